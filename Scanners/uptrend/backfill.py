@@ -0,0 +1,207 @@
+# LIBRARIES ***************************************************************************************
+from ib_insync import *  # For connecting to Interactive Brokers TWS API
+import asyncio  # For running many chunk requests concurrently
+import datetime as dt  # For the chunk end dates
+import os  # For building paths relative to this folder
+import pandas as pd  # For merging the chunks
+from tqdm import tqdm  # For progress bar tracking
+from fetch_engine import PacingLimiter, DEFAULT_CONCURRENCY, DEFAULT_MAX_REQUESTS, CACHE_FLUSH_EVERY  # Pacing
+from contract_cache import qualify_contracts_async  # For cached, batched contract qualification
+from bar_cache import BarCache, MARKET_TZ  # The local store the backfill writes to
+from checkpoint import ScanCheckpoint  # For resuming an interrupted backfill
+from routing import make_routed_contract  # For exchange-aware contracts from the routing table
+from stage_table import read_stock_table  # For the stock list
+from universe import universe_path  # For the Feather universe
+from ib_pool import IBPool  # For spreading the requests over several IB connections
+from bar_arrays import bars_to_frame  # For converting bars without util.df's per-bar tuples
+
+# PATHS *******************************************************************************************
+HERE = os.path.dirname(os.path.abspath(__file__))
+UNIVERSE_FILE = universe_path()  # merged_stocks.feather (or .csv if merge.py has not written it)
+
+# BACKFILL SETTINGS *******************************************************************************
+# Client IDs of the backfill's connection pool (the fused scan uses 11-14, the pipeline 21-24)
+CLIENT_IDS = (31, 32, 33, 34)
+# Years of daily history to seed when the script is run
+BACKFILL_YEARS = 5
+# Calendar days one request covers for each bar size, within IB's maximum duration per bar size
+# (1 year of daily bars, a month of hourly bars, a week of 5-minute bars, a day of 1-minute bars)
+CHUNK_DAYS = {
+    '1 day': 365,
+    '1 hour': 30,
+    '30 mins': 30,
+    '15 mins': 10,
+    '5 mins': 7,
+    '1 min': 1,
+}
+# Chunks are periods of CHUNK_DAYS counted from this date, so a chunk keeps its dates (and its
+# checkpoint record) whatever range a backfill asks for and on whichever day it runs
+CHUNK_EPOCH = dt.date(2000, 1, 1)
+
+
+# CHUNKS ******************************************************************************************
+def chunk_ends(start, end, bar_size):
+    """
+    Split a date range into IB-legal requests, newest first.
+    The requests cover whole periods of the CHUNK_EPOCH grid that overlap the range (the oldest one
+    can reach back before start), except the newest, which stops at end.
+    Args:
+        start (datetime.date): First date to cover
+        end (datetime.date): Last date to cover
+        bar_size (str): IB bar size setting, a key of CHUNK_DAYS
+    Returns:
+        list: (end date, durationStr) of every request
+    Raises:
+        ValueError: If the bar size has no known maximum duration
+    """
+    if bar_size not in CHUNK_DAYS:
+        raise ValueError(f"No chunk size for bar size '{bar_size}' (known: {', '.join(CHUNK_DAYS)})")
+    days = CHUNK_DAYS[bar_size]
+    chunks = []
+    if start > end:
+        return chunks
+    first = (start - CHUNK_EPOCH).days // days
+    last = (end - CHUNK_EPOCH).days // days
+    for period in range(last, first - 1, -1):
+        period_start = CHUNK_EPOCH + dt.timedelta(days=period * days)
+        chunk_end = min(period_start + dt.timedelta(days=days - 1), end)
+        chunks.append((chunk_end, f'{(chunk_end - period_start).days + 1} D'))
+    return chunks
+
+
+# BACKFILL ENGINE *********************************************************************************
+async def backfill_async(ib, symbols, start, end=None, bar_size='1 day', what_to_show='TRADES', use_rth=True,
+                         make_contract=make_routed_contract, cache=None, concurrency=None, limiter=None,
+                         resume=True, desc="Backfilling bars"):
+    """
+    Download a long history for many symbols in IB-sized chunks and merge it into the bar cache.
+    Every finished chunk is written to the cache and to a checkpoint right away, so an interrupted
+    backfill only repeats the chunks that were in flight, also when it is resumed on a later day:
+    the chunks lie on a fixed calendar grid (see chunk_ends), so only the newest, still growing one
+    changes from day to day. Chunks that fail with an exception are not checkpointed and are retried
+    on the next run.
+    Args:
+        ib (IB): Connected IB instance or IBPool
+        symbols (list): Ticker symbols to backfill
+        start (datetime.date): Oldest date to cover
+        end (datetime.date): Newest date to cover (default: today in New York)
+        bar_size (str): IB bar size setting, a key of CHUNK_DAYS (default: '1 day')
+        what_to_show (str): IB data type (default: 'TRADES')
+        use_rth (bool): Regular trading hours only (default: True)
+        make_contract (callable): Builds an unqualified contract from a symbol
+        cache (BarCache): Store the bars are merged into (default: the shared bar cache)
+        concurrency (int): Maximum number of chunk requests in flight (default: DEFAULT_CONCURRENCY
+            per connection)
+        limiter (PacingLimiter): Shared pacing limiter (default: a new one sized for the connections)
+        resume (bool): Skip the chunks an earlier backfill with the same bar settings finished
+            (default: True)
+        desc (str): Progress bar description (None to disable the bar)
+    Returns:
+        dict: Bars stored per symbol by this run (None for symbols IB does not know)
+    """
+    end = end or dt.datetime.now(MARKET_TZ).date()
+    connections = getattr(ib, 'size', 1)
+    concurrency = concurrency or DEFAULT_CONCURRENCY * connections
+    limiter = limiter or PacingLimiter(DEFAULT_MAX_REQUESTS * connections)
+    cache = cache or BarCache()
+    key = (bar_size, what_to_show, use_rth)
+    chunks = chunk_ends(start, end, bar_size)
+
+    # One checkpoint per bar setting, whatever the range and the day; chunks are recorded as
+    # "<symbol>|<chunk end>", and a chunk's end only moves while it is the newest one
+    name = f"backfill_{bar_size.replace(' ', '')}_{what_to_show}_{'rth' if use_rth else 'all'}"
+    checkpoint = ScanCheckpoint(name, params={'bar_size': bar_size, 'what_to_show': what_to_show,
+                                              'use_rth': use_rth},
+                                as_of=CHUNK_EPOCH, resume=resume)
+    if len(checkpoint):
+        print(f"Resuming: {len(checkpoint)} chunks already downloaded")
+
+    # A pool backs off each member on its own pacing errors (see fetch_histories_async)
+    backoff = not getattr(ib, 'paces_members', False)
+    if backoff:
+        ib.errorEvent += limiter.on_error
+    try:
+        jobs = [(symbol, chunk_end, duration) for symbol in symbols for chunk_end, duration in chunks
+                if f'{symbol}|{chunk_end}' not in checkpoint]
+        contracts = await qualify_contracts_async(
+            ib, {symbol: make_contract(symbol) for symbol in dict.fromkeys(symbol for symbol, _, _ in jobs)},
+            limiter=limiter)
+        stored = {symbol: 0 for symbol in symbols}
+        semaphore = asyncio.Semaphore(concurrency)
+        progress = tqdm(total=len(jobs), desc=desc, disable=desc is None)
+        finished = 0
+
+        async def fetch_chunk(symbol, chunk_end, duration):
+            nonlocal finished
+            contract = contracts[symbol]
+            if contract is None:
+                # IB does not know the symbol; not worth asking again for this backfill
+                stored[symbol] = None
+                checkpoint.record(f'{symbol}|{chunk_end}', {'bars': None})
+                return
+            async with semaphore:
+                try:
+                    await limiter.wait()
+                    bars = await ib.reqHistoricalDataAsync(
+                        contract,
+                        endDateTime=chunk_end,
+                        durationStr=duration,
+                        barSizeSetting=bar_size,
+                        whatToShow=what_to_show,
+                        useRTH=use_rth,
+                        formatDate=1,
+                        keepUpToDate=False
+                    )
+                except Exception as e:
+                    print(f"✗ {symbol} ({chunk_end}): Error - {str(e)[:50]}...")
+                    return
+                finally:
+                    progress.update(1)
+            # The oldest chunk can reach past the start date; its bars are kept, so the chunk is
+            # complete for any later backfill that starts earlier
+            new = bars_to_frame(bars)
+            if new is not None and len(new):
+                # Merge into the symbol's cached history (no await in between, so chunks of the same
+                # symbol finishing together cannot overwrite each other)
+                cached, entry = cache.load(symbol, key)
+                dates = new['date'] if cached is None else pd.Index(cached['date']).union(new['date'])
+                cache.store(symbol, key, new, len(dates), cached, entry)
+                stored[symbol] += len(new)
+                finished += 1
+                if finished % CACHE_FLUSH_EVERY == 0:
+                    cache.flush()
+            checkpoint.record(f'{symbol}|{chunk_end}', {'bars': 0 if new is None else len(new)})
+
+        try:
+            await asyncio.gather(*(fetch_chunk(*job) for job in jobs))
+        finally:
+            progress.close()
+    finally:
+        if backoff:
+            ib.errorEvent -= limiter.on_error
+        checkpoint.close()
+        cache.flush()
+    return stored
+
+
+def backfill(ib, symbols, start, **kwargs):
+    """
+    Blocking wrapper around backfill_async.
+    """
+    return ib.run(backfill_async(ib, list(symbols), start, **kwargs))
+
+
+# MAIN SCRIPT ************************************************************************************
+if __name__ == "__main__":
+    # Seed the bar cache with BACKFILL_YEARS of daily bars for the whole universe
+    symbols = read_stock_table(UNIVERSE_FILE)['Symbol']
+    start = dt.date.today() - dt.timedelta(days=365 * BACKFILL_YEARS)
+    ib = IBPool('127.0.0.1', 7497, client_ids=CLIENT_IDS)
+    try:
+        ib.connect()
+        ib.errorEvent += lambda reqId, errorCode, errorString, contract: None
+        stored = backfill(ib, symbols, start)
+        known = [bars for bars in stored.values() if bars is not None]
+        print(f"Stored {sum(known):,} bars for {len(known)} symbols since {start}")
+    finally:
+        ib.disconnect()
@@ -0,0 +1,137 @@
+# LIBRARIES ***************************************************************************************
+import os  # For building paths relative to this folder
+import time  # For timing the backtest
+import numpy as np  # For the symbols x dates signal and return matrices
+import pandas as pd  # For the survivor list and the statistics table
+from bar_cache import BarCache  # For the locally stored daily bars
+from filter_chain import DEFAULT_CHAIN, evaluate_chain_history  # For the point-in-time signals
+from indicators import build_block  # For aligning the histories on one date axis
+from stage_table import read_stock_table  # For the universe
+from universe import universe_path  # For the Feather universe
+
+# PATHS *******************************************************************************************
+HERE = os.path.dirname(os.path.abspath(__file__))
+UNIVERSE_FILE = universe_path()  # merged_stocks.feather (or .csv if merge.py has not written it)
+OUTPUT_CSV = os.path.join(HERE, 'backtest_signals.csv')
+
+# BACKTEST SETTINGS *******************************************************************************
+# Forward returns reported for the survivors, in sessions (next day, a week, a month)
+HORIZONS = (1, 5, 20)
+# Cache key of the daily bars written by backfill.py and the scans
+BAR_KEY = ('1 day', 'TRADES', True)
+
+
+# FORWARD RETURNS *********************************************************************************
+def forward_returns(block, horizon):
+    """
+    Return from each session's close to the close `horizon` sessions later, for every symbol at once.
+    Args:
+        block (BarBlock): Aligned bars
+        horizon (int): Sessions ahead
+    Returns:
+        np.ndarray: (symbols, days) returns, NaN where either close is missing or lies past the block
+    """
+    returns = np.full(block.close.shape, np.nan)
+    if horizon < block.close.shape[1]:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            returns[:, :-horizon] = block.close[:, horizon:] / block.close[:, :-horizon] - 1
+    return returns
+
+
+def forward_return_stats(block, signals, horizons=HORIZONS, sessions=None):
+    """
+    Forward-return statistics of the symbol-sessions that passed the chain, next to the same
+    statistics over every symbol-session of the block as the baseline.
+    Args:
+        block (BarBlock): Aligned bars
+        signals (np.ndarray): (symbols, days) boolean signal matrix
+        horizons (tuple): Sessions ahead to report
+        sessions (np.ndarray): Boolean mask of the sessions the baseline covers (default: all)
+    Returns:
+        pd.DataFrame: One row per horizon with the number of signals, their mean and median return,
+            the share that went up, the mean of each session's equal-weighted survivors, and the
+            baseline mean with the excess over it
+    """
+    rows = []
+    for horizon in horizons:
+        returns = forward_returns(block, horizon)
+        known = ~np.isnan(returns)
+        if sessions is not None:
+            known &= sessions
+        picked = signals & known
+        survivors = returns[picked]
+        # Equal weight per session, so a few crowded sessions do not dominate the average
+        per_session = picked.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            session_means = np.where(picked, returns, 0.0).sum(axis=0) / per_session
+        baseline = returns[known].mean() if known.any() else np.nan
+        mean = survivors.mean() if len(survivors) else np.nan
+        rows.append({
+            'horizon': horizon,
+            'signals': int(picked.sum()),
+            'sessions': int((per_session > 0).sum()),
+            'mean_return': mean,
+            'median_return': np.median(survivors) if len(survivors) else np.nan,
+            'hit_rate': (survivors > 0).mean() if len(survivors) else np.nan,
+            'session_mean_return': np.nanmean(session_means) if (per_session > 0).any() else np.nan,
+            'baseline_mean_return': baseline,
+            'excess_return': mean - baseline,
+        })
+    return pd.DataFrame(rows)
+
+
+# HISTORICAL SCAN *********************************************************************************
+def run_backtest(csv_file=UNIVERSE_FILE, chain=None, start=None, end=None, horizons=HORIZONS, cache=None):
+    """
+    Replay the scanner over the cached daily history: evaluate the chain point in time for every
+    symbol on every session in one vectorized pass and measure what the survivors did afterwards.
+    Only bars already in the bar cache are used (see backfill.py), and the symbols are those of the
+    current universe, so delisted names are missing and the results carry survivorship bias.
+    Args:
+        csv_file (str): Stock list whose symbols are replayed
+        chain (list): (filter name, params dict) pairs (default: filter_chain.DEFAULT_CHAIN)
+        start (str): First session that can signal, e.g. '2020-01-01' (earlier bars still warm up
+            the indicators; default: the first cached session)
+        end (str): Last session that can signal (default: the last cached session)
+        horizons (tuple): Sessions ahead to report
+        cache (BarCache): Bar cache (default: the shared one)
+    Returns:
+        tuple: (DataFrame of survivors with 'date', 'Symbol' and one 'return_<h>d' column per horizon,
+                DataFrame of forward-return statistics per horizon)
+    """
+    chain = chain or DEFAULT_CHAIN
+    cache = cache or BarCache()
+    histories = {}
+    for symbol in read_stock_table(csv_file)['Symbol'].drop_duplicates():
+        bars, entry = cache.load(symbol, BAR_KEY)
+        histories[symbol] = bars
+    block = build_block(histories)
+    print(f"Loaded {int(block.mask.sum()):,} bars of {len(block.symbols)} symbols over {len(block.dates)} sessions")
+
+    signals, _ = evaluate_chain_history(block, chain)
+    # Sessions outside the range cannot signal, but their bars still feed the indicators
+    in_range = np.ones(len(block.dates), dtype=bool)
+    if start is not None:
+        in_range &= block.dates >= np.datetime64(start, 'D')
+    if end is not None:
+        in_range &= block.dates <= np.datetime64(end, 'D')
+    signals &= in_range
+
+    rows, columns = np.nonzero(signals)
+    survivors = pd.DataFrame({'date': block.dates[columns], 'Symbol': np.asarray(block.symbols, dtype=object)[rows]})
+    for horizon in horizons:
+        survivors[f'return_{horizon}d'] = forward_returns(block, horizon)[rows, columns]
+    survivors = survivors.sort_values(['date', 'Symbol'], ignore_index=True)
+    return survivors, forward_return_stats(block, signals, horizons, sessions=in_range)
+
+
+# MAIN SCRIPT ************************************************************************************
+if __name__ == "__main__":
+    # Replay the default chain over everything in the bar cache
+    began = time.perf_counter()
+    survivors, stats = run_backtest()
+    print(f"{len(survivors):,} signals on {survivors['date'].nunique()} sessions "
+          f"in {time.perf_counter() - began:.1f}s")
+    print(stats.to_string(index=False))
+    survivors.to_csv(OUTPUT_CSV, index=False)
+    print(f"Saved to '{OUTPUT_CSV}'")
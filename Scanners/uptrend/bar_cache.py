@@ -0,0 +1,184 @@
+# LIBRARIES ***************************************************************************************
+import datetime as dt  # For working out which sessions are missing from the cache
+import json  # For the per-bucket cache index
+import os  # For building cache file paths
+import numpy as np  # For counting business days between sessions
+import pandas as pd  # For reading, merging and writing cached bars
+from zoneinfo import ZoneInfo  # For US market hours regardless of the local timezone
+
+# CACHE SETTINGS **********************************************************************************
+# Every cache lives under one folder (set UPTREND_CACHE_DIR to move them all, e.g. for benchmarks)
+CACHE_ROOT = os.environ.get('UPTREND_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
+# Cached bars live next to the scanners unless another folder is given
+CACHE_DIR = os.path.join(CACHE_ROOT, 'bars')
+# US equity session times, used to decide whether the newest cached bar is complete
+MARKET_TZ = ZoneInfo('America/New_York')
+MARKET_OPEN = dt.time(9, 30)
+MARKET_CLOSE = dt.time(16, 0)
+
+
+# SESSION HELPERS *********************************************************************************
+def latest_session(now=None):
+    """
+    Date of the most recent session that has started (weekends skipped, holidays not known).
+    Args:
+        now (datetime): Current time (default: now in New York)
+    Returns:
+        datetime.date: Date whose bar should be the last one in an up-to-date history
+    """
+    now = now or dt.datetime.now(MARKET_TZ)
+    day = now.date()
+    if not np.is_busday(day) or now.time() < MARKET_OPEN:
+        # Roll weekends forward to Monday, then step back one business day
+        day = np.busday_offset(day, -1, roll='forward').astype(dt.date)
+    return day
+
+
+def session_closed_before(day, timestamp):
+    """
+    Check whether a fetch made at timestamp happened after the session on day had closed.
+    Args:
+        day (datetime.date): Session date of a cached bar
+        timestamp (datetime): Time the bar was fetched (timezone aware)
+    Returns:
+        bool: True if the bar for day was already final when it was fetched
+    """
+    return timestamp >= dt.datetime.combine(day, MARKET_CLOSE, tzinfo=MARKET_TZ)
+
+
+# BAR CACHE ***************************************************************************************
+class BarCache:
+    """
+    On-disk store of historical bars, one CSV per symbol, bucketed by (barSize, whatToShow, useRTH).
+    Each bucket keeps an index.json with the longest window fetched and the time of the last update
+    for every symbol, so a rerun only has to request the sessions that are missing.
+    """
+
+    def __init__(self, root=CACHE_DIR):
+        self.root = root
+        # Loaded bucket indexes, keyed by bucket folder
+        self._indexes = {}
+
+    def _bucket(self, key):
+        bar_size, what_to_show, use_rth = key
+        name = f"{bar_size.replace(' ', '')}_{what_to_show}_{'rth' if use_rth else 'all'}"
+        return os.path.join(self.root, name)
+
+    def _index(self, bucket):
+        if bucket not in self._indexes:
+            path = os.path.join(bucket, 'index.json')
+            if os.path.exists(path):
+                with open(path) as f:
+                    self._indexes[bucket] = json.load(f)
+            else:
+                self._indexes[bucket] = {}
+        return self._indexes[bucket]
+
+    def _path(self, bucket, symbol):
+        # Symbols such as BRK/A are not valid file names
+        return os.path.join(bucket, symbol.replace('/', '_') + '.csv')
+
+    def load(self, symbol, key):
+        """
+        Read the cached bars for a symbol.
+        Args:
+            symbol (str): Ticker symbol
+            key (tuple): (barSize, whatToShow, useRTH) of the request
+        Returns:
+            tuple: (DataFrame of bars or None, index entry dict or None)
+        """
+        bucket = self._bucket(key)
+        path = self._path(bucket, symbol)
+        entry = self._index(bucket).get(symbol)
+        if entry is None or not os.path.exists(path):
+            return None, None
+        bars = pd.read_csv(path)
+        bars['date'] = pd.to_datetime(bars['date'])
+        if key[0] == '1 day':
+            # Daily bars come back from IB as plain dates
+            bars['date'] = bars['date'].dt.date
+        return bars, entry
+
+    def store(self, symbol, key, bars, days, cached=None, entry=None):
+        """
+        Merge newly downloaded bars into the cache and return the merged history.
+        Args:
+            symbol (str): Ticker symbol
+            key (tuple): (barSize, whatToShow, useRTH) of the request
+            bars (pd.DataFrame): Bars just received from IB (util.df format)
+            days (int): Window that was asked for by the caller
+            cached (pd.DataFrame): Bars previously returned by load (or None)
+            entry (dict): Index entry previously returned by load (or None)
+        Returns:
+            pd.DataFrame: Cached and new bars combined, oldest first
+        """
+        bucket = self._bucket(key)
+        if cached is not None:
+            # New bars win over cached ones, since the last cached bar may have been partial
+            bars = pd.concat([cached, bars], ignore_index=True)
+            bars = bars.drop_duplicates(subset='date', keep='last').sort_values('date', ignore_index=True)
+        os.makedirs(bucket, exist_ok=True)
+        bars.to_csv(self._path(bucket, symbol), index=False)
+        self._index(bucket)[symbol] = {
+            'days': max(days, entry['days'] if entry else 0),
+            'updated': dt.datetime.now(MARKET_TZ).isoformat(),
+        }
+        return bars
+
+    def missing_days(self, bars, entry, days, now=None):
+        """
+        Work out how much history still has to be requested for a cached symbol.
+        Args:
+            bars (pd.DataFrame): Cached bars (or None)
+            entry (dict): Cache index entry (or None)
+            days (int): Window the caller needs
+            now (datetime): Current time (default: now in New York)
+        Returns:
+            int: Days to request from IB (0 when the cache is already up to date)
+        """
+        # Nothing cached, or only a shorter window than needed: fetch the full window
+        if bars is None or entry['days'] < days:
+            return days
+        last_date = pd.Timestamp(bars['date'].iloc[-1]).date()
+        session = latest_session(now)
+        updated = dt.datetime.fromisoformat(entry['updated'])
+        # The newest session is cached and its bar was complete when it was fetched
+        if last_date >= session and session_closed_before(last_date, updated):
+            return 0
+        # Re-request the last cached session (it may have been partial) plus every session after it
+        return max(int(np.busday_count(last_date, session)), 0) + 1
+
+    def invalidate(self, symbols):
+        """
+        Drop the cached bars of some symbols from every bucket, e.g. after a split or a delisting.
+        Args:
+            symbols (iterable): Ticker symbols
+        Returns:
+            int: Number of cached histories removed
+        """
+        symbols = set(symbols)
+        removed = 0
+        if not os.path.isdir(self.root):
+            return removed
+        for name in os.listdir(self.root):
+            bucket = os.path.join(self.root, name)
+            if not os.path.isdir(bucket):
+                continue
+            index = self._index(bucket)
+            for symbol in symbols.intersection(index):
+                del index[symbol]
+                path = self._path(bucket, symbol)
+                if os.path.exists(path):
+                    os.remove(path)
+                removed += 1
+        self.flush()
+        return removed
+
+    def flush(self):
+        """
+        Write every loaded bucket index back to disk (call once at the end of a scan).
+        """
+        for bucket, index in self._indexes.items():
+            os.makedirs(bucket, exist_ok=True)
+            with open(os.path.join(bucket, 'index.json'), 'w') as f:
+                json.dump(index, f)
@@ -0,0 +1,211 @@
+# LIBRARIES ***************************************************************************************
+import contextlib  # For silencing the scanners' per-symbol output
+import importlib  # For loading the scanner modules
+import importlib.util  # For loading 1_filter_volume.py, whose name is not a valid module name
+import inspect  # For telling pooled scanners (ib_factory argument) from single-connection ones
+import io  # For the silenced output
+import json  # For saving results and reading the baseline
+import os  # For paths and the benchmark cache folder
+import shutil  # For clearing the benchmark caches between runs
+import tempfile  # For the throwaway cache folder
+import time  # For wall-clock timing
+import numpy as np  # For the latency percentiles and the synthetic universe
+import pandas as pd  # For the synthetic universe and the results table
+
+# Every cache the scanners use goes to a throwaway folder (must be set before they are imported)
+BENCH_CACHE = tempfile.mkdtemp(prefix='uptrend_benchmark_')
+os.environ['UPTREND_CACHE_DIR'] = BENCH_CACHE
+
+from fake_ib import FakeTWS, FakeIB  # Local TWS stand-in with latency and pacing rules
+from bar_cache import BarCache  # For serving recorded bars
+
+# PATHS *******************************************************************************************
+HERE = os.path.dirname(os.path.abspath(__file__))
+VOLUME_SCRIPT = os.path.join(HERE, '..', '..', 'scanners', 'uptrend', '1_filter_volume.py')
+RESULTS_JSON = os.path.join(HERE, 'benchmark_results.json')  # Git-ignored, rewritten by every run
+# Results of an earlier run to check for regressions against (skipped if the file does not exist)
+BASELINE_JSON = os.path.join(HERE, 'benchmark_baseline.json')
+
+# BENCHMARK SETTINGS ******************************************************************************
+# Scanner name -> (module name or script path, function)
+SCANNERS = {
+    'avg_volume': (VOLUME_SCRIPT, 'filter_by_avg_volume'),
+    'relative_volume': ('filter_relative_volume', 'filter_by_relative_volume'),
+    'atr': ('filter_atr', 'filter_by_atr'),
+    'price_above_20sma': ('filter_price_above_20sma', 'filter_by_price_above_20sma'),
+    '50sma_below_20sma': ('filter_50sma_below_20sma', 'filter_by_50sma_below_20sma'),
+    '200sma_below_50sma': ('filter_200sma_below_50sma', 'filter_by_200sma_below_50sma'),
+    'fused': ('main', 'run_uptrend_scan'),
+}
+# Synthetic universe size and the share of symbols IB does not know
+UNIVERSE_SIZE = 1000
+INVALID_FRACTION = 0.1
+# Fake TWS behaviour: round trip per request, random extra delay and TWS's pacing rules
+FAKE_TWS_SETTINGS = {'latency': 0.05, 'jitter': 0.05, 'max_messages_per_second': 50, 'max_open_historical': 50}
+# A scanner regresses when its symbols/sec drops more than this fraction below the baseline
+REGRESSION_TOLERANCE = 0.2
+
+
+# UNIVERSE ****************************************************************************************
+def make_universe(path, size=UNIVERSE_SIZE, invalid_fraction=INVALID_FRACTION, seed=0):
+    """
+    Write a synthetic stock list in the merged_stocks.csv layout.
+    Args:
+        path (str): CSV path to write
+        size (int): Number of symbols
+        invalid_fraction (float): Share of symbols the fake TWS will reject as invalid
+        seed (int): Random seed
+    Returns:
+        set: The invalid symbols, for FakeTWS(invalid_symbols=...)
+    """
+    rng = np.random.default_rng(seed)
+    symbols = [f'SYM{i:05d}' for i in range(size)]
+    pd.DataFrame({
+        'No.': np.arange(1, size + 1),
+        'Symbol': symbols,
+        'Company Name': [f'{symbol} Inc.' for symbol in symbols],
+        'Market Cap': rng.uniform(1e8, 1e12, size),
+        'Stock Price': rng.uniform(1, 500, size),
+        '% Change': [f'{change:.2f}%' for change in rng.normal(0, 2, size)],
+        'Revenue': rng.uniform(1e7, 1e11, size),
+        'Exchange': 'NYSE',
+    }).to_csv(path, index=False)
+    return set(rng.choice(symbols, int(size * invalid_fraction), replace=False))
+
+
+# BENCHMARK RUN ***********************************************************************************
+def load_scanner(source, function):
+    """
+    Import a scanner module (by module name or script path) and return it with its filter function.
+    """
+    if source.endswith('.py'):
+        spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(source))[0], source)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(source)
+    return module, getattr(module, function)
+
+
+def run_scanner(name, universe_csv, tws, clear_cache=True):
+    """
+    Run one scanner against a fake TWS and measure it.
+    Args:
+        name (str): Key of SCANNERS
+        universe_csv (str): Stock list to scan
+        tws (FakeTWS): Fake TWS to serve the requests
+        clear_cache (bool): Start with empty bar/contract/negative caches (False measures a warm rerun)
+    Returns:
+        dict: Symbols, seconds, symbols/sec, p50/p99 per-symbol latency, requests and pacing violations
+    """
+    if clear_cache:
+        shutil.rmtree(BENCH_CACHE, ignore_errors=True)
+        os.makedirs(BENCH_CACHE, exist_ok=True)
+    module, scan = load_scanner(*SCANNERS[name])
+    make_ib = lambda: FakeIB(tws)
+    kwargs = {}
+    if 'ib_factory' in inspect.signature(scan).parameters:
+        # Pooled scanners build their own connections
+        kwargs['ib_factory'] = make_ib
+    else:
+        # Single-connection scanners call IB() from the module namespace
+        module.IB = make_ib
+    symbols = len(pd.read_csv(universe_csv))
+
+    # The scanners print a line per symbol; keep the benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        start = time.perf_counter()
+        passed = scan(universe_csv, **kwargs)
+        seconds = time.perf_counter() - start
+
+    latencies = tws.symbol_latencies()
+    return {
+        'scanner': name,
+        'symbols': symbols,
+        'passed': len(passed),
+        'seconds': round(seconds, 3),
+        'symbols_per_sec': round(symbols / seconds, 1),
+        'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 1) if len(latencies) else None,
+        'p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 1) if len(latencies) else None,
+        'requests': sum(tws.requests.values()),
+        'historical_requests': tws.requests['historical'],
+        'pacing_violations': tws.violations,
+    }
+
+
+def run_benchmark(scanners=tuple(SCANNERS), size=UNIVERSE_SIZE, tws_settings=None, recorded_dir=None,
+                  warm=True):
+    """
+    Benchmark every scanner on the same synthetic universe, each with a fresh fake TWS.
+    Args:
+        scanners (iterable): Keys of SCANNERS to run
+        size (int): Synthetic universe size
+        tws_settings (dict): FakeTWS keyword arguments (default: FAKE_TWS_SETTINGS)
+        recorded_dir (str): BarCache folder with recorded daily bars to serve (default: synthetic bars)
+        warm (bool): Also measure a second run of each scanner on the caches the first run filled
+    Returns:
+        pd.DataFrame: One row of measurements per scanner and run
+    """
+    tws_settings = tws_settings or FAKE_TWS_SETTINGS
+    recorded = BarCache(recorded_dir) if recorded_dir else None
+    universe_csv = os.path.join(BENCH_CACHE, '..', os.path.basename(BENCH_CACHE) + '_universe.csv')
+    invalid = make_universe(universe_csv, size)
+    rows = []
+    try:
+        for name in scanners:
+            runs = [('cold', True), ('warm', False)] if warm else [('cold', True)]
+            for run, clear_cache in runs:
+                tws = FakeTWS(invalid_symbols=invalid, recorded=recorded, **tws_settings)
+                row = run_scanner(name, universe_csv, tws, clear_cache)
+                row['run'] = run
+                rows.append(row)
+                print(f"{name} ({run}): {row['symbols_per_sec']} symbols/sec, "
+                      f"{row['requests']} requests, {row['pacing_violations']} pacing violations")
+    finally:
+        os.remove(universe_csv)
+        shutil.rmtree(BENCH_CACHE, ignore_errors=True)
+    return pd.DataFrame(rows)
+
+
+# REGRESSION CHECK ********************************************************************************
+def find_regressions(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Compare a benchmark to a baseline run.
+    Args:
+        results (pd.DataFrame): Output of run_benchmark
+        baseline (pd.DataFrame): Earlier output of run_benchmark
+        tolerance (float): Allowed drop in symbols/sec as a fraction of the baseline
+    Returns:
+        list: Description of every scanner/run that got slower or started breaking pacing rules
+    """
+    merged = results.merge(baseline, on=['scanner', 'run'], suffixes=('', '_baseline'))
+    regressions = []
+    for row in merged.itertuples():
+        if row.symbols_per_sec < row.symbols_per_sec_baseline * (1 - tolerance):
+            regressions.append(f"{row.scanner} ({row.run}): {row.symbols_per_sec} symbols/sec, "
+                               f"baseline {row.symbols_per_sec_baseline}")
+        if row.pacing_violations > row.pacing_violations_baseline:
+            regressions.append(f"{row.scanner} ({row.run}): {row.pacing_violations} pacing violations, "
+                               f"baseline {row.pacing_violations_baseline}")
+    return regressions
+
+
+# MAIN SCRIPT ************************************************************************************
+if __name__ == "__main__":
+    # Benchmark every scanner against the fake TWS
+    results = run_benchmark()
+    print()
+    print(results.to_string(index=False))
+
+    # Save the results (copy them to benchmark_baseline.json to make them the new baseline)
+    results.to_json(RESULTS_JSON, orient='records', indent=1)
+    print(f"Saved to '{RESULTS_JSON}'")
+
+    # Check for regressions against the baseline, if there is one
+    if os.path.exists(BASELINE_JSON):
+        regressions = find_regressions(results, pd.read_json(BASELINE_JSON))
+        for regression in regressions:
+            print(f"✗ Regression: {regression}")
+        if regressions:
+            raise SystemExit(1)
+        print("✓ No regressions against the baseline")
@@ -0,0 +1,136 @@
+# LIBRARIES ***************************************************************************************
+import datetime as dt  # For the as-of date of a scan
+import json  # For the JSON Lines checkpoint file
+import os  # For building the checkpoint path
+
+# CHECKPOINT SETTINGS *****************************************************************************
+# Every cache lives under one folder (set UPTREND_CACHE_DIR to move them all, e.g. for benchmarks)
+CACHE_ROOT = os.environ.get('UPTREND_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
+CHECKPOINT_DIR = os.path.join(CACHE_ROOT, 'checkpoints')
+
+
+# SCAN CHECKPOINT *********************************************************************************
+class ScanCheckpoint:
+    """
+    Durable record of the symbols a scan has already processed, so an interrupted scan can resume.
+    The file is JSON Lines: a header line with the as-of date and the scan parameters, then one
+    {"symbol", "as_of", "result"} line per symbol, flushed as soon as the symbol is done.
+    A checkpoint is only resumed when both the as-of date and the parameters match.
+    """
+
+    def __init__(self, name, params=None, as_of=None, resume=True, root=CHECKPOINT_DIR):
+        """
+        Args:
+            name (str): Scan name (one checkpoint file per scan)
+            params (dict): Scan settings; a checkpoint written with other settings is discarded
+            as_of (datetime.date): Date the results are valid for (default: today)
+            resume (bool): Load the results of an earlier matching run (default: True)
+            root (str): Checkpoint folder
+        """
+        self.path = os.path.join(root, f'{name}.jsonl')
+        self.as_of = (as_of or dt.date.today()).isoformat()
+        # Round-trip the parameters so they compare equal to the ones read back from the file
+        self.params = json.loads(json.dumps(params or {}, sort_keys=True, default=str))
+        # Result dict keyed by symbol
+        self.results = {}
+
+        if resume and os.path.exists(self.path):
+            self._load()
+        os.makedirs(root, exist_ok=True)
+        if self.results:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        else:
+            # Nothing to resume: start a new checkpoint
+            self._file = open(self.path, 'w', encoding='utf-8')
+            self._write({'as_of': self.as_of, 'params': self.params})
+
+    def _load(self):
+        with open(self.path, encoding='utf-8') as f:
+            lines = f.readlines()
+        if not lines:
+            return
+        header = json.loads(lines[0])
+        if header.get('as_of') != self.as_of or header.get('params') != self.params:
+            return
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by a crash
+                continue
+            self.results[record['symbol']] = record['result']
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, default=str) + '\n')
+        self._file.flush()
+
+    def __contains__(self, symbol):
+        return symbol in self.results
+
+    def __len__(self):
+        return len(self.results)
+
+    def record(self, symbol, result):
+        """
+        Save one symbol's result to disk.
+        Args:
+            symbol (str): Ticker symbol
+            result (dict): JSON-serializable result (dates and other values are written as strings)
+        """
+        self.results[symbol] = result
+        self._write({'symbol': symbol, 'as_of': self.as_of, 'result': result})
+
+    def pending(self, symbols):
+        """
+        Symbols that still have to be processed, in the given order.
+        """
+        return [symbol for symbol in symbols if symbol not in self.results]
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# INVALIDATION ************************************************************************************
+def invalidate_checkpoints(symbols, root=CHECKPOINT_DIR):
+    """
+    Remove some symbols' results from every checkpoint, so a resumed scan checks them again.
+    Records keyed "<symbol>|<chunk>" (the backfill's chunks) count as records of the symbol.
+    Args:
+        symbols (iterable): Ticker symbols
+        root (str): Checkpoint folder
+    Returns:
+        int: Number of records removed
+    """
+    symbols = set(symbols)
+    removed = 0
+    if not os.path.isdir(root):
+        return removed
+    for name in os.listdir(root):
+        if not name.endswith('.jsonl'):
+            continue
+        path = os.path.join(root, name)
+        with open(path, encoding='utf-8') as f:
+            lines = f.readlines()
+        kept = lines[:1]
+        for line in lines[1:]:
+            try:
+                symbol = json.loads(line)['symbol']
+            except ValueError:
+                # A line cut short by a crash
+                continue
+            if symbol.split('|', 1)[0] in symbols:
+                removed += 1
+            else:
+                kept.append(line)
+        if len(kept) < len(lines):
+            # Through a temporary file, so a crash keeps the old checkpoint
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                f.writelines(kept)
+            os.replace(path + '.tmp', path)
+    return removed
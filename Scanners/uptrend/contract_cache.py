@@ -0,0 +1,156 @@
+# LIBRARIES ***************************************************************************************
+from ib_insync import *  # For Contract objects and the IB API
+import datetime as dt  # For qualification timestamps and the refresh TTL
+import json  # For the on-disk contract store
+import os  # For building the cache path
+
+# CACHE SETTINGS **********************************************************************************
+# Every cache lives under one folder (set UPTREND_CACHE_DIR to move them all, e.g. for benchmarks)
+CACHE_ROOT = os.environ.get('UPTREND_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
+# Qualified contracts are shared by every scanner and the pairs scripts
+CACHE_PATH = os.path.join(CACHE_ROOT, 'contracts.json')
+# Contract details almost never change, so only re-qualify once a month
+DEFAULT_TTL_DAYS = 30
+# Number of contracts sent to qualifyContractsAsync at once
+DEFAULT_CHUNK_SIZE = 50
+
+
+# CONTRACT CACHE **********************************************************************************
+class ContractCache:
+    """
+    Persistent symbol -> qualified contract store.
+    Entries are keyed by the unqualified contract (symbol, secType, exchange, primaryExchange,
+    currency), so the NYSE-routed and SMART-routed versions of a symbol are kept apart.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl_days=DEFAULT_TTL_DAYS):
+        self.path = path
+        self.ttl = dt.timedelta(days=ttl_days)
+        self._entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self._entries = json.load(f)
+
+    @staticmethod
+    def key(contract):
+        """
+        Cache key for an unqualified contract.
+        """
+        return ':'.join([contract.symbol, contract.secType, contract.exchange,
+                         contract.primaryExchange, contract.currency])
+
+    def get(self, contract):
+        """
+        Look up the qualified version of a contract.
+        Args:
+            contract (Contract): Unqualified contract
+        Returns:
+            Contract: Qualified contract, or None if unknown or older than the TTL
+        """
+        entry = self._entries.get(self.key(contract))
+        if entry is None:
+            return None
+        if dt.datetime.now() - dt.datetime.fromisoformat(entry['qualified']) > self.ttl:
+            return None
+        return Contract.create(**entry['contract'])
+
+    def put(self, unqualified, qualified):
+        """
+        Remember a qualified contract.
+        Args:
+            unqualified (Contract): Contract as built by the scanner (the lookup key)
+            qualified (Contract): Same contract after qualification (has a conId)
+        """
+        self._entries[self.key(unqualified)] = {
+            'contract': util.dataclassNonDefaults(qualified),
+            'qualified': dt.datetime.now().isoformat(),
+        }
+
+    def invalidate(self, symbols):
+        """
+        Forget the qualified contracts of some symbols (every routing), so they are qualified again.
+        Args:
+            symbols (iterable): IB symbols, e.g. 'BRK B' (the symbol part of the cache key)
+        Returns:
+            int: Number of entries removed
+        """
+        symbols = set(symbols)
+        stale = [key for key in self._entries if key.split(':', 1)[0] in symbols]
+        for key in stale:
+            del self._entries[key]
+        return len(stale)
+
+    def save(self):
+        """
+        Write the store to disk.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(self._entries, f)
+
+
+# BATCHED QUALIFICATION ***************************************************************************
+async def qualify_contracts_async(ib, contracts, cache=None, chunk_size=DEFAULT_CHUNK_SIZE, limiter=None,
+                                  persist=True):
+    """
+    Qualify many contracts, answering from the cache where possible and sending the misses to
+    TWS through qualifyContractsAsync in chunks.
+    Args:
+        ib (IB): Connected IB instance
+        contracts (dict): Unqualified contracts keyed by symbol
+        cache (ContractCache): Persistent contract store (default: the shared one)
+        chunk_size (int): Number of misses qualified per qualifyContractsAsync call
+        limiter (PacingLimiter): Pacing limiter shared with the data requests (optional)
+        persist (bool): Save the store after qualifying misses (False when the caller saves it itself)
+    Returns:
+        dict: Qualified contract (or None when IB does not know it) keyed by symbol
+    """
+    cache = cache or ContractCache()
+    qualified = {}
+    misses = []
+    for symbol, contract in contracts.items():
+        hit = cache.get(contract)
+        if hit is not None:
+            qualified[symbol] = hit
+        else:
+            misses.append((symbol, contract))
+
+    if limiter:
+        # A chunk goes out as one burst of requests, which has to fit in the pacing window
+        chunk_size = min(chunk_size, limiter.max_requests)
+    for start in range(0, len(misses), chunk_size):
+        chunk = misses[start:start + chunk_size]
+        if limiter:
+            # Each contract in the chunk is its own contract details request, all sent at once
+            await limiter.wait(len(chunk))
+        # Keep the unqualified copies for the cache keys, since qualification updates in place
+        originals = [Contract.create(**util.dataclassNonDefaults(contract)) for _, contract in chunk]
+        await ib.qualifyContractsAsync(*(contract for _, contract in chunk))
+        for (symbol, contract), original in zip(chunk, originals):
+            if contract.conId:
+                cache.put(original, contract)
+                qualified[symbol] = contract
+            else:
+                qualified[symbol] = None
+
+    if misses and persist:
+        cache.save()
+    return qualified
+
+
+def qualify_contracts(ib, contracts, cache=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Blocking wrapper around qualify_contracts_async, e.g. for the pairs trading scripts.
+    Args:
+        ib (IB): Connected IB instance
+        contracts (list or dict): Unqualified contracts (a list is keyed by each contract's symbol)
+        cache (ContractCache): Persistent contract store (default: the shared one)
+        chunk_size (int): Number of misses qualified per qualifyContractsAsync call
+    Returns:
+        list or dict: Qualified contracts (None when unknown), in the same shape as contracts
+    """
+    if isinstance(contracts, dict):
+        return ib.run(qualify_contracts_async(ib, contracts, cache, chunk_size))
+    keyed = {contract.symbol: contract for contract in contracts}
+    qualified = ib.run(qualify_contracts_async(ib, keyed, cache, chunk_size))
+    return [qualified[contract.symbol] for contract in contracts]
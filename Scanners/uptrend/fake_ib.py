@@ -0,0 +1,259 @@
+# LIBRARIES ***************************************************************************************
+from ib_insync import *  # For the BarData, Ticker and Event types the scanners expect
+import asyncio  # For simulating request latency
+import collections  # For the per-client pacing windows
+import datetime as dt  # For dating the synthetic bars
+import random  # For latency jitter
+import time  # For pacing windows and per-symbol latency
+import zlib  # For a stable per-symbol random seed
+import numpy as np  # For the synthetic random-walk bars
+
+# FAKE TWS SETTINGS *******************************************************************************
+# TWS pacing limits: API messages per second per client, and open historical requests per client
+MAX_MESSAGES_PER_SECOND = 50
+MAX_OPEN_HISTORICAL = 50
+# What TWS sends when a historical request breaks the pacing rules
+PACING_ERROR_CODE = 162
+PACING_ERROR_TEXT = "Historical Market Data Service error message:Historical data request pacing violation"
+
+
+# FAKE TWS ****************************************************************************************
+class FakeTWS:
+    """
+    Local stand-in for a TWS / IB Gateway session, for exercising the scanners without IB.
+    It serves recorded bars from a BarCache folder or synthetic daily bars (a random walk seeded by
+    the symbol, ending today), answers contract qualification, snapshots and market scanners,
+    enforces unique client IDs and the pacing limits like TWS does, and can drop connections to
+    test reconnects. Requests, pacing violations and per-symbol latency are recorded for benchmarks.
+    """
+
+    def __init__(self, invalid_symbols=(), latency=0.0, seed=0, scanner_symbols=(), jitter=0.0, recorded=None,
+                 max_messages_per_second=MAX_MESSAGES_PER_SECOND, max_open_historical=MAX_OPEN_HISTORICAL):
+        """
+        Args:
+            invalid_symbols (iterable): Symbols that fail qualification ("Invalid contract")
+            latency (float): Seconds each request takes
+            seed (int): Base seed for the synthetic bars and the latency jitter
+            scanner_symbols (iterable): Symbols the market scanners rank (IB symbol spelling)
+            jitter (float): Up to this many extra seconds added to each request at random
+            recorded (BarCache): Recorded daily bars served instead of synthetic ones where available
+            max_messages_per_second (int): Pacing limit per client (None to disable)
+            max_open_historical (int): Open historical requests allowed per client (None to disable)
+        """
+        self.invalid_symbols = set(invalid_symbols)
+        self.latency = latency
+        self.jitter = jitter
+        self.seed = seed
+        self.scanner_symbols = list(scanner_symbols)
+        self.recorded = recorded
+        self.max_messages_per_second = max_messages_per_second
+        self.max_open_historical = max_open_historical
+        self._random = random.Random(seed)
+        # Connected FakeIB clients keyed by client ID
+        self.clients = {}
+        # Number of requests served, by request type
+        self.requests = {'qualify': 0, 'historical': 0, 'snapshot': 0, 'scanner': 0}
+        # Requests rejected for breaking the pacing rules
+        self.violations = 0
+        # Per-client message times and open historical requests
+        self._messages = collections.defaultdict(collections.deque)
+        self._open_historical = collections.defaultdict(int)
+        # [first request, last response] time of every symbol that was asked about
+        self.symbol_times = {}
+
+    def bars(self, symbol, days, end=None):
+        """
+        Daily bars for a symbol: recorded ones if available, otherwise synthetic ones that are the
+        same for the same symbol on every call.
+        Args:
+            symbol (str): Ticker symbol
+            days (int): Number of bars, ending at `end`
+            end (datetime.date): Last session of synthetic bars (default: today, or the previous business day)
+        Returns:
+            list: BarData objects, oldest first
+        """
+        if self.recorded is not None:
+            recorded, entry = self.recorded.load(symbol, ('1 day', 'TRADES', True))
+            if recorded is not None:
+                return [BarData(date=row.date, open=row.open, high=row.high, low=row.low, close=row.close,
+                                volume=row.volume)
+                        for row in recorded.tail(days).itertuples()]
+        end = end or dt.date.today()
+        total = 500
+        rng = np.random.default_rng(zlib.crc32(symbol.encode()) + self.seed)
+        close = 20 + np.cumsum(rng.normal(0.05, 1.0, total)).clip(-15, None)
+        spread = rng.uniform(0.2, 2.0, total)
+        volume = rng.integers(100000, 8000000, total)
+        dates = np.busday_offset(end, -np.arange(total)[::-1], roll='backward')
+        return [
+            BarData(date=dates[i].astype(dt.date), open=close[i], high=close[i] + spread[i],
+                    low=close[i] - spread[i], close=close[i], volume=float(volume[i]))
+            for i in range(total - min(days, total), total)
+        ]
+
+    def drop(self, client_id):
+        """
+        Simulate TWS dropping one client's connection.
+        """
+        client = self.clients.pop(client_id, None)
+        if client is not None:
+            client._connected = False
+            client.disconnectedEvent.emit()
+
+    # Request bookkeeping -------------------------------------------------------------------------
+    async def delay(self):
+        """
+        Wait for one request's simulated round trip.
+        """
+        await asyncio.sleep(self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0))
+
+    def admit(self, client_id, messages=1):
+        """
+        Count API messages against a client's one-second pacing window.
+        Returns:
+            bool: False if the messages break the pacing limit
+        """
+        if self.max_messages_per_second is None:
+            return True
+        now = time.monotonic()
+        window = self._messages[client_id]
+        while window and now - window[0] >= 1.0:
+            window.popleft()
+        window.extend([now] * messages)
+        return len(window) <= self.max_messages_per_second
+
+    def started(self, symbol):
+        self.symbol_times.setdefault(symbol, [time.monotonic(), None])
+
+    def finished(self, symbol):
+        self.symbol_times[symbol][1] = time.monotonic()
+
+    def symbol_latencies(self):
+        """
+        Seconds from the first request about each symbol to the last response about it.
+        """
+        return np.array([end - start for start, end in self.symbol_times.values() if end is not None])
+
+
+# FAKE IB CLIENT **********************************************************************************
+class FakeIB:
+    """
+    Drop-in replacement for ib_insync.IB covering the calls the scanners make, served by a FakeTWS.
+    """
+
+    run = staticmethod(util.run)
+
+    def __init__(self, tws):
+        self.tws = tws
+        self.clientId = None
+        self._connected = False
+        self.errorEvent = Event('errorEvent')
+        self.disconnectedEvent = Event('disconnectedEvent')
+
+    # Connection handling -------------------------------------------------------------------------
+    async def connectAsync(self, host='127.0.0.1', port=7497, clientId=1, timeout=4, **kwargs):
+        await self.tws.delay()
+        if clientId in self.tws.clients:
+            # TWS error 326: client id already in use
+            raise ConnectionRefusedError(f"Unable to connect as the client id {clientId} is already in use")
+        self.clientId = clientId
+        self._connected = True
+        self.tws.clients[clientId] = self
+        return self
+
+    def connect(self, host='127.0.0.1', port=7497, clientId=1, timeout=4, **kwargs):
+        return self.run(self.connectAsync(host, port, clientId, timeout))
+
+    def disconnect(self):
+        if self._connected:
+            self.tws.clients.pop(self.clientId, None)
+            self._connected = False
+
+    def isConnected(self):
+        return self._connected
+
+    def _check(self):
+        if not self._connected:
+            raise ConnectionError("Not connected")
+
+    # Requests ------------------------------------------------------------------------------------
+    async def qualifyContractsAsync(self, *contracts):
+        self._check()
+        for contract in contracts:
+            self.tws.started(contract.symbol)
+        self.tws.admit(self.clientId, len(contracts))
+        await self.tws.delay()
+        qualified = []
+        for contract in contracts:
+            self.tws.requests['qualify'] += 1
+            self.tws.finished(contract.symbol)
+            if contract.symbol in self.tws.invalid_symbols:
+                continue
+            contract.conId = zlib.crc32(contract.symbol.encode())
+            qualified.append(contract)
+        return qualified
+
+    async def reqHistoricalDataAsync(self, contract, endDateTime='', durationStr='1 D', barSizeSetting='1 day',
+                                     whatToShow='TRADES', useRTH=True, formatDate=1, keepUpToDate=False,
+                                     chartOptions=[], timeout=60):
+        self._check()
+        tws = self.tws
+        tws.started(contract.symbol)
+        tws.requests['historical'] += 1
+        tws._open_historical[self.clientId] += 1
+        try:
+            paced = tws.admit(self.clientId)
+            too_many = (tws.max_open_historical is not None
+                        and tws._open_historical[self.clientId] > tws.max_open_historical)
+            await tws.delay()
+            if not paced or too_many:
+                # TWS rejects the request with an error message and no bars
+                tws.violations += 1
+                self.errorEvent.emit(-1, PACING_ERROR_CODE, PACING_ERROR_TEXT, contract)
+                return []
+            # Backfills ask for older windows by passing the end date of each chunk
+            end = endDateTime.date() if isinstance(endDateTime, dt.datetime) else endDateTime or None
+            return tws.bars(contract.symbol, int(durationStr.split()[0]), end)
+        finally:
+            tws._open_historical[self.clientId] -= 1
+            tws.finished(contract.symbol)
+
+    async def reqTickersAsync(self, *contracts, regulatorySnapshot=False):
+        self._check()
+        self.tws.admit(self.clientId, len(contracts))
+        await self.tws.delay()
+        tickers = []
+        for contract in contracts:
+            self.tws.requests['snapshot'] += 1
+            last_bar = self.tws.bars(contract.symbol, 1)[-1]
+            tickers.append(Ticker(contract=contract, last=last_bar.close, close=last_bar.close,
+                                  volume=last_bar.volume))
+        return tickers
+
+    async def reqScannerDataAsync(self, subscription, scannerSubscriptionOptions=[],
+                                  scannerSubscriptionFilterOptions=[]):
+        self._check()
+        self.tws.requests['scanner'] += 1
+        self.tws.admit(self.clientId)
+        await self.tws.delay()
+        filters = {tag.tag: float(tag.value) for tag in scannerSubscriptionFilterOptions}
+        rows = []
+        for symbol in self.tws.scanner_symbols:
+            bars = self.tws.bars(symbol, 20)
+            price, volume = bars[-1].close, bars[-1].volume
+            avg_volume = np.mean([bar.volume for bar in bars])
+            # Unset ScannerSubscription fields hold IB's UNSET sentinels
+            if subscription.abovePrice < util.UNSET_DOUBLE and price <= subscription.abovePrice:
+                continue
+            if subscription.belowPrice < util.UNSET_DOUBLE and price >= subscription.belowPrice:
+                continue
+            if subscription.aboveVolume < util.UNSET_INTEGER and volume <= subscription.aboveVolume:
+                continue
+            if avg_volume <= filters.get('avgVolumeAbove', -1):
+                continue
+            rows.append((volume, symbol))
+        rows.sort(reverse=True)
+        limit = subscription.numberOfRows if subscription.numberOfRows > 0 else 50
+        return [ScanData(rank, ContractDetails(contract=Stock(symbol, 'SMART', 'USD', primaryExchange='NYSE')),
+                         '', '', '', '')
+                for rank, (volume, symbol) in enumerate(rows[:limit])]
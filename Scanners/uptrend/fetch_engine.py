@@ -0,0 +1,273 @@
+# LIBRARIES ***************************************************************************************
+from ib_insync import *  # For connecting to Interactive Brokers TWS API
+import asyncio  # For running many historical requests concurrently
+import collections  # For the sliding window of request timestamps
+import time  # For measuring the pacing window
+from tqdm import tqdm  # For progress bar tracking
+from contract_cache import qualify_contracts_async  # For cached, batched contract qualification
+from negative_cache import NegativeCache  # For skipping symbols that keep failing
+from telemetry import Telemetry  # For per-phase and per-symbol timings and request counters
+from bar_arrays import bars_to_frame  # For converting bars without util.df's per-bar tuples
+
+# IB PACING DEFAULTS ******************************************************************************
+# TWS accepts at most 50 open historical requests at once and ~50 API messages per second,
+# so stay a little below both limits by default
+DEFAULT_CONCURRENCY = 40
+DEFAULT_MAX_REQUESTS = 45
+DEFAULT_WINDOW_SECONDS = 1.0
+# How long to pause every request after TWS reports a pacing violation
+PACING_BACKOFF_SECONDS = 10.0
+# Bar cache index is written every this many downloads, so an interrupted scan keeps its bars
+CACHE_FLUSH_EVERY = 250
+# Error codes TWS uses for pacing problems (162 is also used for "no data", so the text is checked too)
+PACING_ERROR_CODES = (162, 366, 420)
+
+
+# PACING LIMITER **********************************************************************************
+class PacingLimiter:
+    """
+    Sliding-window rate limiter that replaces the fixed time.sleep(0.2) between requests.
+    Allows up to max_requests request starts in any window_seconds, and pauses everything
+    for a while after TWS reports a pacing violation.
+    """
+
+    def __init__(self, max_requests=DEFAULT_MAX_REQUESTS, window_seconds=DEFAULT_WINDOW_SECONDS,
+                 backoff_seconds=PACING_BACKOFF_SECONDS):
+        self.max_requests = max_requests
+        self.window_seconds = window_seconds
+        self.backoff_seconds = backoff_seconds
+        # Start times of the most recent requests (oldest first)
+        self._starts = collections.deque()
+        # Monotonic time before which no new request may start (set by a pacing violation)
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self, messages=1):
+        """
+        Wait until another request may be sent without breaking the pacing window.
+        Args:
+            messages (int): Number of API messages the request sends at once (at most max_requests)
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                # Honour a backoff triggered by a pacing violation
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                # Drop request starts that have left the window
+                while self._starts and now - self._starts[0] >= self.window_seconds:
+                    self._starts.popleft()
+                if len(self._starts) + messages <= self.max_requests:
+                    self._starts.extend([now] * messages)
+                    return
+                # Sleep until enough of the oldest requests leave the window
+                oldest_needed = self._starts[len(self._starts) + messages - self.max_requests - 1]
+                await asyncio.sleep(self.window_seconds - (now - oldest_needed))
+
+    def penalize(self, seconds=None):
+        """
+        Pause all new requests after a pacing violation.
+        Args:
+            seconds (float): Length of the pause (default: backoff_seconds)
+        """
+        pause = self.backoff_seconds if seconds is None else seconds
+        self._paused_until = max(self._paused_until, time.monotonic() + pause)
+
+    def on_error(self, reqId, errorCode, errorString, contract):
+        """
+        Handler for ib.errorEvent that backs off when TWS reports a pacing violation.
+        """
+        if errorCode in PACING_ERROR_CODES and 'pacing' in errorString.lower():
+            self.penalize()
+
+
+# CONTRACT HELPERS ********************************************************************************
+def make_stock_contract(symbol):
+    """
+    Build the stock contract the uptrend scanners have always used.
+    Args:
+        symbol (str): Ticker symbol from the stock list
+    Returns:
+        Stock: Unqualified US stock contract routed through SMART
+    """
+    return Stock(symbol, 'SMART', 'USD', primaryExchange='NYSE')
+
+
+# FETCH RESULT ************************************************************************************
+# One entry per requested symbol: hist_data is a DataFrame of bars (or None) and error explains why not
+FetchResult = collections.namedtuple('FetchResult', ['symbol', 'contract', 'hist_data', 'error'])
+
+
+def is_retryable(result):
+    """
+    True when a symbol failed for a transient reason (an exception such as a dropped connection),
+    as opposed to an invalid contract or a symbol without data.
+    """
+    return result.error is not None and result.error.startswith("Error")
+
+
+# ASYNC FETCH ENGINE ******************************************************************************
+async def fetch_histories_async(ib, symbols, days, bar_size='1 day', what_to_show='TRADES', use_rth=True,
+                                make_contract=make_stock_contract, concurrency=None,
+                                limiter=None, cache=None, contract_cache=None, negative_cache=None, on_result=None,
+                                telemetry=None, desc="Fetching bars", persist=True):
+    """
+    Qualify contracts and download historical bars for many symbols with several requests in flight.
+    Args:
+        ib (IB): Connected IB instance or IBPool
+        symbols (list): Ticker symbols to fetch
+        days (int): Number of days of historical data to fetch
+        bar_size (str): IB bar size setting (default: '1 day')
+        what_to_show (str): IB data type (default: 'TRADES')
+        use_rth (bool): Regular trading hours only (default: True)
+        make_contract (callable): Builds an unqualified contract from a symbol
+        concurrency (int): Maximum number of symbols being fetched at the same time
+            (default: DEFAULT_CONCURRENCY per connection)
+        limiter (PacingLimiter): Shared pacing limiter (default: a new one sized for the connections)
+        cache (BarCache): On-disk bar cache; only the missing tail is requested on a hit (default: no cache)
+        contract_cache (ContractCache): Persistent qualified contracts (default: the shared store)
+        negative_cache (NegativeCache): Known invalid / no-data symbols, skipped until their retry time
+            (default: the shared store)
+        on_result (callable): Called with each FetchResult as soon as that symbol is done
+        telemetry (Telemetry): Records phase and per-symbol timings and request counts (optional)
+        desc (str): Progress bar description (None to disable the bar)
+        persist (bool): Write the bar cache index, contract cache and negative cache to disk during and
+            after the call (False when the caller makes many small calls and saves them itself)
+    Returns:
+        dict: FetchResult for every symbol, keyed by symbol, in input order
+    """
+    # TWS paces each client ID separately, so an IBPool gets the headroom of all its connections
+    connections = getattr(ib, 'size', 1)
+    concurrency = concurrency or DEFAULT_CONCURRENCY * connections
+    limiter = limiter or PacingLimiter(DEFAULT_MAX_REQUESTS * connections)
+    negative_cache = negative_cache or NegativeCache()
+    telemetry = telemetry or Telemetry('fetch')
+    key = (bar_size, what_to_show, use_rth)
+    results = {}
+    telemetry.start('cache_lookup')
+
+    # Look up cached bars and work out how many days are still missing for each symbol
+    pending = {}
+    for symbol in symbols:
+        # Symbols that failed for a lasting reason on an earlier run are not requested again yet
+        known_failure = negative_cache.get(make_contract(symbol))
+        if known_failure is not None:
+            results[symbol] = FetchResult(symbol, None, None, known_failure['reason'])
+            telemetry.count('negative_cache_skips')
+            if on_result:
+                on_result(results[symbol])
+            continue
+        cached, entry = cache.load(symbol, key) if cache else (None, None)
+        request_days = cache.missing_days(cached, entry, days) if cache else days
+        if request_days == 0:
+            results[symbol] = FetchResult(symbol, None, cached.tail(days).reset_index(drop=True), None)
+            telemetry.count('bar_cache_hits')
+            if on_result:
+                on_result(results[symbol])
+        else:
+            pending[symbol] = (cached, entry, request_days)
+    telemetry.stop('cache_lookup')
+
+    # Back off automatically whenever TWS complains about pacing (an IBPool backs off only the
+    # member that was told to, so the shared window is not paused for the whole pool)
+    backoff = not getattr(ib, 'paces_members', False)
+    if backoff:
+        ib.errorEvent += limiter.on_error
+    try:
+        # Qualify only the symbols that still need data, from the contract store or in chunks
+        with telemetry.phase('qualify'):
+            contracts = await qualify_contracts_async(
+                ib, {symbol: make_contract(symbol) for symbol in pending}, contract_cache, limiter=limiter,
+                persist=persist)
+
+        semaphore = asyncio.Semaphore(concurrency)
+        progress = tqdm(total=len(pending), desc=desc, disable=desc is None)
+        stored = 0
+
+        async def fetch_one(symbol):
+            nonlocal stored
+            cached, entry, request_days = pending[symbol]
+            contract = contracts[symbol]
+            if contract is None:
+                telemetry.count('invalid_contracts')
+                return FetchResult(symbol, None, None, "Invalid contract")
+            async with semaphore:
+                try:
+                    # Request historical data once the pacing window allows it
+                    with telemetry.timed('pacing_wait', symbol):
+                        await limiter.wait()
+                    telemetry.count('historical_requests')
+                    with telemetry.timed('historical', symbol):
+                        bars = await ib.reqHistoricalDataAsync(
+                            contract,
+                            endDateTime='',
+                            durationStr=f'{request_days} D',
+                            barSizeSetting=bar_size,
+                            whatToShow=what_to_show,
+                            useRTH=use_rth,
+                            formatDate=1,
+                            keepUpToDate=False
+                        )
+                    telemetry.count('historical_responses' if bars else 'empty_responses')
+                    if not bars:
+                        if cached is not None:
+                            # Nothing new since the cached history (e.g. a market holiday)
+                            return FetchResult(symbol, contract, cached.tail(days).reset_index(drop=True), None)
+                        return FetchResult(symbol, contract, None, "No data returned")
+                    with telemetry.timed('conversion', symbol):
+                        hist_data = bars_to_frame(bars)
+                    if cache:
+                        # Merge the new tail into the cached history
+                        with telemetry.timed('cache_store', symbol):
+                            hist_data = cache.store(symbol, key, hist_data, days, cached, entry)
+                        stored += 1
+                        if persist and stored % CACHE_FLUSH_EVERY == 0:
+                            cache.flush()
+                    return FetchResult(symbol, contract, hist_data.tail(days).reset_index(drop=True), None)
+                except Exception as e:
+                    telemetry.count('fetch_exceptions')
+                    return FetchResult(symbol, contract, None, f"Error - {str(e)[:50]}...")
+                finally:
+                    progress.update(1)
+
+        async def fetch_and_report(symbol):
+            result = await fetch_one(symbol)
+            # Remember lasting failures (transient exceptions are ignored) and forget recovered symbols
+            if result.error:
+                negative_cache.record(make_contract(symbol), result.error)
+            else:
+                negative_cache.clear(make_contract(symbol))
+            if on_result:
+                on_result(result)
+            return result
+
+        try:
+            for result in await asyncio.gather(*(fetch_and_report(symbol) for symbol in pending)):
+                results[result.symbol] = result
+        finally:
+            progress.close()
+    finally:
+        if backoff:
+            ib.errorEvent -= limiter.on_error
+        if persist:
+            negative_cache.save()
+            if cache:
+                cache.flush()
+
+    # Keep the caller's symbol order
+    return {symbol: results[symbol] for symbol in symbols if symbol in results}
+
+
+def fetch_histories(ib, symbols, days, **kwargs):
+    """
+    Blocking wrapper around fetch_histories_async for the filter scripts.
+    Args:
+        ib (IB): Connected IB instance
+        symbols (list): Ticker symbols to fetch
+        days (int): Number of days of historical data to fetch
+        **kwargs: Passed through to fetch_histories_async
+    Returns:
+        dict: FetchResult for every symbol, keyed by symbol
+    """
+    return ib.run(fetch_histories_async(ib, list(symbols), days, **kwargs))
@@ -2,11 +2,16 @@
 from ib_insync import *  # For connecting to Interactive Brokers TWS API
 import pandas as pd  # For handling the stock list and data manipulation
 import talib  # For calculating Simple Moving Average (SMA)
-import time  # For adding delays to respect IB API rate limits
-from tqdm import tqdm  # For progress bar tracking
+from fetch_engine import fetch_histories  # For concurrent, pacing-aware bar downloads
+from bar_cache import BarCache  # For reusing bars downloaded on earlier runs
+from routing import make_routed_contract  # For exchange-aware contracts from the routing table
+from telemetry import Telemetry  # For run timings, request counters and IB error codes
+from stage_table import read_stock_table, write_stage_table, filter_stored, bar_range  # For typed stage tables
+from prescreen import apply_prescreen  # For the local fundamental pre-screen
+from universe import Universe  # For looking up passing symbols' rows
 
 # FUNCTION TO FILTER STOCKS BY 50 SMA BELOW 20 SMA ***********************************************
-def filter_by_50sma_below_20sma(csv_file, sma_short=20, sma_long=50, data_days=50):
+def filter_by_50sma_below_20sma(csv_file, sma_short=20, sma_long=50, data_days=50, prescreen=None):
     """
     Filter stocks from a CSV file where the 50-day SMA is below the 20-day SMA.
     Args:
@@ -14,78 +19,80 @@ def filter_by_50sma_below_20sma(csv_file, sma_short=20, sma_long=50, data_days=5
         sma_short (int): Period for shorter SMA (default: 20)
         sma_long (int): Period for longer SMA (default: 50)
         data_days (int): Number of days of historical data to fetch (default: 50)
+        prescreen (list): (column, operator, value) predicates on the stock list columns, applied
+            before anything is requested from IB (default: none, see prescreen.DEFAULT_PRESCREEN)
     Returns:
         pd.DataFrame: Filtered DataFrame with stocks where 50 SMA < 20 SMA
     """
-    # Read the CSV file containing stock symbols
-    df = pd.read_csv(csv_file)
+    # Read the stock list (the original CSV or the table written by the previous stage)
+    df = read_stock_table(csv_file)
+    
+    # Drop stocks failing the local pre-screen before anything is sent to IB
+    if prescreen:
+        df = apply_prescreen(df, prescreen)
+    
+    # Filter on metrics stored by an earlier run today instead of asking IB again
+    stored = filter_stored(df, [f'sma_{sma_short}', f'sma_{sma_long}'], lambda t: t[f'sma_{sma_long}'] < t[f'sma_{sma_short}'])
+    if stored is not None:
+        print("Using stored SMAs from today's stage table")
+        return stored
+    
+    # Index the stock list once instead of scanning it for every passing symbol
+    stocks = Universe(df)
     
     # Initialize IB connection
     ib = IB()
+    # Timings, request counters and IB error codes, exported at the end of the run
+    telemetry = Telemetry('filter_50sma_below_20sma')
     try:
         # Connect to TWS or IB Gateway
-        ib.connect('127.0.0.1', 7497, clientId=1)
+        with telemetry.phase('connect'):
+            ib.connect('127.0.0.1', 7497, clientId=1)
         
         # Suppress IB API error messages for invalid contracts
         ib.errorEvent += lambda reqId, errorCode, errorString, contract: None
         
+        # Count IB error codes and bytes received for the telemetry
+        telemetry.attach(ib)
+        
         # Initialize list for filtered stocks
         filtered_stocks = []
         
-        # Get total symbols for progress tracking
-        total_symbols = len(df)
+        # Download bars for every symbol concurrently (cached bars are only topped up with new sessions)
+        results = fetch_histories(ib, df['Symbol'], data_days, make_contract=make_routed_contract, cache=BarCache(), telemetry=telemetry, desc="Scanning stocks for 50 SMA < 20 SMA")
         
-        # Loop through each stock symbol with progress bar
-        for symbol in tqdm(df['Symbol'], total=total_symbols, desc="Scanning stocks for 50 SMA < 20 SMA"):
+        # Loop through each stock symbol's downloaded bars
+        telemetry.start('evaluate')
+        for symbol, result in results.items():
             try:
-                # Create a Stock contract (US stock, SMART exchange)
-                contract = Stock(symbol, 'SMART', 'USD', primaryExchange='NYSE')
+                # Skip symbols whose contract or data request failed
+                if result.error:
+                    print(f"✗ {symbol}: {result.error}")
+                    continue
                 
-                # Qualify the contract
-                qualified_contracts = ib.qualifyContracts(contract)
+                hist_data = result.hist_data
                 
-                if qualified_contracts:
-                    contract = qualified_contracts[0]
-                    
-                    # Request historical data
-                    bars = ib.reqHistoricalData(
-                        contract,
-                        endDateTime='',
-                        durationStr=f'{data_days} D',
-                        barSizeSetting='1 day',
-                        whatToShow='TRADES',
-                        useRTH=True,
-                        formatDate=1,
-                        keepUpToDate=False
-                    )
+                if len(hist_data) >= sma_long:
+                    # Calculate SMAs
+                    sma_20 = talib.SMA(hist_data['close'].values, timeperiod=sma_short)
+                    sma_50 = talib.SMA(hist_data['close'].values, timeperiod=sma_long)
+                    latest_sma_20 = sma_20[-1]
+                    latest_sma_50 = sma_50[-1]
                     
-                    if bars and len(bars) >= sma_long:
-                        # Convert bars to DataFrame
-                        hist_data = util.df(bars)
-                        
-                        # Calculate SMAs
-                        sma_20 = talib.SMA(hist_data['close'].values, timeperiod=sma_short)
-                        sma_50 = talib.SMA(hist_data['close'].values, timeperiod=sma_long)
-                        latest_sma_20 = sma_20[-1]
-                        latest_sma_50 = sma_50[-1]
-                        
-                        # Check if 50 SMA is below 20 SMA
-                        if latest_sma_50 < latest_sma_20:
-                            stock_data = df[df['Symbol'] == symbol].to_dict('records')[0]
-                            filtered_stocks.append(stock_data)
-                            print(f"✓ {symbol}: SMA50 {latest_sma_50:.2f} < SMA20 {latest_sma_20:.2f} (passed)")
-                        else:
-                            print(f"✗ {symbol}: SMA50 {latest_sma_50:.2f} >= SMA20 {latest_sma_20:.2f}")
+                    # Check if 50 SMA is below 20 SMA
+                    if latest_sma_50 < latest_sma_20:
+                        stock_data = stocks.row(symbol)
+                        stock_data.update({f'sma_{sma_short}': latest_sma_20, f'sma_{sma_long}': latest_sma_50, **bar_range(hist_data)})
+                        filtered_stocks.append(stock_data)
+                        print(f"✓ {symbol}: SMA50 {latest_sma_50:.2f} < SMA20 {latest_sma_20:.2f} (passed)")
                     else:
-                        print(f"✗ {symbol}: Insufficient data (need at least {sma_long} bars)")
+                        print(f"✗ {symbol}: SMA50 {latest_sma_50:.2f} >= SMA20 {latest_sma_20:.2f}")
                 else:
-                    print(f"✗ {symbol}: Invalid contract")
+                    print(f"✗ {symbol}: Insufficient data (need at least {sma_long} bars)")
                     
             except Exception as e:
                 print(f"✗ {symbol}: Error - {str(e)[:50]}...")
-            
-            # Delay for IB API rate limits
-            time.sleep(0.2)
+        telemetry.stop('evaluate')
         
         # Convert filtered stocks to DataFrame
         filtered_df = pd.DataFrame(filtered_stocks)
@@ -97,6 +104,8 @@ def filter_by_50sma_below_20sma(csv_file, sma_short=20, sma_long=50, data_days=5
         return pd.DataFrame()
     
     finally:
+        telemetry.detach(ib)
+        telemetry.write()
         ib.disconnect()
 
 # MAIN SCRIPT ************************************************************************************
@@ -115,5 +124,8 @@ if __name__ == "__main__":
         # Save to new CSV
         filtered_stocks.to_csv('nyse_50sma_below_20sma_stocks.csv', index=False)
         print("Saved to 'nyse_50sma_below_20sma_stocks.csv'")
+        
+        # Save the SMA values and bar range with the stocks as a typed table for later stages
+        write_stage_table(filtered_stocks, 'nyse_50sma_below_20sma_stocks.parquet')
     else:
         print("No stocks met the 50 SMA < 20 SMA criterion or an error occurred.")
\ No newline at end of file
@@ -2,12 +2,17 @@
 from ib_insync import *  # For connecting to Interactive Brokers TWS API
 import pandas as pd  # For handling the stock list and data manipulation
 import talib  # For calculating Average True Range (ATR)
-import time  # For adding delays to respect IB API rate limits
-from tqdm import tqdm  # For progress bar tracking
 import numpy as np  # For NaN checks in ATR calculations
+from fetch_engine import fetch_histories  # For concurrent, pacing-aware bar downloads
+from bar_cache import BarCache  # For reusing bars downloaded on earlier runs
+from routing import make_routed_contract  # For exchange-aware contracts from the routing table
+from telemetry import Telemetry  # For run timings, request counters and IB error codes
+from stage_table import read_stock_table, write_stage_table, filter_stored, bar_range  # For typed stage tables
+from prescreen import apply_prescreen  # For the local fundamental pre-screen
+from universe import Universe  # For looking up passing symbols' rows
 
 # FUNCTION TO FILTER STOCKS BY ATR ***************************************************************
-def filter_by_atr(csv_file, min_atr=1.0, atr_period=14, data_days=50):
+def filter_by_atr(csv_file, min_atr=1.0, atr_period=14, data_days=50, prescreen=None):
     """
     Filter stocks from a CSV file based on the latest Average True Range (ATR) value.
     Args:
@@ -15,81 +20,83 @@ def filter_by_atr(csv_file, min_atr=1.0, atr_period=14, data_days=50):
         min_atr (float): Minimum ATR value (default: 1.0)
         atr_period (int): Period for ATR calculation (default: 14)
         data_days (int): Number of days of historical data to fetch (should be > atr_period * 2 for accuracy)
+        prescreen (list): (column, operator, value) predicates on the stock list columns, applied
+            before anything is requested from IB (default: none, see prescreen.DEFAULT_PRESCREEN)
     Returns:
         pd.DataFrame: Filtered DataFrame with stocks where latest ATR > min_atr
     """
-    # Read the CSV file containing stock symbols
-    df = pd.read_csv(csv_file)
+    # Read the stock list (the original CSV or the table written by the previous stage)
+    df = read_stock_table(csv_file)
+    
+    # Drop stocks failing the local pre-screen before anything is sent to IB
+    if prescreen:
+        df = apply_prescreen(df, prescreen)
+    
+    # Filter on metrics stored by an earlier run today instead of asking IB again
+    stored = filter_stored(df, ['atr'], lambda t: t['atr'] > min_atr)
+    if stored is not None:
+        print("Using stored ATR values from today's stage table")
+        return stored
+    
+    # Index the stock list once instead of scanning it for every passing symbol
+    stocks = Universe(df)
     
     # Initialize IB connection
     ib = IB()
+    # Timings, request counters and IB error codes, exported at the end of the run
+    telemetry = Telemetry('filter_atr')
     try:
         # Connect to TWS or IB Gateway
-        ib.connect('127.0.0.1', 7497, clientId=1)
+        with telemetry.phase('connect'):
+            ib.connect('127.0.0.1', 7497, clientId=1)
         
         # Suppress IB API error messages for invalid contracts
         ib.errorEvent += lambda reqId, errorCode, errorString, contract: None
         
+        # Count IB error codes and bytes received for the telemetry
+        telemetry.attach(ib)
+        
         # Initialize list for filtered stocks
         filtered_stocks = []
         
-        # Get total symbols for progress tracking
-        total_symbols = len(df)
+        # Download bars for every symbol concurrently (cached bars are only topped up with new sessions)
+        results = fetch_histories(ib, df['Symbol'], data_days, make_contract=make_routed_contract, cache=BarCache(), telemetry=telemetry, desc="Scanning stocks for ATR")
         
-        # Loop through each stock symbol with progress bar
-        for symbol in tqdm(df['Symbol'], total=total_symbols, desc="Scanning stocks for ATR"):
+        # Loop through each stock symbol's downloaded bars
+        telemetry.start('evaluate')
+        for symbol, result in results.items():
             try:
-                # Create a Stock contract (US stock, SMART exchange for broader coverage)
-                contract = Stock(symbol, 'SMART', 'USD', primaryExchange='NYSE')
+                # Skip symbols whose contract or data request failed
+                if result.error:
+                    print(f"✗ {symbol}: {result.error}")
+                    continue
                 
-                # Qualify the contract
-                qualified_contracts = ib.qualifyContracts(contract)
+                hist_data = result.hist_data
                 
-                if qualified_contracts:
-                    contract = qualified_contracts[0]
-                    
-                    # Request historical data
-                    bars = ib.reqHistoricalData(
-                        contract,
-                        endDateTime='',
-                        durationStr=f'{data_days} D',
-                        barSizeSetting='1 day',
-                        whatToShow='TRADES',
-                        useRTH=True,
-                        formatDate=1,
-                        keepUpToDate=False
+                if len(hist_data) >= atr_period:
+                    # Calculate ATR using TA-Lib
+                    atr_values = talib.ATR(
+                        hist_data['high'].values,
+                        hist_data['low'].values,
+                        hist_data['close'].values,
+                        timeperiod=atr_period
                     )
+                    latest_atr = atr_values[-1]
                     
-                    if bars and len(bars) >= atr_period:
-                        # Convert bars to DataFrame
-                        hist_data = util.df(bars)
-                        
-                        # Calculate ATR using TA-Lib
-                        atr_values = talib.ATR(
-                            hist_data['high'].values,
-                            hist_data['low'].values,
-                            hist_data['close'].values,
-                            timeperiod=atr_period
-                        )
-                        latest_atr = atr_values[-1]
-                        
-                        # Check if ATR is valid and exceeds threshold
-                        if not np.isnan(latest_atr) and latest_atr > min_atr:
-                            stock_data = df[df['Symbol'] == symbol].to_dict('records')[0]
-                            filtered_stocks.append(stock_data)
-                            print(f"✓ {symbol}: ATR {latest_atr:.2f} (passed)")
-                        else:
-                            print(f"✗ {symbol}: ATR {latest_atr:.2f} <= {min_atr} or invalid")
+                    # Check if ATR is valid and exceeds threshold
+                    if not np.isnan(latest_atr) and latest_atr > min_atr:
+                        stock_data = stocks.row(symbol)
+                        stock_data.update({'atr': latest_atr, **bar_range(hist_data)})
+                        filtered_stocks.append(stock_data)
+                        print(f"✓ {symbol}: ATR {latest_atr:.2f} (passed)")
                     else:
-                        print(f"✗ {symbol}: Insufficient data (need at least {atr_period} bars)")
+                        print(f"✗ {symbol}: ATR {latest_atr:.2f} <= {min_atr} or invalid")
                 else:
-                    print(f"✗ {symbol}: Invalid contract")
+                    print(f"✗ {symbol}: Insufficient data (need at least {atr_period} bars)")
                     
             except Exception as e:
                 print(f"✗ {symbol}: Error - {str(e)[:50]}...")
-            
-            # Delay for API rate limits (0.2s for ~5 req/s)
-            time.sleep(0.2)
+        telemetry.stop('evaluate')
         
         # Convert filtered stocks to DataFrame
         filtered_df = pd.DataFrame(filtered_stocks)
@@ -101,6 +108,8 @@ def filter_by_atr(csv_file, min_atr=1.0, atr_period=14, data_days=50):
         return pd.DataFrame()
     
     finally:
+        telemetry.detach(ib)
+        telemetry.write()
         ib.disconnect()
 
 # MAIN SCRIPT ************************************************************************************
@@ -125,5 +134,8 @@ if __name__ == "__main__":
         
         # Confirm the file was saved
         print(f"Saved to '{output_path}'")
+        
+        # Save the ATR values and bar range with the stocks as a typed table for later stages
+        write_stage_table(filtered_stocks, output_path.replace('.csv', '.parquet'))
     else:
         print("No stocks met the ATR criterion or an error occurred.")
\ No newline at end of file
@@ -0,0 +1,369 @@
+# LIBRARIES ***************************************************************************************
+import numpy as np  # For NaN checks on indicator values
+import talib  # For calculating Simple Moving Average (SMA) and Average True Range (ATR)
+import indicators  # For the vectorized whole-universe versions of the checks
+
+# FILTER CHECKS ***********************************************************************************
+# Every check works on a DataFrame of daily bars (util.df format, oldest first), looks only at the
+# last `bars` rows it needs, and returns (passed, metrics dict, message) with the same messages the
+# standalone filter scripts print.
+
+def check_avg_volume(hist_data, min_avg_volume=2000000, days=20):
+    """
+    Average daily volume over the last `days` bars is at least min_avg_volume.
+    """
+    avg_volume = hist_data['volume'].tail(days).mean()
+    metrics = {'avg_volume': avg_volume}
+    if avg_volume >= min_avg_volume:
+        return True, metrics, f"Avg vol {avg_volume:,.0f} (passed)"
+    return False, metrics, f"Avg vol {avg_volume:,.0f} < {min_avg_volume:,.0f}"
+
+
+def check_relative_volume(hist_data, min_rel_volume=1.0, avg_days=20):
+    """
+    Today's volume divided by the average volume of the last `avg_days` bars is at least min_rel_volume.
+    """
+    volume = hist_data['volume'].tail(avg_days)
+    avg_volume = volume.mean()
+    if not avg_volume > 0:  # Avoid division by zero
+        return False, {'rel_volume': np.nan}, "Average volume is zero"
+    rel_volume = volume.iloc[-1] / avg_volume
+    metrics = {'rel_volume': rel_volume}
+    if rel_volume >= min_rel_volume:
+        return True, metrics, f"Rel Volume {rel_volume:.2f} (passed)"
+    return False, metrics, f"Rel Volume {rel_volume:.2f} < {min_rel_volume}"
+
+
+def check_atr(hist_data, min_atr=1.0, atr_period=14, data_days=50):
+    """
+    Latest ATR (computed over the last `data_days` bars, like filter_atr.py) is above min_atr.
+    """
+    window = hist_data.tail(data_days)
+    if len(window) < atr_period:
+        return False, {'atr': np.nan}, f"Insufficient data (need at least {atr_period} bars)"
+    latest_atr = talib.ATR(
+        window['high'].values,
+        window['low'].values,
+        window['close'].values,
+        timeperiod=atr_period
+    )[-1]
+    metrics = {'atr': latest_atr}
+    if not np.isnan(latest_atr) and latest_atr > min_atr:
+        return True, metrics, f"ATR {latest_atr:.2f} (passed)"
+    return False, metrics, f"ATR {latest_atr:.2f} <= {min_atr} or invalid"
+
+
+def check_price_above_sma(hist_data, sma_period=20):
+    """
+    Latest close is above the `sma_period` SMA.
+    """
+    close = hist_data['close'].values
+    if len(close) < sma_period:
+        return False, {f'sma_{sma_period}': np.nan}, f"Insufficient data (need at least {sma_period} bars)"
+    latest_sma = talib.SMA(close, timeperiod=sma_period)[-1]
+    latest_price = close[-1]
+    metrics = {'close': latest_price, f'sma_{sma_period}': latest_sma}
+    if latest_price > latest_sma:
+        return True, metrics, f"Price {latest_price:.2f} > SMA{sma_period} {latest_sma:.2f} (passed)"
+    return False, metrics, f"Price {latest_price:.2f} <= SMA{sma_period} {latest_sma:.2f}"
+
+
+def check_sma_below_sma(hist_data, sma_short=20, sma_long=50):
+    """
+    The longer SMA is below the shorter SMA (e.g. SMA50 < SMA20, SMA200 < SMA50).
+    """
+    close = hist_data['close'].values
+    if len(close) < sma_long:
+        return False, {f'sma_{sma_long}': np.nan}, f"Insufficient data (need at least {sma_long} bars)"
+    latest_short = talib.SMA(close, timeperiod=sma_short)[-1]
+    latest_long = talib.SMA(close, timeperiod=sma_long)[-1]
+    metrics = {f'sma_{sma_short}': latest_short, f'sma_{sma_long}': latest_long}
+    if latest_long < latest_short:
+        return True, metrics, f"SMA{sma_long} {latest_long:.2f} < SMA{sma_short} {latest_short:.2f} (passed)"
+    return False, metrics, f"SMA{sma_long} {latest_long:.2f} >= SMA{sma_short} {latest_short:.2f}"
+
+
+# VECTORIZED CHECKS *******************************************************************************
+# The same checks evaluated for every symbol of a BarBlock at once. Each returns
+# (passed boolean array, metrics dict of arrays); NaN indicator values never pass.
+
+def vcheck_avg_volume(block, min_avg_volume=2000000, days=20):
+    """
+    Vectorized check_avg_volume.
+    """
+    avg_volume = indicators.avg_volume(block, days)
+    return avg_volume >= min_avg_volume, {'avg_volume': avg_volume}
+
+
+def vcheck_relative_volume(block, min_rel_volume=1.0, avg_days=20):
+    """
+    Vectorized check_relative_volume.
+    """
+    rel_volume = indicators.rel_volume(block, avg_days)
+    return rel_volume >= min_rel_volume, {'rel_volume': rel_volume}
+
+
+def vcheck_atr(block, min_atr=1.0, atr_period=14, data_days=50):
+    """
+    Vectorized check_atr.
+    """
+    latest_atr = indicators.latest(indicators.atr(block, atr_period, window=data_days))
+    return latest_atr > min_atr, {'atr': latest_atr}
+
+
+def vcheck_price_above_sma(block, sma_period=20):
+    """
+    Vectorized check_price_above_sma.
+    """
+    latest_sma = indicators.latest(indicators.sma(block, sma_period))
+    latest_price = block.close[:, -1]
+    return latest_price > latest_sma, {'close': latest_price, f'sma_{sma_period}': latest_sma}
+
+
+def vcheck_sma_below_sma(block, sma_short=20, sma_long=50):
+    """
+    Vectorized check_sma_below_sma.
+    """
+    latest_short = indicators.latest(indicators.sma(block, sma_short))
+    latest_long = indicators.latest(indicators.sma(block, sma_long))
+    return latest_long < latest_short, {f'sma_{sma_short}': latest_short, f'sma_{sma_long}': latest_long}
+
+
+# ROLLING STATE CHECKS ****************************************************************************
+# The same checks evaluated from a rolling_state.RollingState for the given state rows, in O(1) per
+# symbol. Each returns (passed boolean array, metrics dict of arrays) like the vectorized checks.
+
+def scheck_avg_volume(state, rows, min_avg_volume=2000000, days=20):
+    """
+    Rolling-state check_avg_volume.
+    """
+    avg_volume = state.avg_volume(rows, days)
+    return avg_volume >= min_avg_volume, {'avg_volume': avg_volume}
+
+
+def scheck_relative_volume(state, rows, min_rel_volume=1.0, avg_days=20):
+    """
+    Rolling-state check_relative_volume.
+    """
+    average = state.avg_volume(rows, avg_days)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rel_volume = np.where(average > 0, state.latest(rows, 'volume') / average, np.nan)
+    return rel_volume >= min_rel_volume, {'rel_volume': rel_volume}
+
+
+def scheck_atr(state, rows, min_atr=1.0, atr_period=14, data_days=50):
+    """
+    Rolling-state check_atr.
+    """
+    latest_atr = state.atr(rows, atr_period, data_days)
+    return latest_atr > min_atr, {'atr': latest_atr}
+
+
+def scheck_price_above_sma(state, rows, sma_period=20):
+    """
+    Rolling-state check_price_above_sma.
+    """
+    latest_sma = state.sma(rows, sma_period)
+    latest_price = state.latest(rows, 'close')
+    return latest_price > latest_sma, {'close': latest_price, f'sma_{sma_period}': latest_sma}
+
+
+def scheck_sma_below_sma(state, rows, sma_short=20, sma_long=50):
+    """
+    Rolling-state check_sma_below_sma.
+    """
+    latest_short = state.sma(rows, sma_short)
+    latest_long = state.sma(rows, sma_long)
+    return latest_long < latest_short, {f'sma_{sma_short}': latest_short, f'sma_{sma_long}': latest_long}
+
+
+# HISTORICAL CHECKS *******************************************************************************
+# The same checks evaluated point in time for every symbol on every session of a BarBlock, each
+# session only seeing the bars up to and including it. Each returns (passed, metrics dict), all
+# (symbols, days) arrays; column d is what the vectorized check returns on the block cut off at d.
+
+def hcheck_avg_volume(block, min_avg_volume=2000000, days=20):
+    """
+    Historical check_avg_volume.
+    """
+    avg_volume = indicators.rolling_valid_mean(block.volume, block.mask, days)
+    return avg_volume >= min_avg_volume, {'avg_volume': avg_volume}
+
+
+def hcheck_relative_volume(block, min_rel_volume=1.0, avg_days=20):
+    """
+    Historical check_relative_volume.
+    """
+    average = indicators.rolling_valid_mean(block.volume, block.mask, avg_days)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rel_volume = np.where(average > 0, block.volume / average, np.nan)
+    return rel_volume >= min_rel_volume, {'rel_volume': rel_volume}
+
+
+def hcheck_atr(block, min_atr=1.0, atr_period=14, data_days=50):
+    """
+    Historical check_atr.
+    """
+    atr = indicators.windowed_atr(block, atr_period, data_days)
+    return atr > min_atr, {'atr': atr}
+
+
+def hcheck_price_above_sma(block, sma_period=20):
+    """
+    Historical check_price_above_sma.
+    """
+    sma = indicators.sma(block, sma_period)
+    return block.close > sma, {'close': block.close, f'sma_{sma_period}': sma}
+
+
+def hcheck_sma_below_sma(block, sma_short=20, sma_long=50):
+    """
+    Historical check_sma_below_sma.
+    """
+    short = indicators.sma(block, sma_short)
+    long = indicators.sma(block, sma_long)
+    return long < short, {f'sma_{sma_short}': short, f'sma_{sma_long}': long}
+
+
+# FILTER REGISTRY *********************************************************************************
+# name -> (per-symbol check, vectorized check, function returning how many bars the check needs,
+#          rolling-state check, function returning the rolling-state windows the check needs,
+#          historical check)
+FILTERS = {
+    'avg_volume': (check_avg_volume, vcheck_avg_volume, lambda p: p.get('days', 20),
+                   scheck_avg_volume, lambda p: {'volume': [p.get('days', 20)]}, hcheck_avg_volume),
+    'relative_volume': (check_relative_volume, vcheck_relative_volume, lambda p: p.get('avg_days', 20),
+                        scheck_relative_volume, lambda p: {'volume': [p.get('avg_days', 20)]},
+                        hcheck_relative_volume),
+    'atr': (check_atr, vcheck_atr, lambda p: p.get('data_days', 50),
+            scheck_atr, lambda p: {'atr': [(p.get('atr_period', 14), p.get('data_days', 50))]}, hcheck_atr),
+    'price_above_sma': (check_price_above_sma, vcheck_price_above_sma, lambda p: p.get('sma_period', 20),
+                        scheck_price_above_sma, lambda p: {'sma': [p.get('sma_period', 20)]},
+                        hcheck_price_above_sma),
+    'sma_below_sma': (check_sma_below_sma, vcheck_sma_below_sma, lambda p: p.get('sma_long', 50),
+                      scheck_sma_below_sma, lambda p: {'sma': [p.get('sma_short', 20), p.get('sma_long', 50)]},
+                      hcheck_sma_below_sma),
+}
+
+# The uptrend chain in the order the standalone scripts were run
+DEFAULT_CHAIN = [
+    ('avg_volume', {'min_avg_volume': 2000000, 'days': 20}),
+    ('relative_volume', {'min_rel_volume': 1.0, 'avg_days': 20}),
+    ('atr', {'min_atr': 1.0, 'atr_period': 14, 'data_days': 50}),
+    ('price_above_sma', {'sma_period': 20}),
+    ('sma_below_sma', {'sma_short': 20, 'sma_long': 50}),
+    ('sma_below_sma', {'sma_short': 50, 'sma_long': 200}),
+]
+
+
+# CHAIN HELPERS ***********************************************************************************
+def bars_needed(chain):
+    """
+    Longest history any filter in the chain needs, i.e. the single window to fetch per symbol.
+    Args:
+        chain (list): (filter name, params dict) pairs
+    Returns:
+        int: Number of daily bars to fetch
+    """
+    return max(FILTERS[name][2](params) for name, params in chain)
+
+
+def state_spec(chain):
+    """
+    Every rolling-state window the chain needs (see rolling_state.RollingState).
+    Args:
+        chain (list): (filter name, params dict) pairs
+    Returns:
+        dict: {'sma': [periods], 'volume': [days], 'atr': [(period, data_days), ...]}
+    """
+    spec = {'sma': [], 'volume': [], 'atr': []}
+    for name, params in chain:
+        for kind, windows in FILTERS[name][4](params).items():
+            spec[kind].extend(windows)
+    return spec
+
+
+def evaluate_chain(hist_data, chain):
+    """
+    Run every filter of the chain on one symbol's bars, stopping at the first failure.
+    Args:
+        hist_data (pd.DataFrame): Daily bars for the symbol (oldest first)
+        chain (list): (filter name, params dict) pairs
+    Returns:
+        tuple: (passed all filters, metrics dict from the filters that ran, message of the last filter)
+    """
+    metrics = {}
+    message = "No filters"
+    for name, params in chain:
+        check = FILTERS[name][0]
+        passed, values, message = check(hist_data, **params)
+        metrics.update(values)
+        if not passed:
+            return False, metrics, message
+    return True, metrics, message
+
+
+def evaluate_chain_block(block, chain):
+    """
+    Run the chain for every symbol of a BarBlock at once.
+    Args:
+        block (BarBlock): Aligned bars for the universe (see indicators.build_block)
+        chain (list): (filter name, params dict) pairs
+    Returns:
+        tuple: (passed boolean array, metrics dict of arrays, index of the first failed filter per
+                symbol with -1 for symbols that passed everything)
+    """
+    passed = np.ones(len(block.symbols), dtype=bool)
+    failed_at = np.full(len(block.symbols), -1)
+    metrics = {}
+    for position, (name, params) in enumerate(chain):
+        check_passed, values = FILTERS[name][1](block, **params)
+        metrics.update(values)
+        # Record the first filter each symbol fails
+        failed_at[passed & ~check_passed] = position
+        passed &= check_passed
+    return passed, metrics, failed_at
+
+
+def evaluate_chain_state(state, symbols, chain):
+    """
+    Run the chain for the given symbols from their rolling indicator state.
+    Args:
+        state (RollingState): Up-to-date state holding every symbol (see rolling_state)
+        symbols (list): Symbols to evaluate
+        chain (list): (filter name, params dict) pairs
+    Returns:
+        tuple: (passed boolean array, metrics dict of arrays, index of the first failed filter per
+                symbol with -1 for symbols that passed everything), like evaluate_chain_block
+    """
+    rows = state.rows(symbols)
+    passed = np.ones(len(rows), dtype=bool)
+    failed_at = np.full(len(rows), -1)
+    metrics = {}
+    for position, (name, params) in enumerate(chain):
+        check_passed, values = FILTERS[name][3](state, rows, **params)
+        metrics.update(values)
+        # Record the first filter each symbol fails
+        failed_at[passed & ~check_passed] = position
+        passed &= check_passed
+    return passed, metrics, failed_at
+
+
+def evaluate_chain_history(block, chain):
+    """
+    Run the chain point in time for every symbol on every session of a BarBlock (see the historical
+    checks), e.g. for backtesting the scanner over years of cached bars.
+    Args:
+        block (BarBlock): Aligned bars (see indicators.build_block, with days=None for the full history)
+        chain (list): (filter name, params dict) pairs
+    Returns:
+        tuple: (signals boolean array of shape (symbols, days), True where a symbol passed every filter
+                on that session; metrics dict of (symbols, days) arrays)
+    """
+    signals = np.ones(block.close.shape, dtype=bool)
+    metrics = {}
+    for name, params in chain:
+        check_passed, values = FILTERS[name][5](block, **params)
+        metrics.update(values)
+        signals &= check_passed
+    return signals, metrics
@@ -1,108 +1,117 @@
 # LIBRARIES ***************************************************************************************
 from ib_insync import *  # For connecting to Interactive Brokers TWS API
 import pandas as pd  # For handling the stock list and data manipulation
-import time  # For adding delays to respect IB API rate limits
-from tqdm import tqdm  # For progress bar tracking
+from fetch_engine import fetch_histories  # For concurrent, pacing-aware bar downloads
+from bar_cache import BarCache  # For reusing bars downloaded on earlier runs
+from routing import make_routed_contract  # For exchange-aware contracts from the routing table
+from telemetry import Telemetry  # For run timings, request counters and IB error codes
+from stage_table import read_stock_table, write_stage_table, filter_stored, bar_range  # For typed stage tables
+from prescreen import apply_prescreen  # For the local fundamental pre-screen
+from universe import Universe  # For looking up passing symbols' rows
+from snapshot import intraday_relative_volume  # For snapshot-based relative volume during the session
 
 # FUNCTION TO FILTER STOCKS BY RELATIVE VOLUME *****************************************************
-def filter_by_relative_volume(csv_file, min_rel_volume=1.0, avg_days=20):
+def filter_by_relative_volume(csv_file, min_rel_volume=1.0, avg_days=20, intraday=False, prescreen=None):
     """
     Filter stocks from a CSV file based on relative volume (current day volume / average volume).
     Args:
         csv_file (str): Path to the CSV file with stock symbols
         min_rel_volume (float): Minimum relative volume (default: 1.0)
         avg_days (int): Number of days for average volume calculation (default: 20)
+        intraday (bool): During the session, use snapshot volumes against cached averages (default: False)
+        prescreen (list): (column, operator, value) predicates on the stock list columns, applied
+            before anything is requested from IB (default: none, see prescreen.DEFAULT_PRESCREEN)
     Returns:
         pd.DataFrame: Filtered DataFrame with stocks meeting the relative volume criterion
     """
-    # Read the CSV file containing stock symbols
-    df = pd.read_csv(csv_file)
+    # Read the stock list (the original CSV or the table written by the previous stage)
+    df = read_stock_table(csv_file)
+    
+    # Drop stocks failing the local pre-screen before anything is sent to IB
+    if prescreen:
+        df = apply_prescreen(df, prescreen)
+    
+    # Filter on metrics stored by an earlier run today instead of asking IB again
+    # (not intraday, where relative volume keeps changing through the session)
+    stored = None if intraday else filter_stored(df, ['rel_volume'], lambda t: t['rel_volume'] >= min_rel_volume)
+    if stored is not None:
+        print("Using stored relative volumes from today's stage table")
+        return stored
+    
+    # Index the stock list once instead of scanning it for every passing symbol
+    stocks = Universe(df)
     
     # Initialize IB connection
     ib = IB()
+    # Timings, request counters and IB error codes, exported at the end of the run
+    telemetry = Telemetry('filter_relative_volume')
     try:
         # Connect to TWS or IB Gateway
-        ib.connect('127.0.0.1', 7497, clientId=1)
+        with telemetry.phase('connect'):
+            ib.connect('127.0.0.1', 7497, clientId=1)
         
         # Suppress IB API error messages
         ib.errorEvent += lambda reqId, errorCode, errorString, contract: None
         
+        # Count IB error codes and bytes received for the telemetry
+        telemetry.attach(ib)
+        
         # Initialize list for filtered stocks
         filtered_stocks = []
         
-        # Get total symbols for progress tracking
-        total_symbols = len(df)
+        # Intraday mode: batched snapshots of today's volume against cached 20-day averages
+        if intraday:
+            with telemetry.phase('snapshots'):
+                rel_table = intraday_relative_volume(ib, df['Symbol'], avg_days, make_contract=make_routed_contract)
+            for row in rel_table.itertuples(index=False):
+                if row.rel_volume >= min_rel_volume:
+                    stock_data = stocks.row(row.Symbol)
+                    stock_data.update({'avg_volume': row.avg_volume, 'rel_volume': row.rel_volume})
+                    filtered_stocks.append(stock_data)
+                    print(f"✓ {row.Symbol}: Rel Volume {row.rel_volume:.2f} (passed)")
+                else:
+                    print(f"✗ {row.Symbol}: Rel Volume {row.rel_volume:.2f} < {min_rel_volume}")
+            return pd.DataFrame(filtered_stocks)
+        
+        # Download 20 days of bars for every symbol concurrently (replaces the serial loop).
+        # The last bar of that history is today's bar, so no separate '1 D' request is needed.
+        results = fetch_histories(ib, df['Symbol'], avg_days, make_contract=make_routed_contract, cache=BarCache(), telemetry=telemetry, desc="Scanning stocks for Rel Volume")
         
-        # Loop through each stock symbol with progress bar
-        for symbol in tqdm(df['Symbol'], total=total_symbols, desc="Scanning stocks for Rel Volume"):
+        # Loop through each stock symbol's downloaded bars
+        telemetry.start('evaluate')
+        for symbol, result in results.items():
             try:
-                # Create a Stock contract (US stock, SMART exchange for better coverage)
-                contract = Stock(symbol, 'SMART', 'USD', primaryExchange='NYSE')
+                # Skip symbols whose contract or data request failed
+                if result.error:
+                    print(f"✗ {symbol}: {result.error}")
+                    continue
                 
-                # Qualify the contract
-                qualified_contracts = ib.qualifyContracts(contract)
+                hist_data = result.hist_data
                 
-                if qualified_contracts:
-                    contract = qualified_contracts[0]
-                    
-                    # Request historical data for average volume (20 days)
-                    hist_bars = ib.reqHistoricalData(
-                        contract,
-                        endDateTime='',
-                        durationStr=f'{avg_days} D',
-                        barSizeSetting='1 day',
-                        whatToShow='TRADES',
-                        useRTH=True,
-                        formatDate=1,
-                        keepUpToDate=False
-                    )
-                    
-                    # Request latest day’s volume (1 day)
-                    latest_bar = ib.reqHistoricalData(
-                        contract,
-                        endDateTime='',
-                        durationStr='1 D',
-                        barSizeSetting='1 day',
-                        whatToShow='TRADES',
-                        useRTH=True,
-                        formatDate=1,
-                        keepUpToDate=False
-                    )
+                # Calculate average volume
+                avg_volume = hist_data['volume'].mean()
+                
+                # Get current day’s volume
+                current_volume = hist_data['volume'].iloc[-1]
+                
+                # Calculate relative volume
+                if avg_volume > 0:  # Avoid division by zero
+                    rel_volume = current_volume / avg_volume
                     
-                    if hist_bars and latest_bar:
-                        # Convert to DataFrames
-                        hist_data = util.df(hist_bars)
-                        latest_data = util.df(latest_bar)
-                        
-                        # Calculate average volume
-                        avg_volume = hist_data['volume'].mean()
-                        
-                        # Get current day’s volume
-                        current_volume = latest_data['volume'].iloc[-1]
-                        
-                        # Calculate relative volume
-                        if avg_volume > 0:  # Avoid division by zero
-                            rel_volume = current_volume / avg_volume
-                            
-                            # Check if relative volume exceeds threshold
-                            if rel_volume >= min_rel_volume:
-                                stock_data = df[df['Symbol'] == symbol].to_dict('records')[0]
-                                filtered_stocks.append(stock_data)
-                                print(f"✓ {symbol}: Rel Volume {rel_volume:.2f} (passed)")
-                            else:
-                                print(f"✗ {symbol}: Rel Volume {rel_volume:.2f} < {min_rel_volume}")
-                        else:
-                            print(f"✗ {symbol}: Average volume is zero")
+                    # Check if relative volume exceeds threshold
+                    if rel_volume >= min_rel_volume:
+                        stock_data = stocks.row(symbol)
+                        stock_data.update({'avg_volume': avg_volume, 'rel_volume': rel_volume, **bar_range(hist_data)})
+                        filtered_stocks.append(stock_data)
+                        print(f"✓ {symbol}: Rel Volume {rel_volume:.2f} (passed)")
                     else:
-                        print(f"✗ {symbol}: No data returned")
+                        print(f"✗ {symbol}: Rel Volume {rel_volume:.2f} < {min_rel_volume}")
                 else:
-                    print(f"✗ {symbol}: Invalid contract")
+                    print(f"✗ {symbol}: Average volume is zero")
                     
             except Exception as e:
                 print(f"✗ {symbol}: Error - {str(e)[:50]}...")
-            
-            # Delay for API rate limits (0.2s for ~5 req/s)
-            time.sleep(0.2)
+        telemetry.stop('evaluate')
         
         # Convert filtered stocks to DataFrame
         filtered_df = pd.DataFrame(filtered_stocks)
@@ -114,6 +123,8 @@ def filter_by_relative_volume(csv_file, min_rel_volume=1.0, avg_days=20):
         return pd.DataFrame()
     
     finally:
+        telemetry.detach(ib)
+        telemetry.write()
         ib.disconnect()
 
 # MAIN SCRIPT ************************************************************************************
@@ -137,5 +148,8 @@ if __name__ == "__main__":
         
         # Confirm the file was saved
         print("Saved to 'nyse_high_rel_volume_stocks.csv'")
+        
+        # Save the volume metrics and bar range with the stocks as a typed table for later stages
+        write_stage_table(filtered_stocks, r'C:\Users\jorge_388iox0\OneDrive\OneDrive\Trading\QuantitativeTrading\Scanners\golden_stack_uptrend\nyse_high_rel_volume_stocks.parquet')
     else:
         print("No stocks met the relative volume criterion or an error occurred.")
\ No newline at end of file
@@ -0,0 +1,152 @@
+# LIBRARIES ***************************************************************************************
+import itertools  # For trying every order of a short chain
+import json  # For the on-disk statistics and the filter keys
+import os  # For building the statistics path
+from bar_cache import CACHE_ROOT  # The statistics are kept next to the caches
+from filter_chain import FILTERS  # For the bars each filter needs
+
+# STATISTICS SETTINGS *****************************************************************************
+STATS_PATH = os.path.join(CACHE_ROOT, 'filter_stats.json')
+# Weight of the earlier runs when a new run is added, so the statistics follow the market (a volume
+# filter passes more names on a busy day) without one run overturning the history
+DECAY = 0.8
+# Assumed until a filter has been measured: half of the symbols pass, and a bar costs what a
+# 200-bar request costs per bar when it takes about a second
+DEFAULT_PASS_RATE = 0.5
+DEFAULT_SECONDS_PER_BAR = 0.005
+DEFAULT_CHECK_SECONDS = 0.0001
+# Chains up to this length are ordered by trying every permutation, longer ones greedily
+MAX_EXHAUSTIVE = 7
+
+
+def filter_key(name, params):
+    """
+    Key of a filter with its parameters, e.g. 'sma_below_sma {"sma_long": 50, "sma_short": 20}'.
+    """
+    return f'{name} {json.dumps(params, sort_keys=True)}'
+
+
+# FILTER STATISTICS *******************************************************************************
+class FilterStats:
+    """
+    Pass rate and per-symbol cost of every filter, accumulated over pipeline runs.
+    For each filter it keeps (decayed) totals of the symbols it was given and passed and the seconds
+    its checks took, plus the seconds and bars of the downloads made for it, from which the
+    expected cost of any chain order can be worked out.
+    """
+
+    def __init__(self, path=STATS_PATH):
+        self.path = path
+        # Filter key -> {'in', 'passed', 'check_seconds', 'fetch_seconds', 'bars', 'runs'}
+        self.filters = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.filters = json.load(f)
+
+    def record_run(self, telemetry, chain):
+        """
+        Add the stage counters and timings of a pipeline run (see pipeline.run_pipeline_async).
+        Args:
+            telemetry (Telemetry): Telemetry of the run
+            chain (list): (filter name, params dict) pairs in the order the stages ran
+        """
+        def seconds(phase):
+            return telemetry.phases[phase][0] if phase in telemetry.phases else 0.0
+
+        for position, (name, params) in enumerate(chain):
+            stage = f'stage{position}_{name}'
+            run = {
+                'in': telemetry.counters[f'{stage}_in'],
+                'passed': telemetry.counters[f'{stage}_passed'],
+                'check_seconds': seconds(f'{stage}_check'),
+                'fetch_seconds': seconds(f'{stage}_fetch'),
+                'bars': telemetry.counters[f'{stage}_fetched_bars'],
+            }
+            if not run['in']:
+                # The stage saw no symbols, so this run says nothing about it
+                continue
+            key = filter_key(name, params)
+            previous = self.filters.get(key, {'runs': 0})
+            self.filters[key] = {field: DECAY * previous.get(field, 0.0) + value for field, value in run.items()}
+            self.filters[key]['runs'] = previous['runs'] + 1
+
+    def pass_rate(self, name, params):
+        """
+        Share of the symbols given to the filter that passed it.
+        """
+        entry = self.filters.get(filter_key(name, params))
+        if not entry or not entry['in']:
+            return DEFAULT_PASS_RATE
+        return entry['passed'] / entry['in']
+
+    def check_seconds(self, name, params):
+        """
+        Seconds the filter's check takes per symbol (its downloads not included).
+        """
+        entry = self.filters.get(filter_key(name, params))
+        if not entry or not entry['in']:
+            return DEFAULT_CHECK_SECONDS
+        return entry['check_seconds'] / entry['in']
+
+    def seconds_per_bar(self):
+        """
+        Download seconds per bar over every filter (downloads are the same requests whichever
+        filter asked for them, only the number of bars differs).
+        """
+        bars = sum(entry['bars'] for entry in self.filters.values())
+        if not bars:
+            return DEFAULT_SECONDS_PER_BAR
+        return sum(entry['fetch_seconds'] for entry in self.filters.values()) / bars
+
+    def expected_cost(self, chain):
+        """
+        Expected seconds per input symbol of running a chain in the given order.
+        A symbol reaches a filter with the probability that it passed every earlier one, and a filter
+        only downloads bars when it needs a longer history than the earlier filters fetched.
+        Args:
+            chain (list): (filter name, params dict) pairs
+        Returns:
+            float: Expected check and download seconds per symbol
+        """
+        per_bar = self.seconds_per_bar()
+        cost = 0.0
+        reach = 1.0
+        history = 0
+        for name, params in chain:
+            days = FILTERS[name][2](params)
+            cost += reach * self.check_seconds(name, params)
+            if days > history:
+                cost += reach * days * per_bar
+                history = days
+            reach *= self.pass_rate(name, params)
+        return cost
+
+    def order_chain(self, chain):
+        """
+        Reorder a conjunctive chain so its expected cost is lowest: cheap, selective filters first,
+        and long histories only downloaded for the symbols that survived them.
+        Args:
+            chain (list): (filter name, params dict) pairs (all have to pass, so any order is valid)
+        Returns:
+            list: The same filters in the cheapest known order (ties keep the given order)
+        """
+        if len(chain) <= MAX_EXHAUSTIVE:
+            return list(min(itertools.permutations(chain), key=self.expected_cost))
+        # Greedy: repeatedly take the filter with the lowest added cost per symbol it rejects
+        ordered = []
+        remaining = list(chain)
+        while remaining:
+            base = self.expected_cost(ordered)
+            best = min(remaining, key=lambda step: (self.expected_cost(ordered + [step]) - base)
+                       / max(1.0 - self.pass_rate(*step), 1e-9))
+            ordered.append(best)
+            remaining.remove(best)
+        return ordered
+
+    def save(self):
+        """
+        Write the statistics to disk.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(self.filters, f, indent=1)
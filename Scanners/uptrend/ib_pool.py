@@ -0,0 +1,165 @@
+# LIBRARIES ***************************************************************************************
+from ib_insync import *  # For connecting to Interactive Brokers TWS API
+import asyncio  # For connecting and reconnecting the members concurrently
+import itertools  # For round-robin member selection
+import time  # For spacing out reconnect attempts
+from fetch_engine import PacingLimiter  # For pacing each connection separately
+
+# POOL DEFAULTS ***********************************************************************************
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 7497
+# Client IDs 1-4; other scripts can take a different range so they run alongside the scanners
+DEFAULT_CLIENT_IDS = (1, 2, 3, 4)
+# Minimum seconds between reconnect attempts of one member
+RECONNECT_INTERVAL = 5.0
+
+
+# CONNECTION POOL *********************************************************************************
+class IBPool:
+    """
+    N IB connections with distinct client IDs used like a single IB instance.
+    Requests are spread round-robin over the connected members, a member that drops is reconnected
+    the next time it comes up, and a request that fails because its socket dropped is retried on
+    another member. Since TWS paces each client separately, every member has its own pacing
+    limiter that only that member's pacing errors pause, and fetch_histories scales its overall
+    pacing window and concurrency by the pool size.
+    """
+
+    run = staticmethod(util.run)
+    # Tells fetch_histories and backfill that the members back off on their own pacing errors, so
+    # their shared limiter must not pause every member when one of them is told to slow down
+    paces_members = True
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, client_ids=DEFAULT_CLIENT_IDS, ib_factory=IB,
+                 timeout=4):
+        """
+        Args:
+            host (str): TWS / IB Gateway host
+            port (int): TWS / IB Gateway port
+            client_ids (iterable): One client ID per member
+            ib_factory (callable): Creates an unconnected member (default: IB, FakeIB in tests)
+            timeout (float): Connect timeout per member in seconds
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.members = []
+        self._client_ids = {}
+        self._next_attempt = {}
+        self._reconnecting = {}
+        self._limiters = {}
+        # Errors from every member arrive on one event, with the same signature as IB.errorEvent
+        self.errorEvent = Event('errorEvent')
+        for client_id in client_ids:
+            member = ib_factory()
+            member.errorEvent += self.errorEvent.emit
+            # Pacing violations only slow down the member that caused them
+            limiter = PacingLimiter()
+            member.errorEvent += limiter.on_error
+            self._limiters[id(member)] = limiter
+            self.members.append(member)
+            self._client_ids[id(member)] = client_id
+            self._next_attempt[id(member)] = 0.0
+        self._cycle = itertools.cycle(self.members)
+
+    @property
+    def size(self):
+        """
+        Number of members currently connected.
+        """
+        return max(1, sum(member.isConnected() for member in self.members))
+
+    # Connection handling -------------------------------------------------------------------------
+    async def _connect_member(self, member):
+        """
+        Connect one member, returning False instead of raising (e.g. when its client ID is taken).
+        """
+        client_id = self._client_ids[id(member)]
+        self._next_attempt[id(member)] = time.monotonic() + RECONNECT_INTERVAL
+        try:
+            await member.connectAsync(self.host, self.port, clientId=client_id, timeout=self.timeout)
+            return True
+        except Exception as e:
+            print(f"✗ IB client {client_id}: could not connect ({e})")
+            member.disconnect()
+            return False
+
+    async def connectAsync(self):
+        """
+        Connect every member at once. Members whose client ID is busy are skipped and retried later.
+        Raises:
+            ConnectionError: If no member could connect
+        """
+        connected = await asyncio.gather(*(self._connect_member(member) for member in self.members))
+        if not any(connected):
+            raise ConnectionError(f"No IB connection in the pool could connect to {self.host}:{self.port}")
+        return self
+
+    def connect(self):
+        """
+        Blocking wrapper around connectAsync.
+        """
+        return self.run(self.connectAsync())
+
+    def disconnect(self):
+        for member in self.members:
+            member.disconnect()
+
+    def isConnected(self):
+        return any(member.isConnected() for member in self.members)
+
+    async def _reconnect(self, member):
+        """
+        Reconnect a dropped member, sharing one attempt between concurrent callers.
+        """
+        if time.monotonic() < self._next_attempt[id(member)]:
+            return False
+        task = self._reconnecting.get(id(member))
+        if task is None:
+            task = asyncio.ensure_future(self._connect_member(member))
+            self._reconnecting[id(member)] = task
+            task.add_done_callback(lambda _: self._reconnecting.pop(id(member), None))
+        return await task
+
+    async def _next_member(self):
+        """
+        Next connected member in round-robin order, reconnecting dropped members on the way.
+        Raises:
+            ConnectionError: If every member is down and none could be reconnected
+        """
+        for _ in range(len(self.members)):
+            member = next(self._cycle)
+            if member.isConnected() or await self._reconnect(member):
+                return member
+        raise ConnectionError("No IB connection in the pool is available")
+
+    async def _call(self, method, *args, messages=1, **kwargs):
+        """
+        Run an IB request on the next member once its pacing window allows it, retrying on another
+        member if its socket drops mid-request.
+        Args:
+            method (str): Name of the IB coroutine method
+            messages (int): Number of API messages the request sends
+        """
+        for attempt in range(len(self.members)):
+            member = await self._next_member()
+            limiter = self._limiters[id(member)]
+            await limiter.wait(min(messages, limiter.max_requests))
+            try:
+                return await getattr(member, method)(*args, **kwargs)
+            except ConnectionError:
+                if attempt == len(self.members) - 1:
+                    raise
+
+    # Requests ------------------------------------------------------------------------------------
+    async def qualifyContractsAsync(self, *contracts):
+        return await self._call('qualifyContractsAsync', *contracts, messages=len(contracts))
+
+    async def reqHistoricalDataAsync(self, contract, *args, **kwargs):
+        return await self._call('reqHistoricalDataAsync', contract, *args, **kwargs)
+
+    async def reqTickersAsync(self, *contracts, **kwargs):
+        return await self._call('reqTickersAsync', *contracts, messages=len(contracts), **kwargs)
+
+    async def reqScannerDataAsync(self, subscription, *args, **kwargs):
+        return await self._call('reqScannerDataAsync', subscription, *args, **kwargs)
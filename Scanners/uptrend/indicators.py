@@ -0,0 +1,232 @@
+# LIBRARIES ***************************************************************************************
+import collections  # For the BarBlock container
+import numpy as np  # For the symbols x days arrays and vectorized indicator math
+import pandas as pd  # For stacking the per-symbol bar DataFrames
+
+# BAR BLOCK ***************************************************************************************
+# Daily bars of the whole universe aligned on one date axis.
+# open/high/low/close/volume are float arrays of shape (symbols, days) with NaN where a symbol has no
+# bar; mask is True where a bar exists. Column -1 is the most recent session.
+BarBlock = collections.namedtuple('BarBlock', ['symbols', 'dates', 'open', 'high', 'low', 'close', 'volume', 'mask'])
+
+FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+
+def build_block(histories, days=None):
+    """
+    Load the bars of many symbols into one date-aligned BarBlock.
+    Args:
+        histories (dict): DataFrame of daily bars (util.df format) keyed by symbol
+        days (int): Keep only the most recent `days` sessions (default: all)
+    Returns:
+        BarBlock: Aligned arrays for every symbol with at least one bar
+    """
+    histories = {symbol: bars for symbol, bars in histories.items() if bars is not None and len(bars)}
+    symbols = list(histories)
+    arrays = {field: np.full((len(symbols), 0), np.nan) for field in FIELDS}
+    dates = np.array([], dtype='datetime64[D]')
+    if symbols:
+        # Stack every symbol's bars once, then scatter them into the block in a single step
+        combined = pd.concat(list(histories.values()), ignore_index=True)
+        rows = np.repeat(np.arange(len(symbols)), [len(bars) for bars in histories.values()])
+        bar_dates = pd.to_datetime(combined['date']).to_numpy().astype('datetime64[D]')
+        # Union of every session date, oldest first
+        dates = np.unique(bar_dates)
+        if days is not None:
+            dates = dates[-days:]
+        keep = bar_dates >= dates[0]
+        columns = np.searchsorted(dates, bar_dates[keep])
+        values = combined[list(FIELDS)].to_numpy(dtype=float)[keep]
+        for position, field in enumerate(FIELDS):
+            arrays[field] = np.full((len(symbols), len(dates)), np.nan)
+            arrays[field][rows[keep], columns] = values[:, position]
+
+    mask = ~np.isnan(arrays['close'])
+    return BarBlock(symbols, dates, arrays['open'], arrays['high'], arrays['low'], arrays['close'],
+                    arrays['volume'], mask)
+
+
+# ROLLING HELPERS *********************************************************************************
+def rolling_mean(values, mask, period):
+    """
+    Trailing mean over `period` sessions for every symbol at once.
+    Args:
+        values (np.ndarray): (symbols, days) array
+        mask (np.ndarray): (symbols, days) validity mask
+        period (int): Window length
+    Returns:
+        np.ndarray: (symbols, days) means, NaN wherever the window is not fully populated
+    """
+    filled = np.where(mask, values, 0.0)
+    # Prefix sums with a leading zero column make every window sum a single subtraction
+    sums = np.concatenate([np.zeros((len(values), 1)), np.cumsum(filled, axis=1)], axis=1)
+    counts = np.concatenate([np.zeros((len(values), 1)), np.cumsum(mask, axis=1)], axis=1)
+    out = np.full(values.shape, np.nan)
+    if period <= values.shape[1]:
+        window_sum = sums[:, period:] - sums[:, :-period]
+        window_count = counts[:, period:] - counts[:, :-period]
+        out[:, period - 1:] = np.where(window_count == period, window_sum / period, np.nan)
+    return out
+
+
+def last_valid_mean(values, mask, days):
+    """
+    Mean of whatever bars exist in the last `days` sessions (like DataFrame.tail(days).mean()).
+    Returns:
+        np.ndarray: One value per symbol (NaN if there are no bars in the window)
+    """
+    window = values[:, -days:]
+    window_mask = mask[:, -days:]
+    counts = window_mask.sum(axis=1)
+    totals = np.where(window_mask, window, 0.0).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, totals / counts, np.nan)
+
+
+def rolling_valid_mean(values, mask, days):
+    """
+    last_valid_mean at every session: the mean of whatever bars exist in the `days` sessions up to
+    and including each one (fewer at the start of the block).
+    Returns:
+        np.ndarray: (symbols, days) means, NaN where the window has no bars
+    """
+    filled = np.where(mask, values, 0.0)
+    sums = np.concatenate([np.zeros((len(values), 1)), np.cumsum(filled, axis=1)], axis=1)
+    counts = np.concatenate([np.zeros((len(values), 1)), np.cumsum(mask, axis=1)], axis=1)
+    ends = np.arange(1, values.shape[1] + 1)
+    starts = np.maximum(ends - days, 0)
+    window_sum = sums[:, ends] - sums[:, starts]
+    window_count = counts[:, ends] - counts[:, starts]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(window_count > 0, window_sum / window_count, np.nan)
+
+
+# INDICATORS **************************************************************************************
+def sma(block, period, field='close'):
+    """
+    Simple moving average of a field for every symbol and session.
+    Returns:
+        np.ndarray: (symbols, days) SMA values (NaN until `period` bars are available)
+    """
+    return rolling_mean(getattr(block, field), block.mask, period)
+
+
+def true_range(block):
+    """
+    True range for every symbol and session (NaN on a symbol's first bar, like TA-Lib).
+    Returns:
+        np.ndarray: (symbols, days) true range values
+    """
+    prev_close = np.full(block.close.shape, np.nan)
+    prev_close[:, 1:] = block.close[:, :-1]
+    ranges = np.stack([
+        block.high - block.low,
+        np.abs(block.high - prev_close),
+        np.abs(block.low - prev_close),
+    ])
+    # Any NaN (missing bar or missing previous close) makes the true range NaN
+    return ranges.max(axis=0)
+
+
+def atr(block, period=14, window=None):
+    """
+    Wilder's Average True Range for every symbol, matching talib.ATR on the same bars.
+    The first value is the mean of the first `period` true ranges and is then smoothed with
+    (prev * (period - 1) + tr) / period. A gap in a symbol's bars restarts its smoothing.
+    Args:
+        block (BarBlock): Aligned bars
+        period (int): ATR period (default: 14)
+        window (int): Only use the last `window` sessions, e.g. the 50 bars filter_atr.py fetches
+    Returns:
+        np.ndarray: (symbols, days) ATR values
+    """
+    if window is not None:
+        block = slice_block(block, window)
+    tr = true_range(block)
+    n_symbols, n_days = tr.shape
+    out = np.full(tr.shape, np.nan)
+    value = np.full(n_symbols, np.nan)
+    seed_sum = np.zeros(n_symbols)
+    seed_count = np.zeros(n_symbols, dtype=int)
+    # One vectorized step per session across every symbol
+    for day in range(n_days):
+        current = tr[:, day]
+        valid = ~np.isnan(current)
+        # Gaps restart the seed
+        seed_sum[~valid] = 0.0
+        seed_count[~valid] = 0
+        value[~valid] = np.nan
+        seeding = valid & (seed_count < period)
+        seed_sum[seeding] += current[seeding]
+        seed_count[seeding] += 1
+        seeded = seeding & (seed_count == period)
+        value[seeded] = seed_sum[seeded] / period
+        smoothing = valid & ~seeding
+        value[smoothing] = (value[smoothing] * (period - 1) + current[smoothing]) / period
+        out[:, day] = value
+    return out
+
+
+def windowed_atr(block, period=14, window=50):
+    """
+    ATR computed over only the last `window` sessions up to each session, for every session at once
+    (atr(block, period, window) gives just the latest of these values).
+    Within a window of `window` bars there are window - 1 true ranges; the seed is the mean of the first
+    `period` of them and the remaining m are Wilder-smoothed, so the value is a fixed weighted sum of
+    the window's true ranges: r^m / period for the seed ranges and r^(m - i) / period for the i-th
+    smoothed one, with r = (period - 1) / period.
+    Returns:
+        np.ndarray: (symbols, days) ATR values, NaN until a full window of consecutive bars exists
+    """
+    tr = true_range(block)
+    n_symbols, n_days = tr.shape
+    out = np.full(tr.shape, np.nan)
+    length = window - 1
+    smoothed = length - period
+    if smoothed < 0 or length > n_days:
+        return out
+    ratio = (period - 1) / period
+    weights = np.concatenate([np.full(period, ratio ** smoothed / period),
+                              ratio ** np.arange(smoothed - 1, -1, -1) / period])
+    # One shifted multiply-add per position in the window, over every symbol and session at once
+    windows = n_days - length + 1
+    values = np.zeros((n_symbols, windows))
+    for position, weight in enumerate(weights):
+        values += weight * tr[:, position:position + windows]
+    out[:, length - 1:] = values
+    return out
+
+
+def avg_volume(block, days=20):
+    """
+    Average volume over the last `days` sessions for every symbol.
+    Returns:
+        np.ndarray: One value per symbol
+    """
+    return last_valid_mean(block.volume, block.mask, days)
+
+
+def rel_volume(block, avg_days=20):
+    """
+    Latest session's volume divided by the average volume of the last `avg_days` sessions.
+    Returns:
+        np.ndarray: One value per symbol (NaN when there is no volume)
+    """
+    average = avg_volume(block, avg_days)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(average > 0, block.volume[:, -1] / average, np.nan)
+
+
+def latest(values):
+    """
+    Most recent value of a (symbols, days) indicator array.
+    """
+    return values[:, -1]
+
+
+def slice_block(block, days):
+    """
+    Keep only the last `days` sessions of a BarBlock.
+    """
+    return BarBlock(block.symbols, block.dates[-days:],
+                    *(getattr(block, field)[:, -days:] for field in FIELDS), block.mask[:, -days:])
@@ -1 +1,281 @@
+# LIBRARIES ***************************************************************************************
+from ib_insync import *  # For connecting to Interactive Brokers TWS API
+import pandas as pd  # For handling the stock list and data manipulation
+import numpy as np  # For the rows that passed the chain
+import os  # For building paths relative to this folder
+from fetch_engine import fetch_histories, is_retryable, FetchResult  # For concurrent, pacing-aware bar downloads
+from bar_cache import BarCache  # For reusing bars downloaded on earlier runs
+from routing import make_routed_contract  # For exchange-aware contracts from the routing table
+from filter_chain import DEFAULT_CHAIN, bars_needed, evaluate_chain_block  # The uptrend filters
+from filter_chain import state_spec, evaluate_chain_state  # For evaluating the chain from the rolling state
+from indicators import build_block  # For evaluating the whole universe in one vectorized pass
+from stage_table import read_stock_table, write_stage_table, BAR_START, BAR_END  # For typed stock / result tables
+from ib_pool import IBPool  # For spreading the requests over several IB connections
+from market_scanner import scan_candidates, prefilter_universe  # For the server-side shortlist
+from checkpoint import ScanCheckpoint  # For resuming an interrupted scan
+from prescreen import apply_prescreen, DEFAULT_PRESCREEN  # For the local fundamental pre-screen
+from telemetry import Telemetry  # For run timings, request counters and IB error codes
+from rolling_state import RollingState  # For the incremental daily scan
+from universe import Universe, universe_path  # For the Feather universe and its symbol index
+from topk import TopK, prior_scores, rank_by_prior, trend_quality, TOP_K_CHUNK  # For the top-K scan
 
+# PATHS *******************************************************************************************
+HERE = os.path.dirname(os.path.abspath(__file__))
+UNIVERSE_FILE = universe_path()  # merged_stocks.feather (or .csv if merge.py has not written it)
+OUTPUT_CSV = os.path.join(HERE, 'nyse_uptrend_stocks.csv')
+OUTPUT_TABLE = os.path.join(HERE, 'nyse_uptrend_stocks.parquet')
+
+# IB CONNECTIONS **********************************************************************************
+# Client IDs of the scan's connection pool (the single-stage filter scripts use client ID 1)
+CLIENT_IDS = (11, 12, 13, 14)
+
+# INCREMENTAL SCAN ********************************************************************************
+# Rolling indicator state of the incremental scan (cache/rolling_state/<name>.npz)
+STATE_NAME = 'uptrend_scan'
+# Bars requested for symbols that already have a state: enough to reach back over a long weekend
+# to the last bar in the state (symbols that cannot are fetched again with the full window)
+INCREMENTAL_DAYS = 5
+
+
+# FUSED UPTREND SCAN ******************************************************************************
+def run_uptrend_scan(csv_file, chain=DEFAULT_CHAIN, client_ids=CLIENT_IDS, ib_factory=IB, market_scanner=False,
+                     resume=False, prescreen=None, incremental=False, top_k=None):
+    """
+    Run the whole uptrend filter chain in one pass: fetch the longest history any filter needs once
+    per symbol, then evaluate volume, relative volume, ATR and the SMA filters on the same bars.
+    The chain runs in the given order and is not reordered by filter_stats: every symbol gets the
+    full history in a single request, so there is no later download to save. Only the streaming
+    pipeline (pipeline.run_pipeline with adaptive=True) fetches long histories for survivors only.
+    Args:
+        csv_file (str): Path to the stock list (Feather universe, CSV or stage table)
+        chain (list): (filter name, params dict) pairs from filter_chain.FILTERS, applied in order
+        client_ids (iterable): Client IDs of the IB connection pool
+        ib_factory (callable): Creates each pool member (default: IB)
+        market_scanner (bool): Only scan the symbols IB's market scanners return, using the chain's
+            average volume threshold. A lossy fast path: the scanners rank by today's volume and move
+            with at most 50 rows per price band, so liquid stocks having a quiet session can be
+            missed (default: False)
+        resume (bool): Reuse the downloads of an interrupted run from today with the same settings
+            instead of requesting them again (default: False)
+        prescreen (list): (column, operator, value) predicates on the stock list columns, applied
+            before anything is requested from IB (default: none, see prescreen.DEFAULT_PRESCREEN)
+        incremental (bool): Keep a persisted rolling indicator state and only append each symbol's
+            new closed bars to it, instead of recomputing the indicators over the full window.
+            Evaluates the last closed session, so it is meant for the daily scan after the close
+            (default: False)
+        top_k (int): Only find the best top_k candidates by score (prior x trend quality, see topk.py):
+            symbols are downloaded in order of their prior from the stock list and the previous run,
+            and the scan stops once no remaining symbol can beat the top_k-th score (default: scan
+            every symbol)
+    Returns:
+        pd.DataFrame: Stocks that passed every filter, with the computed metrics appended (with top_k,
+            the best top_k of them by score, best first)
+    Raises:
+        ValueError: If top_k is combined with incremental (the incremental scan is already cheap)
+    """
+    if top_k and incremental:
+        raise ValueError("top_k and incremental cannot be combined")
+
+    # Read the stock list (Feather universe, CSV or stage table)
+    df = read_stock_table(csv_file)
+
+    # Drop stocks failing the local pre-screen before anything is sent to IB
+    if prescreen:
+        df = apply_prescreen(df, prescreen)
+
+    # One window covers every filter (e.g. 200 bars for the SMA200 check)
+    data_days = bars_needed(chain)
+
+    # Initialize a pool of IB connections
+    ib = IBPool('127.0.0.1', 7497, client_ids=client_ids, ib_factory=ib_factory)
+    # Timings, request counters and IB error codes, exported at the end of the run
+    telemetry = Telemetry('uptrend_scan')
+    try:
+        # Connect every member to TWS or IB Gateway
+        with telemetry.phase('connect'):
+            ib.connect()
+
+        # Suppress IB API error messages for invalid contracts
+        ib.errorEvent += lambda reqId, errorCode, errorString, contract: None
+
+        # Count IB error codes and bytes received (over every pool member) for the telemetry
+        telemetry.attach(ib)
+
+        # Let IB's scanners shortlist liquid stocks so only those need historical bars
+        if market_scanner:
+            volume_params = dict(chain).get('avg_volume', {})
+            with telemetry.phase('market_scanner'):
+                candidates = scan_candidates(ib, min_avg_volume=volume_params.get('min_avg_volume'))
+            df = prefilter_universe(df, candidates)
+            print(f"Market scanners shortlisted {len(df)} of {len(candidates)} candidates from the stock list")
+
+        # Every finished download is written to the checkpoint right away (the bars themselves go to the
+        # bar cache), so an interrupted scan can pick up where it stopped
+        checkpoint = ScanCheckpoint('uptrend_scan', resume=resume, params={
+            'csv_file': csv_file, 'chain': chain, 'market_scanner': market_scanner})
+        cache = BarCache()
+
+        # Incremental mode: symbols that already have a rolling state only need their newest bars
+        state = RollingState.load(STATE_NAME, state_spec(chain)) if incremental else None
+
+        # Symbols the interrupted run already finished: known failures, or bars that reached the cache
+        resumed = {}
+        for symbol, outcome in checkpoint.results.items():
+            bars = None
+            if outcome['error'] is None:
+                bars, entry = cache.load(symbol, ('1 day', 'TRADES', True))
+                if bars is None:
+                    continue
+                bars = bars.tail(data_days).reset_index(drop=True)
+            resumed[symbol] = FetchResult(symbol, None, bars, outcome['error'])
+        if resumed:
+            print(f"Resuming: {len(resumed)} symbols already downloaded today")
+
+        # Dropped connections and other exceptions are not recorded, so they are retried on the next run
+        def record_download(result):
+            if not is_retryable(result):
+                checkpoint.record(result.symbol, {'error': result.error})
+
+        # Top-K mode: score the candidates of each downloaded chunk into a bounded heap
+        priors = prior_scores(df, previous=OUTPUT_TABLE) if top_k else {}
+        ranking = TopK(top_k) if top_k else None
+
+        def offer_candidates(chunk_results):
+            chunk_block = build_block({symbol: result.hist_data for symbol, result in chunk_results.items()},
+                                      data_days)
+            chunk_passed, chunk_metrics, _ = evaluate_chain_block(chunk_block, chain)
+            for row in np.flatnonzero(chunk_passed):
+                symbol = chunk_block.symbols[row]
+                values = {name: values[row] for name, values in chunk_metrics.items()}
+                ranking.push(priors.get(symbol, 0.0) * trend_quality(values), symbol)
+
+        # Download bars for every remaining symbol once
+        remaining = [symbol for symbol in df['Symbol'] if symbol not in resumed]
+        known = [symbol for symbol in remaining if state is not None and symbol in state]
+        known_set = set(known)
+        try:
+            download = [symbol for symbol in remaining if symbol not in known_set]
+            if top_k:
+                # Best priors first, a chunk at a time, until the remaining priors (upper bounds of the
+                # scores) cannot beat the top_k-th score any more
+                download = rank_by_prior(download, priors)
+                if resumed:
+                    offer_candidates(resumed)
+                results = {}
+                for start in range(0, len(download), TOP_K_CHUNK):
+                    if not ranking.can_beat(priors.get(download[start], 0.0)):
+                        print(f"Top {top_k} settled after {start} of {len(download)} symbols")
+                        telemetry.count('top_k_skipped', len(download) - start)
+                        break
+                    chunk = fetch_histories(ib, download[start:start + TOP_K_CHUNK], data_days,
+                                            make_contract=make_routed_contract, cache=cache,
+                                            on_result=record_download, telemetry=telemetry,
+                                            desc=f"Scanning stocks for uptrend ({start:,}/{len(download):,})")
+                    results.update(chunk)
+                    offer_candidates(chunk)
+            else:
+                results = fetch_histories(ib, download, data_days, make_contract=make_routed_contract, cache=cache,
+                                          on_result=record_download, telemetry=telemetry,
+                                          desc="Scanning stocks for uptrend")
+            if known:
+                results.update(fetch_histories(ib, known, INCREMENTAL_DAYS, make_contract=make_routed_contract,
+                                               cache=cache, on_result=record_download, telemetry=telemetry,
+                                               desc="Updating stocks for uptrend"))
+        finally:
+            checkpoint.close()
+        results = {**resumed, **results}
+
+        # Append the new bars to the rolling state; symbols whose short history does not reach back to
+        # their state (a missed day, a new window) are fetched again with the full window and rebuilt
+        if incremental:
+            with telemetry.phase('rolling_state'):
+                histories = {symbol: result.hist_data for symbol, result in results.items()}
+                state.update({symbol: bars for symbol, bars in histories.items() if symbol not in known_set}, full=True)
+                stale = state.update({symbol: histories[symbol] for symbol in known})
+                if stale:
+                    refetched = fetch_histories(ib, stale, data_days, make_contract=make_routed_contract, cache=cache,
+                                                telemetry=telemetry, desc="Rebuilding stale rolling states")
+                    results.update(refetched)
+                    state.update({symbol: result.hist_data for symbol, result in refetched.items()}, full=True)
+                state.save(STATE_NAME)
+
+        # Report symbols whose contract or data request failed
+        for symbol, result in results.items():
+            if result.error:
+                print(f"✗ {symbol}: {result.error}")
+
+        if incremental:
+            # Evaluate the whole chain from the rolling state, O(1) per symbol
+            symbols = [symbol for symbol, result in results.items()
+                       if result.hist_data is not None and symbol in state]
+            with telemetry.phase('evaluate_chain'):
+                passed, metrics, failed_at = evaluate_chain_state(state, symbols, chain)
+            first_bar, last_bar = state.bar_range(state.rows(symbols))
+        else:
+            # Load every symbol's bars into one aligned symbols x days block
+            with telemetry.phase('build_block'):
+                block = build_block({symbol: result.hist_data for symbol, result in results.items()}, data_days)
+            symbols = block.symbols
+
+            # Evaluate the whole chain for the entire universe at once
+            with telemetry.phase('evaluate_chain'):
+                passed, metrics, failed_at = evaluate_chain_block(block, chain)
+
+            # First and last session each symbol actually has bars for (the bar range behind its metrics)
+            first_bar = block.dates[block.mask.argmax(axis=1)]
+            last_bar = block.dates[block.mask.shape[1] - 1 - block.mask[:, ::-1].argmax(axis=1)]
+
+        # Index the stock list once instead of scanning it for every passing symbol
+        stock_rows = Universe(df)
+
+        # Initialize list for filtered stocks
+        filtered_stocks = []
+        for row, symbol in enumerate(symbols):
+            if passed[row]:
+                stock_data = stock_rows.row(symbol)
+                stock_data.update({name: values[row] for name, values in metrics.items()})
+                stock_data.update({BAR_START: first_bar[row], BAR_END: last_bar[row]})
+                filtered_stocks.append(stock_data)
+                print(f"✓ {symbol}: passed all {len(chain)} filters")
+            else:
+                print(f"✗ {symbol}: failed {chain[failed_at[row]][0]} {chain[failed_at[row]][1]}")
+
+        if top_k:
+            # Keep the best top_k of the passing stocks, scored like the heap that ended the scan
+            best = TopK(top_k)
+            for stock_data in filtered_stocks:
+                stock_data['score'] = priors.get(stock_data['Symbol'], 0.0) * trend_quality(stock_data)
+                best.push(stock_data['score'], stock_data['Symbol'], stock_data)
+            filtered_stocks = [stock_data for _, _, stock_data in best.best()]
+
+        # Convert filtered stocks to DataFrame
+        return pd.DataFrame(filtered_stocks)
+
+    except Exception as e:
+        print(f"Error during IB API operations: {e}")
+        return pd.DataFrame()
+
+    finally:
+        telemetry.detach(ib)
+        telemetry.write()
+        ib.disconnect()
+
+# MAIN SCRIPT ************************************************************************************
+if __name__ == "__main__":
+    # Filter stocks through the full uptrend chain
+    filtered_stocks = run_uptrend_scan(UNIVERSE_FILE, chain=DEFAULT_CHAIN, resume=True, prescreen=DEFAULT_PRESCREEN)
+
+    # Check if filtered DataFrame is not empty
+    if not filtered_stocks.empty:
+        print(f"\nFound {len(filtered_stocks)} stocks in an uptrend:")
+        print(filtered_stocks.head())
+
+        # Save to new CSV
+        filtered_stocks.to_csv(OUTPUT_CSV, index=False)
+        print(f"Saved to '{OUTPUT_CSV}'")
+
+        # Save the same stocks with their metrics as a typed table
+        write_stage_table(filtered_stocks, OUTPUT_TABLE)
+        print(f"Saved to '{OUTPUT_TABLE}'")
+    else:
+        print("No stocks met the uptrend criteria or an error occurred.")
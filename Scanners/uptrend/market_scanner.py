@@ -0,0 +1,123 @@
+# LIBRARIES ***************************************************************************************
+from ib_insync import *  # For connecting to Interactive Brokers TWS API
+import asyncio  # For running several scanner subscriptions at once
+from tqdm import tqdm  # For progress bar tracking
+
+# SCANNER SETTINGS ********************************************************************************
+# IB returns at most 50 rows per scanner subscription, so the universe is cut into price bands
+# and scanned with several scan codes to get past that cap. The scan codes rank by the current
+# session's volume or move, so a liquid stock having a quiet day can still fall outside a crowded
+# band: the shortlist is a lossy fast path, not a replacement for checking the whole stock list
+MAX_ROWS = 50
+# NYSE, NASDAQ and the other major US exchanges, matching the listings merged_stocks covers
+DEFAULT_LOCATIONS = ('STK.US.MAJOR',)
+DEFAULT_SCAN_CODES = ('MOST_ACTIVE', 'HOT_BY_VOLUME', 'TOP_PERC_GAIN', 'TOP_PERC_LOSE')
+DEFAULT_PRICE_BANDS = ((1, 5), (5, 10), (10, 20), (20, 50), (50, 100), (100, None))
+# TWS allows 10 scanner subscriptions at a time; leave room for other clients
+MAX_CONCURRENT_SCANS = 8
+
+
+# SUBSCRIPTIONS ***********************************************************************************
+def make_subscriptions(locations=DEFAULT_LOCATIONS, scan_codes=DEFAULT_SCAN_CODES, price_bands=DEFAULT_PRICE_BANDS,
+                       min_volume=None):
+    """
+    One ScannerSubscription per location, scan code and price band.
+    Args:
+        locations (iterable): IB location codes, e.g. 'STK.NYSE', 'STK.US.MAJOR'
+        scan_codes (iterable): IB scan codes, e.g. 'MOST_ACTIVE'
+        price_bands (iterable): (above price, below price) pairs; None leaves a side open
+        min_volume (int): Minimum volume of the current session (default: no limit)
+    Returns:
+        list: ScannerSubscription objects
+    """
+    subscriptions = []
+    for location in locations:
+        for scan_code in scan_codes:
+            for above, below in price_bands:
+                # Only set the fields in use; the rest keep IB's "unset" defaults
+                settings = {'instrument': 'STK', 'locationCode': location, 'scanCode': scan_code,
+                            'numberOfRows': MAX_ROWS}
+                if above is not None:
+                    settings['abovePrice'] = above
+                if below is not None:
+                    settings['belowPrice'] = below
+                if min_volume is not None:
+                    settings['aboveVolume'] = int(min_volume)
+                subscriptions.append(ScannerSubscription(**settings))
+    return subscriptions
+
+
+def to_universe_symbol(contract):
+    """
+    Convert an IB symbol to the stockanalysis spelling used in merged_stocks.csv ('BRK B' -> 'BRK.B').
+    """
+    return contract.symbol.replace(' ', '.')
+
+
+# SERVER-SIDE CANDIDATES **************************************************************************
+async def scan_candidates_async(ib, locations=DEFAULT_LOCATIONS, scan_codes=DEFAULT_SCAN_CODES,
+                                price_bands=DEFAULT_PRICE_BANDS, min_volume=None, min_avg_volume=None,
+                                desc="Running market scanners"):
+    """
+    Ask IB's market scanners for a shortlist of liquid stocks instead of walking the whole universe.
+    Each subscription is opened with reqScannerSubscription, read once and cancelled.
+    Args:
+        ib (IB): Connected IB instance or IBPool
+        locations (iterable): IB location codes
+        scan_codes (iterable): IB scan codes
+        price_bands (iterable): (above price, below price) pairs
+        min_volume (int): Minimum volume of the current session (default: no limit)
+        min_avg_volume (int): Minimum average daily volume, applied by IB's avgVolumeAbove filter
+        desc (str): Progress bar description (None to disable the bar)
+    Returns:
+        list: Candidate symbols in universe spelling, in the order the scanners ranked them
+    """
+    subscriptions = make_subscriptions(locations, scan_codes, price_bands, min_volume)
+    filter_options = []
+    if min_avg_volume is not None:
+        filter_options.append(TagValue('avgVolumeAbove', str(int(min_avg_volume))))
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_SCANS)
+    progress = tqdm(total=len(subscriptions), desc=desc, disable=desc is None)
+
+    async def scan_one(subscription):
+        async with semaphore:
+            try:
+                return await ib.reqScannerDataAsync(subscription, [], filter_options)
+            except Exception as e:
+                print(f"✗ Scanner {subscription.scanCode} {subscription.locationCode}: Error - {str(e)[:50]}...")
+                return []
+            finally:
+                progress.update(1)
+
+    try:
+        scans = await asyncio.gather(*(scan_one(subscription) for subscription in subscriptions))
+    finally:
+        progress.close()
+
+    # Union of every scan, without duplicates
+    candidates = {}
+    for rows in scans:
+        for row in rows:
+            candidates.setdefault(to_universe_symbol(row.contractDetails.contract), None)
+    return list(candidates)
+
+
+def scan_candidates(ib, **kwargs):
+    """
+    Blocking wrapper around scan_candidates_async.
+    """
+    return ib.run(scan_candidates_async(ib, **kwargs))
+
+
+def prefilter_universe(df, candidates):
+    """
+    Keep only the universe rows the market scanners returned.
+    Lossy: stocks that pass the filters but did not rank in today's scans are dropped (see MAX_ROWS).
+    Args:
+        df (pd.DataFrame): Stock list with a Symbol column
+        candidates (list): Symbols from scan_candidates
+    Returns:
+        pd.DataFrame: The shortlisted rows, in the stock list's order
+    """
+    return df[df['Symbol'].isin(set(candidates))].reset_index(drop=True)
@@ -0,0 +1,111 @@
+# LIBRARIES ***************************************************************************************
+import datetime as dt  # For failure timestamps and retry times
+import json  # For the on-disk store
+import os  # For building the cache path
+from contract_cache import ContractCache  # For the contract key the failures are stored under
+
+# CACHE SETTINGS **********************************************************************************
+# Every cache lives under one folder (set UPTREND_CACHE_DIR to move them all, e.g. for benchmarks)
+CACHE_ROOT = os.environ.get('UPTREND_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
+CACHE_PATH = os.path.join(CACHE_ROOT, 'negative.json')
+# Days to skip a symbol after each kind of failure. IB rarely starts knowing an unknown contract,
+# while a symbol without data may just be newly listed or halted
+DEFAULT_TTL_DAYS = {
+    'Invalid contract': 30,
+    'No data returned': 7,
+}
+
+
+# NEGATIVE CACHE **********************************************************************************
+class NegativeCache:
+    """
+    Persistent record of symbols that failed for a lasting reason ("Invalid contract",
+    "No data returned"), so scans skip them instead of spending a request on them every run.
+    Each entry keeps the reason, when the failure was first and last seen, and a retry_after time
+    (last seen + the reason's TTL). Entries are keyed like the contract cache, so a symbol that only
+    fails with one exchange routing is still tried with the others.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl_days=None):
+        """
+        Args:
+            path (str): JSON file holding the entries
+            ttl_days (dict): Days to skip a symbol per failure reason (default: DEFAULT_TTL_DAYS)
+        """
+        self.path = path
+        self.ttl_days = ttl_days or DEFAULT_TTL_DAYS
+        self._entries = {}
+        self._changed = False
+        if os.path.exists(path):
+            with open(path) as f:
+                self._entries = json.load(f)
+
+    def get(self, contract, now=None):
+        """
+        Look up an active failure for a contract.
+        Args:
+            contract (Contract): Unqualified contract as built by the scanner
+            now (datetime): Current time (default: now)
+        Returns:
+            dict: {'reason', 'first_seen', 'last_seen', 'failures', 'retry_after'}, or None when the
+                contract has no failure on record or its retry time has passed
+        """
+        entry = self._entries.get(ContractCache.key(contract))
+        if entry is None or (now or dt.datetime.now()) >= dt.datetime.fromisoformat(entry['retry_after']):
+            return None
+        return entry
+
+    def record(self, contract, reason, now=None):
+        """
+        Remember a failure. Reasons without a TTL (e.g. transient exceptions) are ignored.
+        Args:
+            contract (Contract): Unqualified contract as built by the scanner
+            reason (str): FetchResult error, e.g. "Invalid contract"
+            now (datetime): Time of the failure (default: now)
+        """
+        if reason not in self.ttl_days:
+            return
+        now = now or dt.datetime.now()
+        key = ContractCache.key(contract)
+        previous = self._entries.get(key)
+        self._entries[key] = {
+            'reason': reason,
+            'first_seen': previous['first_seen'] if previous else now.isoformat(),
+            'last_seen': now.isoformat(),
+            'failures': previous['failures'] + 1 if previous else 1,
+            'retry_after': (now + dt.timedelta(days=self.ttl_days[reason])).isoformat(),
+        }
+        self._changed = True
+
+    def clear(self, contract):
+        """
+        Forget a contract's failure, e.g. after it returned data again.
+        """
+        if self._entries.pop(ContractCache.key(contract), None) is not None:
+            self._changed = True
+
+    def invalidate(self, symbols):
+        """
+        Forget the failures of some symbols (every routing), e.g. after they were newly listed.
+        Args:
+            symbols (iterable): IB symbols, e.g. 'BRK B' (the symbol part of the contract key)
+        Returns:
+            int: Number of entries removed
+        """
+        symbols = set(symbols)
+        stale = [key for key in self._entries if key.split(':', 1)[0] in symbols]
+        for key in stale:
+            del self._entries[key]
+        self._changed = self._changed or bool(stale)
+        return len(stale)
+
+    def save(self):
+        """
+        Write the store to disk if anything changed.
+        """
+        if not self._changed:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(self._entries, f, indent=1)
+        self._changed = False
@@ -0,0 +1,323 @@
+# LIBRARIES ***************************************************************************************
+from ib_insync import *  # For connecting to Interactive Brokers TWS API
+import asyncio  # For the stage workers and the queues between them
+import collections  # For the Stage container
+import os  # For building paths relative to this folder
+import time  # For the latency to the first candidate
+import pandas as pd  # For the stock list and the candidate table
+from fetch_engine import fetch_histories_async, PacingLimiter, DEFAULT_MAX_REQUESTS, CACHE_FLUSH_EVERY  # For the bar downloads
+from bar_cache import BarCache  # For reusing bars downloaded on earlier runs
+from contract_cache import ContractCache  # For one contract store shared by every stage
+from negative_cache import NegativeCache  # For one negative cache shared by every stage
+from routing import make_routed_contract  # For exchange-aware contracts from the routing table
+from filter_chain import DEFAULT_CHAIN, FILTERS  # The uptrend filters
+from stage_table import read_stock_table, write_stage_table, bar_range  # For typed stage tables
+from ib_pool import IBPool  # For spreading the requests over several IB connections
+from prescreen import apply_prescreen, DEFAULT_PRESCREEN  # For the local fundamental pre-screen
+from telemetry import Telemetry  # For run timings, request counters and IB error codes
+from universe import Universe, universe_path  # For the Feather universe and its symbol index
+from topk import TopK, prior_scores, rank_by_prior, trend_quality  # For the top-K scan
+from filter_stats import FilterStats  # For ordering the stages by measured cost and pass rate
+
+# PATHS *******************************************************************************************
+HERE = os.path.dirname(os.path.abspath(__file__))
+UNIVERSE_FILE = universe_path()  # merged_stocks.feather (or .csv if merge.py has not written it)
+OUTPUT_CSV = os.path.join(HERE, 'nyse_uptrend_pipeline_stocks.csv')
+OUTPUT_TABLE = os.path.join(HERE, 'nyse_uptrend_pipeline_stocks.parquet')
+
+# PIPELINE SETTINGS *******************************************************************************
+# Client IDs of the pipeline's connection pool (the fused scan uses 11-14)
+CLIENT_IDS = (21, 22, 23, 24)
+# Symbols in flight per stage and connection. All stages share TWS's ~40 open requests per
+# connection, and later stages only see the survivors of earlier ones, so they get fewer
+STAGE_CONCURRENCY = (16, 8, 6, 4, 3, 3)
+# Symbols a stage worker fetches together (each batch is forwarded once all of it is evaluated)
+BATCH_SIZE = 8
+# Survivors that can wait between two stages; a full buffer makes the earlier stage wait
+BUFFER_SIZE = 100
+
+# One pipeline stage: a filter from filter_chain.FILTERS, its params and its symbols in flight
+Stage = collections.namedtuple('Stage', ['name', 'params', 'concurrency'])
+
+
+def make_stages(chain=DEFAULT_CHAIN, connections=1, concurrency=STAGE_CONCURRENCY):
+    """
+    Turn a filter chain into pipeline stages.
+    Args:
+        chain (list): (filter name, params dict) pairs from filter_chain.FILTERS, applied in order
+        connections (int): Number of IB connections (the concurrency scales with them)
+        concurrency (tuple): Symbols in flight per connection for each stage (the last value is
+            reused for any further stages)
+    Returns:
+        list: Stage for every filter of the chain
+    """
+    return [Stage(name, params, concurrency[min(position, len(concurrency) - 1)] * connections)
+            for position, (name, params) in enumerate(chain)]
+
+
+# STREAMING PIPELINE ******************************************************************************
+async def run_pipeline_async(ib, symbols, stages, make_contract=make_routed_contract, cache=None,
+                             batch_size=BATCH_SIZE, buffer_size=BUFFER_SIZE, on_candidate=None, telemetry=None,
+                             stop_feeding=None):
+    """
+    Run the filter stages as a streaming pipeline: every stage has its own workers and bounded input
+    queue, and a symbol that passes a stage goes straight on to the next one, so the stages overlap
+    and the first candidates come out while the rest of the universe is still being scanned.
+    A stage only downloads bars when the history carried over from the earlier stages is shorter
+    than it needs (e.g. ATR's 50 bars after the 20 bars of the volume stages).
+    Args:
+        ib (IB): Connected IB instance or IBPool
+        symbols (list): Ticker symbols to scan
+        stages (list): Stage for every filter, in order (see make_stages)
+        make_contract (callable): Builds an unqualified contract from a symbol
+        cache (BarCache): On-disk bar cache (default: no cache)
+        batch_size (int): Symbols a stage worker fetches together
+        buffer_size (int): Capacity of each stage's input queue
+        on_candidate (callable): Called with each candidate as soon as it passes the last stage
+        telemetry (Telemetry): Records the stage counts, fetch timings and time to the first candidate
+        stop_feeding (callable): Called with each symbol before it enters the first stage; returning
+            True ends the input there (symbols already in the pipeline still finish), e.g. once a
+            top-K scan cannot improve
+    Returns:
+        list: Candidate dicts ('symbol', 'hist_data', 'metrics'), in the order they came out
+    """
+    telemetry = telemetry or Telemetry('pipeline')
+    # Every stage shares one pacing window and the contract / negative caches
+    limiter = PacingLimiter(DEFAULT_MAX_REQUESTS * getattr(ib, 'size', 1))
+    contract_cache = ContractCache()
+    negative_cache = NegativeCache()
+    queues = [asyncio.Queue(buffer_size) for _ in stages]
+    # Each worker keeps up to one batch in flight
+    workers = [max(1, -(-stage.concurrency // batch_size)) for stage in stages]
+    candidates = []
+    start = time.perf_counter()
+    # Symbols fetched since the caches were last written. The workers fetch small batches with
+    # persist=False, so the stores are written here every CACHE_FLUSH_EVERY symbols and once at the end
+    # instead of after every batch
+    unsaved = 0
+
+    def save_caches():
+        nonlocal unsaved
+        unsaved = 0
+        contract_cache.save()
+        negative_cache.save()
+        if cache:
+            cache.flush()
+
+    async def forward(position, item):
+        if position + 1 < len(stages):
+            await queues[position + 1].put(item)
+            return
+        if not candidates:
+            telemetry.add_time('first_candidate', time.perf_counter() - start)
+        candidates.append(item)
+        if on_candidate:
+            on_candidate(item)
+
+    async def work(position):
+        nonlocal unsaved
+        name, params, _ = stages[position]
+        check, _, bars_needed = FILTERS[name][:3]
+        days = bars_needed(params)
+        queue = queues[position]
+        done = False
+        while not done:
+            # Wait for one symbol, then take whatever else is already queued (up to a batch).
+            # None marks the end of the input; there is one per worker, so each worker takes only one
+            batch = [await queue.get()]
+            while batch[-1] is not None and len(batch) < batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            done = batch[-1] is None
+            batch = [item for item in batch if item is not None]
+
+            # Download bars only for symbols whose carried history is too short for this stage
+            short = [item['symbol'] for item in batch if item['days'] < days]
+            fetched = {}
+            if short:
+                fetch_start = time.perf_counter()
+                fetched = await fetch_histories_async(
+                    ib, short, days, make_contract=make_contract, concurrency=len(short), limiter=limiter,
+                    cache=cache, contract_cache=contract_cache, negative_cache=negative_cache,
+                    telemetry=telemetry, desc=None, persist=False)
+                unsaved += len(short)
+                if unsaved >= CACHE_FLUSH_EVERY:
+                    save_caches()
+                # Download time and bars of the stage, for the filter statistics (see filter_stats)
+                telemetry.add_time(f'stage{position}_{name}_fetch', time.perf_counter() - fetch_start)
+                telemetry.count(f'stage{position}_{name}_fetched_bars', days * len(short))
+
+            for item in batch:
+                symbol = item['symbol']
+                telemetry.count(f'stage{position}_{name}_in')
+                result = fetched.get(symbol)
+                if result is not None:
+                    if result.error:
+                        telemetry.count(f'stage{position}_{name}_errors')
+                        continue
+                    item = {**item, 'days': days, 'hist_data': result.hist_data}
+                try:
+                    with telemetry.timed(f'stage{position}_{name}_check', symbol):
+                        passed, values, message = check(item['hist_data'], **params)
+                except Exception as e:
+                    print(f"✗ {symbol}: Error - {str(e)[:50]}...")
+                    continue
+                if passed:
+                    telemetry.count(f'stage{position}_{name}_passed')
+                    await forward(position, {**item, 'metrics': {**item['metrics'], **values}})
+
+    async def run_stage(position):
+        await asyncio.gather(*(work(position) for _ in range(workers[position])))
+        # Tell every worker of the next stage that no more symbols are coming
+        if position + 1 < len(stages):
+            for _ in range(workers[position + 1]):
+                await queues[position + 1].put(None)
+
+    async def feed():
+        for position, symbol in enumerate(symbols):
+            if stop_feeding and stop_feeding(symbol):
+                telemetry.count('top_k_skipped', len(symbols) - position)
+                break
+            await queues[0].put({'symbol': symbol, 'days': 0, 'hist_data': None, 'metrics': {}})
+        for _ in range(workers[0]):
+            await queues[0].put(None)
+
+    tasks = [asyncio.ensure_future(feed())] + [asyncio.ensure_future(run_stage(position))
+                                               for position in range(len(stages))]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # A failing stage would leave the others waiting on their queues
+        for task in tasks:
+            task.cancel()
+        save_caches()
+    return candidates
+
+
+def run_pipeline(csv_file, chain=DEFAULT_CHAIN, client_ids=CLIENT_IDS, ib_factory=IB, concurrency=STAGE_CONCURRENCY,
+                 batch_size=BATCH_SIZE, buffer_size=BUFFER_SIZE, prescreen=None, on_candidate=None, top_k=None,
+                 adaptive=False):
+    """
+    Scan a stock list through the uptrend chain as a streaming pipeline (see run_pipeline_async).
+    Args:
+        csv_file (str): Path to the stock list (Feather universe, CSV or stage table)
+        chain (list): (filter name, params dict) pairs from filter_chain.FILTERS, applied in order
+        client_ids (iterable): Client IDs of the IB connection pool
+        ib_factory (callable): Creates each pool member (default: IB)
+        concurrency (tuple): Symbols in flight per connection for each stage
+        batch_size (int): Symbols a stage worker fetches together
+        buffer_size (int): Capacity of each stage's input queue
+        prescreen (list): (column, operator, value) predicates on the stock list columns, applied
+            before anything is requested from IB (default: none, see prescreen.DEFAULT_PRESCREEN)
+        on_candidate (callable): Called with each candidate's stock row (with its metrics) as soon as
+            it passes the last stage (default: print it)
+        top_k (int): Only find the best top_k candidates by score (prior x trend quality, see topk.py):
+            symbols enter the pipeline in order of their prior, and no more are fed once none of the
+            remaining ones can beat the top_k-th score (default: scan every symbol)
+        adaptive (bool): Run the filters in the order with the lowest expected cost according to the
+            pass rates and costs measured on earlier runs, and add this run's measurements (see
+            filter_stats.FilterStats); the chain's own order is kept until a cheaper one is known
+            (default: False)
+    Returns:
+        pd.DataFrame: Stocks that passed every stage, with the computed metrics, in the order they came out
+            (with top_k, the best top_k of them by score, best first)
+    """
+    # Read the stock list
+    df = read_stock_table(csv_file)
+
+    # Drop stocks failing the local pre-screen before anything is sent to IB
+    if prescreen:
+        df = apply_prescreen(df, prescreen)
+
+    # Index the stock list once for building the candidate rows
+    stock_rows = Universe(df)
+    on_candidate = on_candidate or (lambda stock: print(f"✓ {stock['Symbol']}: passed all {len(chain)} filters"))
+    filtered_stocks = []
+
+    # Top-K mode: best priors first, and a bounded heap of the best candidates by score
+    symbols = stock_rows.symbols()
+    stop_feeding = None
+    if top_k:
+        priors = prior_scores(df, previous=OUTPUT_TABLE)
+        symbols = rank_by_prior(symbols, priors)
+        ranking = TopK(top_k)
+        # The priors only fall from here on, so once one cannot beat the heap none of the rest can
+        stop_feeding = lambda symbol: not ranking.can_beat(priors.get(symbol, 0.0))
+
+    def add_candidate(item):
+        stock_data = stock_rows.row(item['symbol'])
+        stock_data.update(item['metrics'])
+        stock_data.update(bar_range(item['hist_data']))
+        if top_k:
+            stock_data['score'] = priors.get(item['symbol'], 0.0) * trend_quality(item['metrics'])
+            ranking.push(stock_data['score'], item['symbol'], stock_data)
+        filtered_stocks.append(stock_data)
+        on_candidate(stock_data)
+
+    def results():
+        if top_k:
+            return pd.DataFrame([stock_data for _, _, stock_data in ranking.best()])
+        return pd.DataFrame(filtered_stocks)
+
+    # Cheapest, most selective filters first, so long histories are only fetched for their survivors
+    if adaptive:
+        stats = FilterStats()
+        ordered = stats.order_chain(chain)
+        if ordered != list(chain):
+            print("Filter order: " + " -> ".join(name for name, _ in ordered))
+        chain = ordered
+
+    # Initialize a pool of IB connections
+    ib = IBPool('127.0.0.1', 7497, client_ids=client_ids, ib_factory=ib_factory)
+    # Timings, request counters and IB error codes, exported at the end of the run
+    telemetry = Telemetry('uptrend_pipeline')
+    try:
+        # Connect every member to TWS or IB Gateway
+        with telemetry.phase('connect'):
+            ib.connect()
+
+        # Suppress IB API error messages for invalid contracts
+        ib.errorEvent += lambda reqId, errorCode, errorString, contract: None
+
+        # Count IB error codes and bytes received (over every pool member) for the telemetry
+        telemetry.attach(ib)
+
+        # Stream the symbols through the stages
+        stages = make_stages(chain, ib.size, concurrency)
+        with telemetry.phase('pipeline'):
+            ib.run(run_pipeline_async(ib, symbols, stages, cache=BarCache(), batch_size=batch_size,
+                                      buffer_size=buffer_size, on_candidate=add_candidate, telemetry=telemetry,
+                                      stop_feeding=stop_feeding))
+
+        # Convert filtered stocks to DataFrame
+        return results()
+
+    except Exception as e:
+        print(f"Error during IB API operations: {e}")
+        return results()
+
+    finally:
+        telemetry.detach(ib)
+        telemetry.write()
+        if adaptive:
+            stats.record_run(telemetry, chain)
+            stats.save()
+        ib.disconnect()
+
+# MAIN SCRIPT ************************************************************************************
+if __name__ == "__main__":
+    # Stream the stock list through the full uptrend chain, in the order measured cheapest on earlier runs
+    filtered_stocks = run_pipeline(UNIVERSE_FILE, chain=DEFAULT_CHAIN, prescreen=DEFAULT_PRESCREEN, adaptive=True)
+
+    # Check if filtered DataFrame is not empty
+    if not filtered_stocks.empty:
+        print(f"\nFound {len(filtered_stocks)} stocks in an uptrend:")
+        print(filtered_stocks.head())
+
+        # Save to new CSV
+        filtered_stocks.to_csv(OUTPUT_CSV, index=False)
+        print(f"Saved to '{OUTPUT_CSV}'")
+
+        # Save the metrics and bar range with the stocks as a typed table
+        write_stage_table(filtered_stocks, OUTPUT_TABLE)
+    else:
+        print("No stocks met the uptrend criteria or an error occurred.")
@@ -0,0 +1,73 @@
+# LIBRARIES ***************************************************************************************
+import operator  # For the comparison predicates
+import numpy as np  # For combining the predicate masks
+import pandas as pd  # For the stock list columns
+
+# PREDICATES **************************************************************************************
+# A pre-screen is a list of (column, operator, value) predicates on the stockanalysis columns of the
+# stock list (Market Cap, Stock Price, % Change, Revenue). A stock has to pass every predicate.
+OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+    'in': lambda column, values: column.isin(values),
+    'notnull': lambda column, _: column.notna(),
+    'isnull': lambda column, _: column.isna(),
+}
+
+# Liquid, established companies: price above $5, market cap above $1B, reported revenue
+DEFAULT_PRESCREEN = [
+    ('Stock Price', '>', 5),
+    ('Market Cap', '>', 1e9),
+    ('Revenue', 'notnull', None),
+]
+
+
+# EVALUATION **************************************************************************************
+def numeric_column(column):
+    """
+    Read a stock list column as numbers, e.g. '% Change' values like '-0.05%' or '1,234'.
+    Values that are not numbers become NaN (and fail every comparison).
+    """
+    if not pd.api.types.is_numeric_dtype(column):
+        column = column.astype(str).str.replace('%', '', regex=False).str.replace(',', '', regex=False)
+    return pd.to_numeric(column, errors='coerce')
+
+
+def prescreen_mask(df, predicates):
+    """
+    Evaluate every predicate on the whole stock list at once.
+    Args:
+        df (pd.DataFrame): Stock list or stage table
+        predicates (list): (column, operator, value) tuples, operator being a key of OPERATORS
+    Returns:
+        np.ndarray: True for the rows passing every predicate
+    Raises:
+        KeyError: If a predicate names a column the stock list does not have
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for column, op, value in predicates:
+        if column not in df:
+            raise KeyError(f"Pre-screen column '{column}' is not in the stock list")
+        values = df[column]
+        if op in ('>', '>=', '<', '<='):
+            values = numeric_column(values)
+        mask &= OPERATORS[op](values, value).to_numpy(dtype=bool)
+    return mask
+
+
+def apply_prescreen(df, predicates):
+    """
+    Drop the stocks failing a pre-screen before any request is sent to IB.
+    Args:
+        df (pd.DataFrame): Stock list or stage table
+        predicates (list): (column, operator, value) tuples
+    Returns:
+        pd.DataFrame: Rows passing every predicate
+    """
+    screened = df[prescreen_mask(df, predicates)].reset_index(drop=True)
+    print(f"Pre-screen kept {len(screened)} of {len(df)} stocks")
+    return screened
@@ -0,0 +1,349 @@
+# LIBRARIES ***************************************************************************************
+import datetime as dt  # For the last completed session
+import json  # For storing the state spec next to the arrays
+import os  # For the state file path
+import numpy as np  # For the per-symbol state arrays
+import pandas as pd  # For reading the bar dates
+from bar_cache import CACHE_ROOT, MARKET_TZ, latest_session, session_closed_before  # For session handling
+
+# STATE SETTINGS **********************************************************************************
+STATE_DIR = os.path.join(CACHE_ROOT, 'rolling_state')
+
+
+# SESSION HELPERS *********************************************************************************
+def last_closed_session(now=None):
+    """
+    Date of the most recent session that has closed, i.e. the newest bar that is final.
+    Args:
+        now (datetime): Current time (default: now in New York)
+    Returns:
+        datetime.date: Newest session whose bar can go into the rolling state
+    """
+    now = now or dt.datetime.now(MARKET_TZ)
+    session = latest_session(now)
+    if not session_closed_before(session, now):
+        session = np.busday_offset(session, -1, roll='backward').astype(dt.date)
+    return session
+
+
+def normalize_spec(spec):
+    """
+    Sorted, de-duplicated copy of a state spec, so equal specs compare equal after a JSON round trip.
+    Args:
+        spec (dict): {'sma': [periods], 'volume': [days], 'atr': [[period, data_days], ...]}
+    Returns:
+        dict: The same windows as sorted lists
+    """
+    return {
+        'sma': sorted({int(period) for period in spec.get('sma', [])}),
+        'volume': sorted({int(days) for days in spec.get('volume', [])}),
+        'atr': sorted({(int(period), int(data_days)) for period, data_days in spec.get('atr', [])}),
+    }
+
+
+# ROLLING STATE ***********************************************************************************
+class RollingState:
+    """
+    Persisted per-symbol indicator state that is brought up to date by appending only the newest bars.
+    For every symbol it keeps the last closes and volumes in ring buffers, running sums for each SMA
+    and average volume window, and for each ATR the true ranges of its window with two running sums,
+    so adding a bar costs O(1) per indicator instead of recomputing over the whole history.
+
+    The ATR matches talib.ATR over the last `data_days` bars (what check_atr computes): that value
+    is the seed (the mean of the window's first `period` true ranges) weighted by r^k plus the later
+    true ranges weighted by r^age / period, with r = (period - 1) / period. Sliding the window by one
+    bar moves one true range from the smoothed part into the seed and drops the oldest one, which
+    only needs the two running sums and the ring buffer.
+
+    Only bars of sessions that have closed are added, since a partial bar could not be replaced later.
+    The state follows each symbol's own bars (like the per-symbol checks), not a common date axis.
+    """
+
+    def __init__(self, spec):
+        """
+        Args:
+            spec (dict): Windows to maintain, see normalize_spec (filter_chain.state_spec builds it)
+        """
+        self.spec = normalize_spec(spec)
+        self.symbols = []
+        # Row of every symbol in the state arrays
+        self.index = {}
+        self._close_len = max(self.spec['sma'], default=1)
+        self._volume_len = max(self.spec['volume'], default=1)
+        # Every array has one row per symbol; blank rows are filled with these values
+        self._blank = {'first_date': np.datetime64('NaT', 'D'), 'last_date': np.datetime64('NaT', 'D'),
+                       'count': 0, 'close': np.nan, 'volume': np.nan, 'closes': 0.0, 'volumes': 0.0}
+        self._widths = {'closes': self._close_len, 'volumes': self._volume_len}
+        for period in self.spec['sma']:
+            self._blank[f'sma_sum_{period}'] = 0.0
+        for days in self.spec['volume']:
+            self._blank[f'volume_sum_{days}'] = 0.0
+        for period, data_days in self.spec['atr']:
+            self._blank[f'atr_seed_{period}_{data_days}'] = 0.0
+            self._blank[f'atr_tail_{period}_{data_days}'] = 0.0
+            self._blank[f'atr_ranges_{period}_{data_days}'] = 0.0
+            # A window of data_days bars holds data_days - 1 true ranges
+            self._widths[f'atr_ranges_{period}_{data_days}'] = max(data_days - 1, 1)
+        self.arrays = {name: self._blank_rows(name, 0) for name in self._blank}
+
+    def _blank_rows(self, name, rows):
+        value = self._blank[name]
+        shape = (rows, self._widths[name]) if name in self._widths else (rows,)
+        if isinstance(value, np.datetime64):
+            return np.full(shape, value)
+        return np.full(shape, value, dtype=int if isinstance(value, int) else float)
+
+    def __contains__(self, symbol):
+        return symbol in self.index
+
+    def __len__(self):
+        return len(self.symbols)
+
+    # Persistence ---------------------------------------------------------------------------------
+    @classmethod
+    def load(cls, name, spec, root=STATE_DIR):
+        """
+        Read a saved state, or start an empty one if there is none or it was built for other windows.
+        Args:
+            name (str): State name (one file per scan)
+            spec (dict): Windows the caller needs
+            root (str): State folder
+        Returns:
+            RollingState: The loaded or new state
+        """
+        state = cls(spec)
+        path = os.path.join(root, f'{name}.npz')
+        if not os.path.exists(path):
+            return state
+        with np.load(path) as saved:
+            if json.loads(str(saved['spec'])) != json.loads(json.dumps(state.spec)):
+                return state
+            state.symbols = saved['symbols'].tolist()
+            state.index = {symbol: row for row, symbol in enumerate(state.symbols)}
+            state.arrays = {name: saved[name] for name in state._blank}
+        return state
+
+    def save(self, name, root=STATE_DIR):
+        """
+        Write the state to <root>/<name>.npz (through a temporary file, so a crash keeps the old one).
+        """
+        os.makedirs(root, exist_ok=True)
+        path = os.path.join(root, f'{name}.npz')
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, spec=np.array(json.dumps(self.spec)), symbols=np.array(self.symbols, dtype=str),
+                     **self.arrays)
+        os.replace(path + '.tmp', path)
+
+    # Updates -------------------------------------------------------------------------------------
+    def drop(self, symbols):
+        """
+        Remove symbols from the state, so their next update rebuilds them from a full history.
+        Returns:
+            int: Number of symbols removed
+        """
+        drop = set(symbols).intersection(self.index)
+        if drop:
+            keep = np.array([symbol not in drop for symbol in self.symbols], dtype=bool)
+            self.symbols = [symbol for symbol in self.symbols if symbol not in drop]
+            self.index = {symbol: row for row, symbol in enumerate(self.symbols)}
+            self.arrays = {name: values[keep] for name, values in self.arrays.items()}
+        return len(drop)
+
+    def _add_symbols(self, symbols):
+        first = len(self.symbols)
+        self.symbols.extend(symbols)
+        self.index.update({symbol: first + offset for offset, symbol in enumerate(symbols)})
+        for name, values in self.arrays.items():
+            self.arrays[name] = np.concatenate([values, self._blank_rows(name, len(symbols))])
+
+    def _reset(self, rows):
+        for name, values in self.arrays.items():
+            values[rows] = self._blank[name]
+
+    def _append(self, rows, date, high, low, close, volume):
+        """
+        Add one bar to each of the given rows (each row at most once).
+        """
+        a = self.arrays
+        count = a['count'][rows]
+
+        # Running sums over the close and volume ring buffers: add the new value, drop the one that
+        # leaves the window (read before the new value overwrites its slot)
+        for period in self.spec['sma']:
+            leaving = count >= period
+            sums = a[f'sma_sum_{period}']
+            sums[rows] += close
+            sums[rows[leaving]] -= a['closes'][rows[leaving], (count[leaving] - period) % self._close_len]
+        a['closes'][rows, count % self._close_len] = close
+        for days in self.spec['volume']:
+            leaving = count >= days
+            sums = a[f'volume_sum_{days}']
+            sums[rows] += volume
+            sums[rows[leaving]] -= a['volumes'][rows[leaving], (count[leaving] - days) % self._volume_len]
+        a['volumes'][rows, count % self._volume_len] = volume
+
+        # True range needs the previous close, so a symbol's first bar has none (like TA-Lib)
+        has_prev = count >= 1
+        prev_close = a['close'][rows[has_prev]]
+        tr = np.max([high[has_prev] - low[has_prev], np.abs(high[has_prev] - prev_close),
+                     np.abs(low[has_prev] - prev_close)], axis=0)
+        tr_rows = rows[has_prev]
+        # True ranges seen before this one
+        seen = count[has_prev] - 1
+        for period, data_days in self.spec['atr']:
+            suffix = f'{period}_{data_days}'
+            ranges, seed, tail = a[f'atr_ranges_{suffix}'], a[f'atr_seed_{suffix}'], a[f'atr_tail_{suffix}']
+            length = ranges.shape[1]
+            ratio = (period - 1) / period
+            # Still collecting the first `period` true ranges of the window
+            seeding = seen < period
+            seed[tr_rows[seeding]] += tr[seeding]
+            # Window not full yet: plain Wilder smoothing
+            growing = ~seeding & (seen < length)
+            tail[tr_rows[growing]] = ratio * tail[tr_rows[growing]] + tr[growing] / period
+            # Window full: the oldest true range leaves the seed and the first smoothed one joins it
+            full = ~seeding & ~growing
+            full_rows, full_seen = tr_rows[full], seen[full]
+            oldest = ranges[full_rows, (full_seen - length) % length]
+            if length > period:
+                joining = ranges[full_rows, (full_seen - length + period) % length]
+                seed[full_rows] += joining - oldest
+                tail[full_rows] = (ratio * (tail[full_rows] - ratio ** (length - 1 - period) / period * joining)
+                                   + tr[full] / period)
+            else:
+                seed[full_rows] += tr[full] - oldest
+            ranges[tr_rows, seen % length] = tr
+
+        a['close'][rows] = close
+        a['volume'][rows] = volume
+        a['first_date'][rows[count == 0]] = date[count == 0]
+        a['last_date'][rows] = date
+        a['count'][rows] += 1
+
+    def update(self, histories, full=False, now=None):
+        """
+        Append every closed bar newer than a symbol's state.
+        A history is only appended when it reaches back to the symbol's last state bar; otherwise
+        bars could be missing in between, so the symbol is rebuilt from the history (full=True) or
+        returned to the caller to fetch its full history (full=False). Unknown symbols are treated
+        the same way.
+        Args:
+            histories (dict): DataFrame of daily bars (util.df format, oldest first) keyed by symbol
+            full (bool): The histories cover every bar the indicators need (e.g. bars_needed(chain))
+            now (datetime): Current time, for the last closed session (default: now in New York)
+        Returns:
+            list: Symbols that need their full history (always empty when full=True)
+        """
+        closed = np.datetime64(last_closed_session(now), 'D')
+        needs_full = []
+        pending = []
+        for symbol, bars in histories.items():
+            if bars is None or not len(bars):
+                continue
+            dates = pd.to_datetime(bars['date']).to_numpy().astype('datetime64[D]')
+            keep = dates <= closed
+            row = self.index.get(symbol)
+            last = self.arrays['last_date'][row] if row is not None else np.datetime64('NaT', 'D')
+            if not np.isnat(last) and np.isin(last, dates):
+                # Contiguous with the state: only the newer bars are appended
+                keep &= dates > last
+            elif not np.isnat(last) and dates[keep].size and dates[keep][-1] <= last:
+                # Nothing newer than the state
+                continue
+            elif not full:
+                needs_full.append(symbol)
+                continue
+            elif row is not None:
+                # Possible gap: rebuild the symbol from the history
+                self._reset([row])
+            if keep.any():
+                pending.append((symbol, dates[keep], bars.loc[keep, ['high', 'low', 'close', 'volume']]
+                                .to_numpy(dtype=float)))
+
+        self._add_symbols([symbol for symbol, _, _ in pending if symbol not in self.index])
+        if pending:
+            # One vectorized step per new bar position across every updated symbol
+            rows = np.array([self.index[symbol] for symbol, _, _ in pending])
+            lengths = np.array([len(symbol_dates) for _, symbol_dates, _ in pending])
+            dates = np.full((len(pending), lengths.max()), np.datetime64('NaT', 'D'))
+            values = np.full((len(pending), lengths.max(), 4), np.nan)
+            for position, (_, symbol_dates, symbol_values) in enumerate(pending):
+                dates[position, :len(symbol_dates)] = symbol_dates
+                values[position, :len(symbol_dates)] = symbol_values
+            for step in range(lengths.max()):
+                active = lengths > step
+                high, low, close, volume = values[active, step].T
+                self._append(rows[active], dates[active, step], high, low, close, volume)
+        return needs_full
+
+    # Indicator values ----------------------------------------------------------------------------
+    def rows(self, symbols):
+        """
+        State rows of the given symbols.
+        """
+        return np.array([self.index[symbol] for symbol in symbols], dtype=int)
+
+    def sma(self, rows, period):
+        """
+        Latest `period` SMA of the close (NaN until `period` bars were added).
+        """
+        count = self.arrays['count'][rows]
+        with np.errstate(invalid='ignore'):
+            return np.where(count >= period, self.arrays[f'sma_sum_{period}'][rows] / period, np.nan)
+
+    def avg_volume(self, rows, days):
+        """
+        Average volume of the last `days` bars (or of every bar when there are fewer).
+        """
+        count = np.minimum(self.arrays['count'][rows], days)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 0, self.arrays[f'volume_sum_{days}'][rows] / count, np.nan)
+
+    def atr(self, rows, period, data_days):
+        """
+        Latest ATR over the last `data_days` bars (NaN until `period` true ranges are available).
+        """
+        suffix = f'{period}_{data_days}'
+        ranges = np.minimum(self.arrays['count'][rows] - 1, self.arrays[f'atr_ranges_{suffix}'].shape[1])
+        weight = ((period - 1) / period) ** np.maximum(ranges - period, 0) / period
+        value = weight * self.arrays[f'atr_seed_{suffix}'][rows] + self.arrays[f'atr_tail_{suffix}'][rows]
+        return np.where(ranges >= period, value, np.nan)
+
+    def latest(self, rows, field):
+        """
+        Latest 'close' or 'volume' of the given rows.
+        """
+        return self.arrays[field][rows]
+
+    def bar_range(self, rows):
+        """
+        (first, last) session dates that went into the state of the given rows.
+        """
+        return self.arrays['first_date'][rows], self.arrays['last_date'][rows]
+
+
+def invalidate_states(symbols, root=STATE_DIR):
+    """
+    Drop symbols from every saved rolling state (see RollingState.drop).
+    Args:
+        symbols (iterable): Ticker symbols
+        root (str): State folder
+    Returns:
+        int: Number of symbol states removed
+    """
+    symbols = set(symbols)
+    removed = 0
+    if not os.path.isdir(root):
+        return removed
+    for file_name in os.listdir(root):
+        if not file_name.endswith('.npz'):
+            continue
+        name = file_name[:-len('.npz')]
+        with np.load(os.path.join(root, file_name)) as saved:
+            spec = json.loads(str(saved['spec']))
+        state = RollingState.load(name, spec, root)
+        dropped = state.drop(symbols)
+        if dropped:
+            state.save(name, root)
+            removed += dropped
+    return removed
@@ -0,0 +1,44 @@
+# LIBRARIES ***************************************************************************************
+from ib_insync import *  # For building IB contracts
+import functools  # For loading the routing table once per process
+import os  # For locating the routing table
+import pandas as pd  # For reading the routing table
+from fetch_engine import make_stock_contract  # Fallback for symbols missing from the routing table
+
+# PATHS *******************************************************************************************
+# Written by all_stocks/merge.py next to merged_stocks.csv
+ROUTING_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'all_stocks', 'routing.csv')
+
+
+# ROUTING TABLE ***********************************************************************************
+@functools.lru_cache(maxsize=None)
+def load_routing(path=ROUTING_CSV):
+    """
+    Read the routing table built by all_stocks/merge.py.
+    Args:
+        path (str): Path of routing.csv
+    Returns:
+        dict: {'IB Symbol', 'Exchange', 'Sec Type', 'Currency'} keyed by stock list symbol
+            (empty if the table has not been built yet)
+    """
+    if not os.path.exists(path):
+        print(f"Routing table not found at {path}, run all_stocks/merge.py to build it")
+        return {}
+    table = pd.read_csv(path, keep_default_na=False, dtype=str)
+    return table.set_index('Symbol')[['IB Symbol', 'Exchange', 'Sec Type', 'Currency']].to_dict('index')
+
+
+def make_routed_contract(symbol):
+    """
+    Build the contract for a stock list symbol from the routing table, so NASDAQ and OTC names get
+    their own primary exchange and class shares get IB's spelling ('BRK.B' -> 'BRK B').
+    Args:
+        symbol (str): Ticker symbol from the stock list
+    Returns:
+        Contract: Unqualified contract routed through SMART (the NYSE default for unknown symbols)
+    """
+    route = load_routing().get(symbol)
+    if route is None:
+        return make_stock_contract(symbol)
+    return Contract(secType=route['Sec Type'], symbol=route['IB Symbol'], exchange='SMART',
+                    primaryExchange=route['Exchange'], currency=route['Currency'])
@@ -0,0 +1,262 @@
+# LIBRARIES ***************************************************************************************
+import ast  # For parsing the screen expressions
+import operator  # For the comparison and arithmetic operators
+import os  # For building paths relative to this folder
+import numpy as np  # For the vectorized evaluation
+import pandas as pd  # For the stock list and the result table
+import indicators  # For the indicator values over a BarBlock
+from bar_cache import BarCache  # For running screens on locally cached bars
+from stage_table import read_stock_table  # For the stock list
+from universe import universe_path  # For the Feather universe
+
+# PATHS *******************************************************************************************
+HERE = os.path.dirname(os.path.abspath(__file__))
+UNIVERSE_FILE = universe_path()  # merged_stocks.feather (or .csv if merge.py has not written it)
+
+# EXPRESSION LANGUAGE *****************************************************************************
+# A screen is a Python-like boolean expression over the latest value of each symbol, e.g.
+#   close > sma(20) and sma(50) > sma(20) and atr(14) > 1
+# Names are the bar fields of the most recent session, calls are indicators, and numbers, + - * /,
+# comparisons (also chained, like 1 < atr(14) < 5), and / or / not can combine them.
+FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+# Indicator name -> (function computing the latest value per symbol, bars needed for its arguments)
+INDICATORS = {
+    'sma': (lambda block, period, field='close': indicators.latest(indicators.sma(block, int(period), field)),
+            lambda period, field='close': int(period)),
+    'atr': (lambda block, period=14, window=None: indicators.latest(
+                indicators.atr(block, int(period), int(window) if window else None)),
+            lambda period=14, window=None: int(window) if window else int(period) + 1),
+    'avg_volume': (lambda block, days=20: indicators.avg_volume(block, int(days)),
+                   lambda days=20: int(days)),
+    'rel_volume': (lambda block, days=20: indicators.rel_volume(block, int(days)),
+                   lambda days=20: int(days)),
+}
+
+COMPARISONS = {
+    ast.Gt: operator.gt, ast.GtE: operator.ge, ast.Lt: operator.lt, ast.LtE: operator.le,
+    ast.Eq: operator.eq, ast.NotEq: operator.ne,
+}
+ARITHMETIC = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv}
+
+# The uptrend chain of filter_chain.DEFAULT_CHAIN written as screens
+UPTREND_SCREENS = {
+    'avg_volume': 'avg_volume(20) >= 2000000',
+    'relative_volume': 'rel_volume(20) >= 1',
+    'atr': 'atr(14, 50) > 1',
+    'price_above_sma': 'close > sma(20)',
+    'sma50_below_sma20': 'sma(50) < sma(20)',
+    'sma200_below_sma50': 'sma(200) < sma(50)',
+    'uptrend': 'avg_volume(20) >= 2000000 and rel_volume(20) >= 1 and atr(14, 50) > 1 '
+               'and close > sma(20) and sma(50) < sma(20) and sma(200) < sma(50)',
+}
+
+
+# COMPILER ****************************************************************************************
+# Expressions compile to nested tuples (the plan nodes). Equal subexpressions give equal tuples,
+# so one dict of computed nodes is all the common-subexpression elimination needs.
+#   ('const', value) | ('field', name) | ('call', name, args...) | ('arith', op, left, right)
+#   ('neg', operand) | ('cmp', op, left, right) | ('and', operands...) | ('or', operands...) | ('not', operand)
+
+def _compile_node(node, source):
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return ('const', float(node.value))
+    if isinstance(node, ast.Constant) and isinstance(node.value, str) and node.value in FIELDS:
+        # Field argument of an indicator, e.g. sma(20, 'volume')
+        return ('const', node.value)
+    if isinstance(node, ast.Name):
+        if node.id not in FIELDS:
+            raise ValueError(f"Unknown name '{node.id}' in screen '{source}' (fields: {', '.join(FIELDS)})")
+        return ('field', node.id)
+    if isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in INDICATORS:
+            raise ValueError(f"Unknown indicator in screen '{source}' (indicators: {', '.join(INDICATORS)})")
+        if node.keywords:
+            raise ValueError(f"Indicator arguments are positional in screen '{source}'")
+        args = tuple(_compile_node(arg, source) for arg in node.args)
+        if any(arg[0] != 'const' for arg in args):
+            raise ValueError(f"Indicator arguments must be constants in screen '{source}'")
+        # Integral periods are stored as ints, so sma(20) and sma(20.0) are the same node
+        return ('call', node.func.id) + tuple(arg[1] if isinstance(arg[1], str) else int(arg[1])
+                                               for arg in args)
+    if isinstance(node, ast.BinOp) and type(node.op) in ARITHMETIC:
+        return ('arith', type(node.op).__name__, _compile_node(node.left, source), _compile_node(node.right, source))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        return ('neg', _compile_node(node.operand, source))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        return ('not', _compile_node(node.operand, source))
+    if isinstance(node, ast.BoolOp):
+        return ('and' if isinstance(node.op, ast.And) else 'or',) + tuple(
+            _compile_node(value, source) for value in node.values)
+    if isinstance(node, ast.Compare):
+        # a < b < c is (a < b) and (b < c), sharing b
+        operands = [_compile_node(node.left, source)] + [_compile_node(right, source) for right in node.comparators]
+        parts = []
+        for position, op in enumerate(node.ops):
+            if type(op) not in COMPARISONS:
+                raise ValueError(f"Unsupported comparison in screen '{source}'")
+            parts.append(('cmp', type(op).__name__, operands[position], operands[position + 1]))
+        return parts[0] if len(parts) == 1 else ('and',) + tuple(parts)
+    raise ValueError(f"Unsupported syntax '{ast.dump(node)[:40]}' in screen '{source}'")
+
+
+def compile_screen(expression):
+    """
+    Compile a screen expression into its plan node.
+    Args:
+        expression (str): e.g. "close > sma(20) and atr(14) > 1"
+    Returns:
+        tuple: Root plan node
+    Raises:
+        ValueError: If the expression is not valid screen syntax
+    """
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Invalid screen '{expression}': {e.msg}") from None
+    return _compile_node(tree.body, expression)
+
+
+def _children(node):
+    kind = node[0]
+    if kind in ('const', 'field', 'call'):
+        return ()
+    if kind in ('arith', 'cmp'):
+        return node[2:]
+    return node[1:]
+
+
+def describe(node):
+    """
+    Readable text of a plan node, e.g. "sma(20)" (used for the metric column names).
+    """
+    kind = node[0]
+    if kind == 'const':
+        return f'{node[1]:g}' if isinstance(node[1], float) else repr(node[1])
+    if kind == 'field':
+        return node[1]
+    if kind == 'call':
+        return f"{node[1]}({', '.join(repr(arg) if isinstance(arg, str) else str(arg) for arg in node[2:])})"
+    if kind == 'arith':
+        symbol = {'Add': '+', 'Sub': '-', 'Mult': '*', 'Div': '/'}[node[1]]
+        return f'({describe(node[2])} {symbol} {describe(node[3])})'
+    if kind == 'cmp':
+        symbol = {'Gt': '>', 'GtE': '>=', 'Lt': '<', 'LtE': '<=', 'Eq': '==', 'NotEq': '!='}[node[1]]
+        return f'{describe(node[2])} {symbol} {describe(node[3])}'
+    if kind == 'neg':
+        return f'-{describe(node[1])}'
+    if kind == 'not':
+        return f'not ({describe(node[1])})'
+    return f' {kind} '.join(f'({describe(child)})' for child in node[1:])
+
+
+# EVALUATION PLAN *********************************************************************************
+class ScreenPlan:
+    """
+    Several screens compiled into one evaluation plan over a BarBlock.
+    Every distinct subexpression, e.g. sma(20) used by three screens, is one step of the plan and is
+    computed once per evaluation; the steps are ordered so each one's inputs come before it.
+    """
+
+    def __init__(self, screens):
+        """
+        Args:
+            screens (dict): Screen name -> expression
+        Raises:
+            ValueError: If an expression is not valid screen syntax
+        """
+        self.screens = {name: compile_screen(expression) for name, expression in screens.items()}
+        # Unique nodes in dependency order (children first)
+        self.steps = []
+        seen = set()
+
+        def visit(node):
+            if node in seen:
+                return
+            for child in _children(node):
+                visit(child)
+            seen.add(node)
+            self.steps.append(node)
+
+        for root in self.screens.values():
+            visit(root)
+
+    def indicators(self):
+        """
+        Indicator calls in the plan, each listed once.
+        """
+        return [node for node in self.steps if node[0] == 'call']
+
+    def bars_needed(self):
+        """
+        Longest history any indicator of the plan needs, i.e. the window to fetch per symbol.
+        """
+        return max([INDICATORS[node[1]][1](*node[2:]) for node in self.indicators()], default=1)
+
+    def evaluate(self, block):
+        """
+        Evaluate every screen for every symbol of a BarBlock in one pass.
+        Args:
+            block (BarBlock): Aligned bars for the universe (see indicators.build_block)
+        Returns:
+            tuple: (screen name -> passed boolean array, indicator text -> latest value array)
+        """
+        values = {}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for node in self.steps:
+                kind = node[0]
+                if kind == 'const':
+                    values[node] = node[1]
+                elif kind == 'field':
+                    values[node] = getattr(block, node[1])[:, -1]
+                elif kind == 'call':
+                    values[node] = INDICATORS[node[1]][0](block, *node[2:])
+                elif kind == 'arith':
+                    values[node] = ARITHMETIC[getattr(ast, node[1])](values[node[2]], values[node[3]])
+                elif kind == 'neg':
+                    values[node] = -values[node[1]]
+                elif kind == 'cmp':
+                    # NaN indicator values never pass a comparison
+                    values[node] = np.asarray(COMPARISONS[getattr(ast, node[1])](values[node[2]], values[node[3]]))
+                elif kind == 'not':
+                    values[node] = np.logical_not(values[node[1]])
+                elif kind == 'and':
+                    values[node] = np.logical_and.reduce([values[child] for child in node[1:]])
+                else:
+                    values[node] = np.logical_or.reduce([values[child] for child in node[1:]])
+        n_symbols = len(block.symbols)
+        passed = {name: np.broadcast_to(values[root], (n_symbols,)).astype(bool)
+                  for name, root in self.screens.items()}
+        metrics = {describe(node): values[node] for node in self.indicators()}
+        return passed, metrics
+
+
+def evaluate_screens(block, screens):
+    """
+    Compile and evaluate screens over a BarBlock (see ScreenPlan).
+    Args:
+        block (BarBlock): Aligned bars for the universe
+        screens (dict): Screen name -> expression
+    Returns:
+        pd.DataFrame: One row per symbol with a boolean column per screen and the indicator values
+    """
+    passed, metrics = ScreenPlan(screens).evaluate(block)
+    return pd.DataFrame({'Symbol': block.symbols, **metrics, **passed})
+
+
+# MAIN SCRIPT ************************************************************************************
+if __name__ == "__main__":
+    # Run the uptrend screens over the bars already in the local bar cache (no IB requests)
+    plan = ScreenPlan(UPTREND_SCREENS)
+    days = plan.bars_needed()
+    print(f"{len(plan.screens)} screens share {len(plan.indicators())} indicators, {days} bars per symbol")
+    cache = BarCache()
+    histories = {}
+    for symbol in read_stock_table(UNIVERSE_FILE)['Symbol']:
+        bars, entry = cache.load(symbol, ('1 day', 'TRADES', True))
+        if bars is not None:
+            histories[symbol] = bars.tail(days)
+    block = indicators.build_block(histories, days)
+    passed, metrics = plan.evaluate(block)
+    for name, mask in passed.items():
+        print(f"{name}: {mask.sum()} of {len(block.symbols)} symbols")
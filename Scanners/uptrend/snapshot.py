@@ -0,0 +1,134 @@
+# LIBRARIES ***************************************************************************************
+from ib_insync import *  # For connecting to Interactive Brokers TWS API
+import datetime as dt  # For dropping today's partial bar from cached histories
+import numpy as np  # For NaN handling in the snapshot values
+import pandas as pd  # For the relative volume table
+from tqdm import tqdm  # For progress bar tracking
+from bar_cache import BarCache, MARKET_TZ  # For the cached daily volume histories
+from contract_cache import qualify_contracts_async  # For cached, batched contract qualification
+from fetch_engine import fetch_histories_async, make_stock_contract  # For filling cache misses
+
+# SNAPSHOT SETTINGS *******************************************************************************
+# Snapshots requested per reqTickers batch (stays well inside the default 100 market data lines)
+DEFAULT_BATCH_SIZE = 50
+# Business days the last completed cached bar may lie before today (1: the previous session)
+MAX_CACHE_AGE = 1
+
+
+# CACHED AVERAGE VOLUME ***************************************************************************
+def cached_average_volumes(symbols, avg_days=20, cache=None, today=None, max_age=MAX_CACHE_AGE):
+    """
+    Average daily volume of the last avg_days completed sessions, read from the bar cache only.
+    Today's bar is left out since the snapshot supplies today's volume.
+    Args:
+        symbols (list): Ticker symbols
+        avg_days (int): Number of completed sessions to average
+        cache (BarCache): Bar cache to read (default: the shared one)
+        today (datetime.date): Current session date (default: today in New York)
+        max_age (int): Business days the last completed cached bar may lie before today; older
+            histories are left out as stale (None to accept any age)
+    Returns:
+        dict: Average volume keyed by symbol, for the symbols with enough recent cached bars
+    """
+    cache = cache or BarCache()
+    today = today or dt.datetime.now(MARKET_TZ).date()
+    averages = {}
+    for symbol in symbols:
+        bars, entry = cache.load(symbol, ('1 day', 'TRADES', True))
+        if bars is None:
+            continue
+        completed = bars[bars['date'] < today]
+        if max_age is not None and len(completed) and np.busday_count(completed['date'].iloc[-1], today) > max_age:
+            # The cache was last filled sessions ago, so its average would describe older sessions
+            continue
+        if len(completed) >= avg_days:
+            averages[symbol] = completed['volume'].tail(avg_days).mean()
+    return averages
+
+
+# BATCHED SNAPSHOTS *******************************************************************************
+async def fetch_snapshots_async(ib, contracts, batch_size=DEFAULT_BATCH_SIZE, desc="Requesting snapshots"):
+    """
+    Get last price and cumulative session volume for many contracts with snapshot market data.
+    Args:
+        ib (IB): Connected IB instance
+        contracts (dict): Qualified contracts keyed by symbol
+        batch_size (int): Number of snapshots requested together
+        desc (str): Progress bar description (None to disable the bar)
+    Returns:
+        dict: (last price, volume) keyed by symbol (NaN where IB sent nothing)
+    """
+    symbols = list(contracts)
+    snapshots = {}
+    progress = tqdm(total=len(symbols), desc=desc, disable=desc is None)
+    try:
+        for start in range(0, len(symbols), batch_size):
+            batch = symbols[start:start + batch_size]
+            # reqTickers sends one snapshot reqMktData per contract and waits for all of them
+            tickers = await ib.reqTickersAsync(*(contracts[symbol] for symbol in batch))
+            by_conid = {ticker.contract.conId: ticker for ticker in tickers}
+            for symbol in batch:
+                ticker = by_conid.get(contracts[symbol].conId)
+                if ticker is None:
+                    snapshots[symbol] = (np.nan, np.nan)
+                else:
+                    snapshots[symbol] = (ticker.marketPrice(), ticker.volume)
+            progress.update(len(batch))
+    finally:
+        progress.close()
+    return snapshots
+
+
+# INTRADAY RELATIVE VOLUME ************************************************************************
+async def intraday_relative_volume_async(ib, symbols, avg_days=20, make_contract=make_stock_contract,
+                                         cache=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Relative volume for many symbols during the session: snapshot volume / cached average volume.
+    Symbols without enough cached history, or whose cached history stops before the previous
+    session, are topped up through the fetch engine first (only the missing sessions are requested).
+    Args:
+        ib (IB): Connected IB instance
+        symbols (list): Ticker symbols
+        avg_days (int): Number of completed sessions in the average
+        make_contract (callable): Builds an unqualified contract from a symbol
+        cache (BarCache): Bar cache holding the daily histories (default: the shared one)
+        batch_size (int): Number of snapshots requested together
+    Returns:
+        pd.DataFrame: Symbol, last, volume, avg_volume and rel_volume for every symbol that resolved
+    """
+    cache = cache or BarCache()
+    symbols = list(symbols)
+    averages = cached_average_volumes(symbols, avg_days, cache)
+
+    # History download for symbols the cache cannot answer yet or only with stale sessions
+    missing = [symbol for symbol in symbols if symbol not in averages]
+    if missing:
+        results = await fetch_histories_async(ib, missing, avg_days + 1, make_contract=make_contract, cache=cache,
+                                              desc="Filling volume cache")
+        # A successful download brings the history up to what IB has (it can still end before the
+        # previous session after a market holiday); failed symbols stay out rather than use stale bars
+        refreshed = [symbol for symbol in missing if symbol in results and results[symbol].error is None]
+        averages.update(cached_average_volumes(refreshed, avg_days, cache, max_age=None))
+        skipped = len(missing) - len(refreshed)
+        if skipped:
+            print(f"Skipped {skipped} symbols whose daily history could not be refreshed")
+
+    # Qualified contracts come from the shared contract store
+    contracts = await qualify_contracts_async(ib, {symbol: make_contract(symbol) for symbol in averages})
+    contracts = {symbol: contract for symbol, contract in contracts.items() if contract is not None}
+    snapshots = await fetch_snapshots_async(ib, contracts, batch_size)
+
+    rows = []
+    for symbol, (last, volume) in snapshots.items():
+        avg_volume = averages[symbol]
+        rel_volume = volume / avg_volume if avg_volume > 0 else np.nan
+        rows.append({'Symbol': symbol, 'last': last, 'volume': volume,
+                     'avg_volume': avg_volume, 'rel_volume': rel_volume})
+    return pd.DataFrame(rows, columns=['Symbol', 'last', 'volume', 'avg_volume', 'rel_volume'])
+
+
+def intraday_relative_volume(ib, symbols, avg_days=20, **kwargs):
+    """
+    Blocking wrapper around intraday_relative_volume_async.
+    """
+    return ib.run(intraday_relative_volume_async(ib, symbols, avg_days, **kwargs))
@@ -0,0 +1,92 @@
+# LIBRARIES ***************************************************************************************
+import datetime as dt  # For the as-of timestamp of a stage run
+import os  # For picking the file format from the extension
+import pandas as pd  # For reading and writing the stage tables (Parquet/Feather need pyarrow)
+import pyarrow.feather as feather  # For memory-mapped Feather reads
+
+# STAGE TABLE COLUMNS *****************************************************************************
+# Every stage table has the stockanalysis columns of its input, the metrics the stage computed,
+# and these bookkeeping columns
+AS_OF = 'as_of'            # When the stage ran (timestamp)
+BAR_START = 'bar_start'    # First bar used for the metrics (date)
+BAR_END = 'bar_end'        # Last bar used for the metrics (date)
+
+
+# READ / WRITE ************************************************************************************
+def read_stock_table(path):
+    """
+    Read a stock list from a CSV, Parquet or Feather file, so a stage can take either the original
+    stockanalysis CSV or the table written by the previous stage.
+    Args:
+        path (str): File path (format picked from the extension)
+    Returns:
+        pd.DataFrame: Stock list, with any stored metrics
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.parquet':
+        return pd.read_parquet(path)
+    if extension == '.feather':
+        # Memory-mapped, so an uncompressed file (like the universe from merge.py) loads without copying
+        return feather.read_table(path, memory_map=True).to_pandas()
+    return pd.read_csv(path)
+
+
+def write_stage_table(stocks, path, as_of=None):
+    """
+    Save a stage's surviving stocks with their metrics as a typed columnar table.
+    Args:
+        stocks (pd.DataFrame): Stock rows plus metric columns (and bar_start/bar_end if known)
+        path (str): Output path ending in .parquet or .feather
+        as_of (datetime): Time of the run (default: now)
+    Returns:
+        pd.DataFrame: The table that was written
+    """
+    table = stocks.copy()
+    table[AS_OF] = pd.Timestamp(as_of or dt.datetime.now())
+    for column in (BAR_START, BAR_END):
+        if column in table:
+            table[column] = pd.to_datetime(table[column])
+    # Metrics and stockanalysis numbers are stored as floats rather than whatever the CSV parser guessed
+    for column in table.columns:
+        if table[column].dtype == object and column not in ('Symbol', 'Company Name', '% Change'):
+            converted = pd.to_numeric(table[column], errors='coerce')
+            if converted.notna().sum() == table[column].notna().sum():
+                table[column] = converted
+    if os.path.splitext(path)[1].lower() == '.feather':
+        table.reset_index(drop=True).to_feather(path)
+    else:
+        table.to_parquet(path, index=False)
+    return table
+
+
+def bar_range(hist_data):
+    """
+    First and last bar dates of a symbol's history, for the bar_start/bar_end columns.
+    Args:
+        hist_data (pd.DataFrame): Bars in util.df format
+    Returns:
+        dict: {'bar_start': date, 'bar_end': date}
+    """
+    return {BAR_START: hist_data['date'].iloc[0], BAR_END: hist_data['date'].iloc[-1]}
+
+
+# STORED METRIC FILTERS ***************************************************************************
+def filter_stored(table, columns, condition, as_of_date=None):
+    """
+    Filter a stage table on metrics it already stores, without touching IB.
+    Args:
+        table (pd.DataFrame): Stock list, possibly a table written by write_stage_table
+        columns (list): Metric columns the condition needs, e.g. ['atr']
+        condition (callable): Takes the table and returns a boolean mask of rows to keep
+        as_of_date (datetime.date): Date the metrics must have been computed on (default: today)
+    Returns:
+        pd.DataFrame: Rows that pass, or None if the table does not hold usable metrics
+    """
+    as_of_date = as_of_date or dt.date.today()
+    if AS_OF not in table or any(column not in table for column in columns):
+        return None
+    # Metrics from an earlier day are stale, and missing values mean the metric was never computed
+    fresh = (pd.to_datetime(table[AS_OF]).dt.date == as_of_date).all()
+    if not fresh or table[columns].isna().any().any():
+        return None
+    return table[condition(table)].reset_index(drop=True)
@@ -0,0 +1,200 @@
+# LIBRARIES ***************************************************************************************
+import collections  # For the counters and per-symbol timings
+import contextlib  # For the phase timers
+import datetime as dt  # For the run timestamp
+import json  # For the JSON summary
+import os  # For the output paths
+import time  # For timing phases
+import numpy as np  # For the per-symbol latency quantiles
+from bar_cache import CACHE_ROOT  # Telemetry is written next to the caches
+
+# TELEMETRY SETTINGS ******************************************************************************
+TELEMETRY_DIR = os.path.join(CACHE_ROOT, 'telemetry')
+# Prefix of every exported Prometheus metric
+METRIC_PREFIX = 'uptrend'
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+# RUN TELEMETRY ***********************************************************************************
+class Telemetry:
+    """
+    Timings, counters, IB error codes and bytes received for one scanner run.
+    Phases are timed either as a whole (phase) or per symbol (timed); per-symbol phases of
+    concurrent requests overlap, so their totals are request-seconds rather than wall time.
+    At the end of the run write() exports a JSON summary and a Prometheus text file.
+    """
+
+    def __init__(self, scan):
+        """
+        Args:
+            scan (str): Scanner name, used for the file names and the Prometheus 'scan' label
+        """
+        self.scan = scan
+        self.started = dt.datetime.now()
+        self._start = time.perf_counter()
+        # Phase name -> [total seconds, number of timings]
+        self.phases = collections.defaultdict(lambda: [0.0, 0])
+        # Symbol -> {phase: seconds}
+        self.symbols = collections.defaultdict(dict)
+        self.counters = collections.Counter()
+        self.error_codes = collections.Counter()
+        self.bytes_received = 0
+        self.messages_received = 0
+        self._ib_start = None
+        # Start times of the phases timed with start()/stop()
+        self._running = {}
+
+    # Timers --------------------------------------------------------------------------------------
+    def add_time(self, phase, seconds, symbol=None):
+        """
+        Add a measured duration to a phase (and to a symbol's timings if one is given).
+        """
+        totals = self.phases[phase]
+        totals[0] += seconds
+        totals[1] += 1
+        if symbol is not None:
+            self.symbols[symbol][phase] = self.symbols[symbol].get(phase, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def phase(self, phase):
+        """
+        Time a whole phase of the run, e.g. `with telemetry.phase('qualify'):`.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def start(self, phase):
+        """
+        Start timing a phase that spans a block of code; finish it with stop().
+        """
+        self._running[phase] = time.perf_counter()
+
+    def stop(self, phase):
+        """
+        Finish timing a phase started with start().
+        """
+        self.add_time(phase, time.perf_counter() - self._running.pop(phase))
+
+    @contextlib.contextmanager
+    def timed(self, phase, symbol):
+        """
+        Time one symbol's part of a phase, e.g. `with telemetry.timed('historical', symbol):`.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start, symbol)
+
+    # Counters ------------------------------------------------------------------------------------
+    def count(self, name, amount=1):
+        """
+        Increase a counter, e.g. 'historical_requests'.
+        """
+        self.counters[name] += amount
+
+    def on_error(self, reqId, errorCode, errorString, contract):
+        """
+        Handler for ib.errorEvent counting IB error codes (162/366/420 pacing, 200 no security, ...).
+        """
+        self.error_codes[errorCode] += 1
+
+    # IB connection -------------------------------------------------------------------------------
+    @staticmethod
+    def _received(ib):
+        """
+        Bytes and messages received so far by an IB instance or every member of an IBPool.
+        """
+        received = [0, 0]
+        for member in getattr(ib, 'members', [ib]):
+            client = getattr(member, 'client', None)
+            received[0] += getattr(client, '_numBytesRecv', 0)
+            received[1] += getattr(client, '_numMsgRecv', 0)
+        return received
+
+    def attach(self, ib):
+        """
+        Start counting an IB connection's error codes and received bytes (call once it is connected).
+        """
+        ib.errorEvent += self.on_error
+        self._ib_start = self._received(ib)
+
+    def detach(self, ib):
+        """
+        Stop listening to the connection and record what it received since attach().
+        """
+        if self._ib_start is None:
+            return
+        ib.errorEvent -= self.on_error
+        received = self._received(ib)
+        self.bytes_received += received[0] - self._ib_start[0]
+        self.messages_received += received[1] - self._ib_start[1]
+        self._ib_start = None
+
+    # Export --------------------------------------------------------------------------------------
+    def summary(self):
+        """
+        Everything recorded so far as a JSON-serializable dict.
+        """
+        per_symbol = np.array([sum(phases.values()) for phases in self.symbols.values()])
+        return {
+            'scan': self.scan,
+            'started': self.started.isoformat(),
+            'run_seconds': time.perf_counter() - self._start,
+            'phases': {phase: {'seconds': total, 'count': count} for phase, (total, count) in self.phases.items()},
+            'counters': dict(self.counters),
+            'error_codes': {str(code): count for code, count in self.error_codes.items()},
+            'bytes_received': self.bytes_received,
+            'messages_received': self.messages_received,
+            'symbol_seconds': {str(q): float(np.quantile(per_symbol, q)) if len(per_symbol) else None
+                               for q in QUANTILES},
+            'symbols': self.symbols,
+        }
+
+    def prometheus(self):
+        """
+        The summary in the Prometheus text exposition format (for the node_exporter textfile collector).
+        """
+        summary = self.summary()
+        label = f'scan="{self.scan}"'
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {METRIC_PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {METRIC_PREFIX}_{name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{METRIC_PREFIX}_{name}{{{",".join([label, *labels])}}} {value}')
+
+        metric('run_seconds', 'gauge', 'Wall time of the scanner run.', [((), summary['run_seconds'])])
+        metric('phase_seconds_total', 'counter', 'Seconds spent per phase (summed over concurrent requests).',
+               [((f'phase="{phase}"',), values['seconds']) for phase, values in summary['phases'].items()])
+        metric('phase_count_total', 'counter', 'Number of timings per phase.',
+               [((f'phase="{phase}"',), values['count']) for phase, values in summary['phases'].items()])
+        metric('events_total', 'counter', 'Requests, responses, cache hits and other events.',
+               [((f'event="{name}"',), count) for name, count in summary['counters'].items()])
+        metric('ib_errors_total', 'counter', 'IB error messages by error code.',
+               [((f'code="{code}"',), count) for code, count in summary['error_codes'].items()])
+        metric('bytes_received_total', 'counter', 'Bytes received from TWS.', [((), summary['bytes_received'])])
+        metric('messages_received_total', 'counter', 'API messages received from TWS.',
+               [((), summary['messages_received'])])
+        metric('symbol_seconds', 'summary', 'Time spent per symbol across all per-symbol phases.',
+               [((f'quantile="{q}"',), value) for q, value in summary['symbol_seconds'].items() if value is not None])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, directory=TELEMETRY_DIR):
+        """
+        Write <scan>.json and <scan>.prom for the run.
+        Returns:
+            tuple: (JSON path, Prometheus path)
+        """
+        os.makedirs(directory, exist_ok=True)
+        json_path = os.path.join(directory, f'{self.scan}.json')
+        prom_path = os.path.join(directory, f'{self.scan}.prom')
+        with open(json_path, 'w') as f:
+            json.dump(self.summary(), f, indent=1)
+        with open(prom_path, 'w') as f:
+            f.write(self.prometheus())
+        return json_path, prom_path
@@ -0,0 +1,123 @@
+# LIBRARIES ***************************************************************************************
+import heapq  # For the bounded heap of the best candidates
+import os  # For checking for the previous run's table
+import numpy as np  # For the trend quality
+import pandas as pd  # For ranking the stock list columns
+from prescreen import numeric_column  # For reading the stock list columns as numbers
+from stage_table import read_stock_table  # For the previous run's candidates
+
+# TOP-K SETTINGS **********************************************************************************
+# The prior is a weighted sum of percentile ranks of stock list columns (0..1 each) plus a bonus for
+# symbols that were candidates in the previous run, so large, liquid names and last run's
+# candidates are scanned first. The weights add up to 1, so the prior lies between 0 and 1
+PRIOR_WEIGHTS = {
+    'Market Cap': 0.6,
+    'Stock Price': 0.1,
+}
+PREVIOUS_RUN_WEIGHT = 0.3
+# Distance of the close above the chain's longest SMA that counts as a full-strength trend
+# (e.g. 0.5: 50% above the SMA200); the trend quality is that distance scaled to 0..1
+TREND_SCALE = 0.5
+# Symbols downloaded per step between two early-termination checks
+TOP_K_CHUNK = 100
+
+
+# PRIOR ********************************************************************************************
+def prior_scores(df, previous=None):
+    """
+    Cheap prior of every symbol in a stock list, known before anything is requested from IB.
+    Args:
+        df (pd.DataFrame): Stock list (see PRIOR_WEIGHTS for the columns used)
+        previous (str): Result table of the previous run; its symbols get PREVIOUS_RUN_WEIGHT
+            (skipped if the file does not exist)
+    Returns:
+        dict: Prior between 0 and 1 keyed by symbol
+    """
+    df = df.drop_duplicates(subset='Symbol')
+    prior = np.zeros(len(df))
+    for column, weight in PRIOR_WEIGHTS.items():
+        if column in df.columns:
+            # Missing values rank last
+            prior += weight * numeric_column(df[column]).rank(pct=True).fillna(0).to_numpy()
+    if previous and os.path.exists(previous):
+        prior += PREVIOUS_RUN_WEIGHT * df['Symbol'].isin(read_stock_table(previous)['Symbol']).to_numpy()
+    return dict(zip(df['Symbol'], prior))
+
+
+def trend_quality(metrics):
+    """
+    Strength of a passing symbol's uptrend between 0 and 1: how far the close is above the longest
+    SMA of the chain, relative to TREND_SCALE.
+    Args:
+        metrics (dict): Metric name -> value of one symbol (needs 'close' and an 'sma_<period>')
+    Returns:
+        float: Trend quality (0 when the metrics are missing)
+    """
+    periods = [int(name[len('sma_'):]) for name in metrics if name.startswith('sma_')]
+    if not periods or 'close' not in metrics:
+        return 0.0
+    distance = metrics['close'] / metrics[f'sma_{max(periods)}'] - 1
+    if not np.isfinite(distance):
+        return 0.0
+    return float(min(max(distance / TREND_SCALE, 0.0), 1.0))
+
+
+# BOUNDED HEAP ************************************************************************************
+class TopK:
+    """
+    The best k candidates seen so far, by score (prior x trend quality).
+    Since the trend quality is at most 1, a symbol's prior bounds its score: once the heap is full
+    and no unscanned symbol has a prior above the k-th best score, the scan can stop.
+    """
+
+    def __init__(self, k):
+        self.k = k
+        # Min-heap of (score, order, symbol, item); the order keeps ties stable
+        self._heap = []
+        self._pushed = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    @property
+    def full(self):
+        return len(self._heap) >= self.k
+
+    @property
+    def threshold(self):
+        """
+        Score a new candidate has to beat (the k-th best score once the heap is full, else -inf).
+        """
+        return self._heap[0][0] if self.full else -np.inf
+
+    def can_beat(self, bound):
+        """
+        Whether a symbol whose score is at most bound could still enter the heap.
+        """
+        return bound > self.threshold
+
+    def push(self, score, symbol, item=None):
+        """
+        Offer a candidate; it is kept only while it is among the best k.
+        """
+        entry = (score, -self._pushed, symbol, item)
+        self._pushed += 1
+        if not self.full:
+            heapq.heappush(self._heap, entry)
+        elif score > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def best(self):
+        """
+        Kept candidates, best first.
+        Returns:
+            list: (score, symbol, item) tuples
+        """
+        return [(score, symbol, item) for score, _, symbol, item in sorted(self._heap, reverse=True)]
+
+
+def rank_by_prior(symbols, priors):
+    """
+    Symbols in descending prior order (stable, so equal priors keep the stock list order).
+    """
+    return sorted(symbols, key=lambda symbol: -priors.get(symbol, 0.0))
@@ -0,0 +1,162 @@
+# LIBRARIES ***************************************************************************************
+import os  # For locating the universe files
+import numpy as np  # For the numeric snapshot comparisons
+import pandas as pd  # For the stock list DataFrame
+
+# PATHS *******************************************************************************************
+# Written by all_stocks/merge.py: the typed Feather file, and the CSV for older checkouts and spreadsheets
+ALL_STOCKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'all_stocks')
+UNIVERSE_FEATHER = os.path.join(ALL_STOCKS_DIR, 'merged_stocks.feather')
+UNIVERSE_CSV = os.path.join(ALL_STOCKS_DIR, 'merged_stocks.csv')
+# Dated copies of the Feather file, one per merge day (merged_stocks_YYYY-MM-DD.feather)
+SNAPSHOT_DIR = os.path.join(ALL_STOCKS_DIR, 'snapshots')
+
+# SNAPSHOT DIFF SETTINGS **************************************************************************
+# Columns compared between two snapshots and the relative move that counts as a change (None for a
+# text column, which changes on any difference). The numeric ones are the columns
+# prescreen.DEFAULT_PRESCREEN filters on, compared exactly, since any move can flip a pre-screen
+# result; a value appearing or disappearing is a change too
+DIFF_TOLERANCE = {
+    'Company Name': None,
+    'Exchange': None,
+    'Stock Price': 0.0,
+    'Market Cap': 0.0,
+    'Revenue': 0.0,
+}
+# Moves this large are reported as jumps as well: prices and market caps move every day, but a jump
+# usually means a split or a different company behind the ticker, which makes the cached
+# (split-adjusted) bars of the symbol stale, not only its scan results
+JUMP_TOLERANCE = {
+    'Stock Price': 0.4,
+    'Market Cap': 0.4,
+}
+
+
+def universe_path():
+    """
+    The universe file the scanners should read: the Feather file if merge.py has written one,
+    otherwise merged_stocks.csv.
+    """
+    return UNIVERSE_FEATHER if os.path.exists(UNIVERSE_FEATHER) else UNIVERSE_CSV
+
+
+# SYMBOL INDEX ************************************************************************************
+class Universe:
+    """
+    Stock list with a symbol -> row index, so fetching a symbol's row is a dict lookup instead of
+    the df[df['Symbol'] == symbol] scan over the whole list for every passing symbol.
+    The first row wins when a symbol is listed twice, like the scan it replaces. Rows without a
+    symbol are left out of the index (the listing files read the ticker 'NA' as a missing value).
+    """
+
+    def __init__(self, df):
+        """
+        Args:
+            df (pd.DataFrame): Stock list or stage table with a 'Symbol' column
+        """
+        self.df = df.reset_index(drop=True)
+        self._rows = {}
+        for position, symbol in enumerate(self.df['Symbol']):
+            if pd.isna(symbol):
+                continue
+            self._rows.setdefault(symbol, position)
+
+    def __contains__(self, symbol):
+        return symbol in self._rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def symbols(self):
+        """
+        Every symbol once, in stock list order.
+        """
+        return list(self._rows)
+
+    def row(self, symbol):
+        """
+        A symbol's stock list row.
+        Returns:
+            dict: Column -> value
+        Raises:
+            KeyError: If the symbol is not in the stock list
+        """
+        return self.df.iloc[self._rows[symbol]].to_dict()
+
+
+# SNAPSHOTS ***************************************************************************************
+def list_snapshots(root=SNAPSHOT_DIR):
+    """
+    Universe snapshots written by merge.py, oldest first.
+    """
+    if not os.path.isdir(root):
+        return []
+    return sorted(os.path.join(root, name) for name in os.listdir(root)
+                  if name.startswith('merged_stocks_') and name.endswith('.feather'))
+
+
+def _compare_columns(old, new, common, tolerance, missing_changes):
+    """
+    One boolean column per compared field over the symbols listed in both snapshots, True where
+    the field changed by more than its tolerance (see diff_universes).
+    """
+    changed = pd.DataFrame(index=common)
+    for column, limit in tolerance.items():
+        if column not in old.columns or column not in new.columns:
+            continue
+        before, after = old.loc[common, column], new.loc[common, column]
+        if limit is None:
+            changed[column] = before.astype(str).to_numpy() != after.astype(str).to_numpy()
+        else:
+            before = pd.to_numeric(before, errors='coerce').to_numpy(dtype=float)
+            after = pd.to_numeric(after, errors='coerce').to_numpy(dtype=float)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                moved = np.abs(after - before) > limit * np.abs(before)
+            if missing_changes:
+                moved |= np.isnan(before) != np.isnan(after)
+            changed[column] = moved
+    return changed
+
+
+def _joined_fields(changed):
+    """
+    Names of the True columns of each row, comma separated ('' for rows without any).
+    """
+    if not len(changed) or not len(changed.columns):
+        return pd.Series('', index=changed.index, dtype=object)
+    return changed.apply(lambda flags: ', '.join(flags.index[flags]), axis=1)
+
+
+def diff_universes(old, new, tolerance=None, jump_tolerance=None):
+    """
+    Compare two universe snapshots symbol by symbol.
+    Args:
+        old (pd.DataFrame): Earlier stock list
+        new (pd.DataFrame): Later stock list
+        tolerance (dict): Column -> relative change that counts as changed (None for any change
+            of a text column), default: DIFF_TOLERANCE
+        jump_tolerance (dict): Column -> relative move that is also reported as a jump (a likely
+            split), default: JUMP_TOLERANCE
+    Returns:
+        pd.DataFrame: One row per added, removed or changed symbol with the columns 'Symbol',
+            'Change' ('added', 'removed' or 'changed'), 'Fields' (the changed columns, comma
+            separated) and 'Jumps' (the columns that jumped, comma separated), sorted by symbol
+    """
+    tolerance = DIFF_TOLERANCE if tolerance is None else tolerance
+    jump_tolerance = JUMP_TOLERANCE if jump_tolerance is None else jump_tolerance
+    old = old.drop_duplicates(subset='Symbol').set_index('Symbol')
+    new = new.drop_duplicates(subset='Symbol').set_index('Symbol')
+    common = old.index.intersection(new.index)
+
+    changed = _compare_columns(old, new, common, tolerance, missing_changes=True)
+    changed = changed[changed.any(axis=1)]
+    # Only a real move is a jump; a value going missing is not a split (the listing files have gaps)
+    jumped = _compare_columns(old, new, changed.index, jump_tolerance, missing_changes=False)
+
+    diff = pd.concat([
+        pd.DataFrame({'Symbol': new.index.difference(old.index), 'Change': 'added', 'Fields': '', 'Jumps': ''}),
+        pd.DataFrame({'Symbol': old.index.difference(new.index), 'Change': 'removed', 'Fields': '', 'Jumps': ''}),
+        pd.DataFrame({'Symbol': changed.index, 'Change': 'changed', 'Fields': _joined_fields(changed).to_numpy(),
+                      'Jumps': _joined_fields(jumped).to_numpy()}),
+    ], ignore_index=True)
+    return diff.sort_values('Symbol', ignore_index=True)
@@ -0,0 +1,130 @@
+# LIBRARIES ***************************************************************************************
+import datetime as dt  # For the backfill start date
+import os  # For writing the diff next to the snapshots
+from bar_cache import BarCache  # For dropping stale bars
+from contract_cache import ContractCache  # For dropping stale qualified contracts
+from negative_cache import NegativeCache  # For dropping stale failures
+from checkpoint import invalidate_checkpoints  # For dropping stale scan results
+from rolling_state import invalidate_states  # For dropping stale incremental scan state
+from stage_table import read_stock_table  # For reading the snapshots
+from universe import list_snapshots, diff_universes, SNAPSHOT_DIR  # For the snapshot diff
+from backfill import backfill, BACKFILL_YEARS  # For re-seeding the invalidated symbols
+from ib_pool import IBPool  # For spreading the backfill over several IB connections
+
+# REFRESH SETTINGS ********************************************************************************
+# Changed columns that mean the ticker may now be a different contract (new company or listing), so
+# its qualified contract and recorded failures are dropped too, not only its bars and scan results
+IDENTITY_FIELDS = ('Company Name', 'Exchange')
+# Client IDs of the refresh's connection pool (the backfill itself uses 31-34)
+CLIENT_IDS = (41, 42, 43, 44)
+
+
+# INVALIDATION ************************************************************************************
+def ib_symbols(symbols):
+    """
+    Stock list symbols plus their IB spelling ('BRK.B' -> 'BRK B'), the symbols the contract keys use.
+    """
+    symbols = set(symbols)
+    return symbols | {symbol.replace('.', ' ') for symbol in symbols}
+
+
+def reidentified(diff):
+    """
+    Rows of a universe diff whose ticker may now be a different contract: added, removed, or
+    changed in one of IDENTITY_FIELDS.
+    """
+    identity = diff['Change'] != 'changed'
+    for field in IDENTITY_FIELDS:
+        identity |= diff['Fields'].str.contains(field, regex=False)
+    return identity
+
+
+def stale_bars(diff):
+    """
+    Rows of a universe diff whose cached bars no longer hold: re-identified symbols and symbols whose
+    price or market cap jumped (see universe.JUMP_TOLERANCE).
+    """
+    return reidentified(diff) | (diff['Jumps'] != '')
+
+
+def apply_universe_diff(diff, cache=None, contract_cache=None, negative_cache=None):
+    """
+    Invalidate the cached data of the symbols in a universe diff, and only of those.
+    Added, removed and re-identified symbols (see IDENTITY_FIELDS) lose everything cached under their
+    ticker; symbols whose price or market cap jumped lose their bars, rolling state and checkpointed
+    results, since a split rewrites their adjusted history, but keep their qualified contract; any
+    other changed symbol (e.g. a price move that can flip the pre-screen) only loses its checkpointed
+    results, since its bars are still valid.
+    Args:
+        diff (pd.DataFrame): Output of universe.diff_universes
+        cache (BarCache): Bar cache (default: the shared one)
+        contract_cache (ContractCache): Contract cache (default: the shared one)
+        negative_cache (NegativeCache): Negative cache (default: the shared one)
+    Returns:
+        dict: Entries removed per cache
+    """
+    cache = cache or BarCache()
+    contract_cache = contract_cache or ContractCache()
+    negative_cache = negative_cache or NegativeCache()
+
+    symbols = list(diff['Symbol'])
+    renamed = ib_symbols(diff.loc[reidentified(diff), 'Symbol'])
+    stale = list(diff.loc[stale_bars(diff), 'Symbol'])
+
+    removed = {
+        'bars': cache.invalidate(stale),
+        'rolling_state': invalidate_states(stale),
+        'checkpoints': invalidate_checkpoints(symbols),
+        'contracts': contract_cache.invalidate(renamed),
+        'negative': negative_cache.invalidate(renamed),
+    }
+    contract_cache.save()
+    negative_cache.save()
+    return removed
+
+
+def refresh_universe(old_path=None, new_path=None):
+    """
+    Diff the two newest universe snapshots (or the given ones) and invalidate the affected symbols.
+    The routing table needs no invalidation: merge.py rewrites it with every snapshot.
+    Args:
+        old_path (str): Earlier snapshot (default: the second newest in universe.SNAPSHOT_DIR)
+        new_path (str): Later snapshot (default: the newest)
+    Returns:
+        tuple: (diff DataFrame, entries removed per cache), or (None, {}) with fewer than two snapshots
+    """
+    if old_path is None or new_path is None:
+        snapshots = list_snapshots()
+        if len(snapshots) < 2:
+            print(f"Need two universe snapshots in {SNAPSHOT_DIR} to diff, run all_stocks/merge.py again later")
+            return None, {}
+        old_path, new_path = old_path or snapshots[-2], new_path or snapshots[-1]
+    diff = diff_universes(read_stock_table(old_path), read_stock_table(new_path))
+    counts = diff['Change'].value_counts()
+    print(f"{os.path.basename(old_path)} -> {os.path.basename(new_path)}: {counts.get('added', 0)} added, "
+          f"{counts.get('removed', 0)} removed, {counts.get('changed', 0)} changed")
+    return diff, apply_universe_diff(diff)
+
+
+# MAIN SCRIPT ************************************************************************************
+if __name__ == "__main__":
+    # Invalidate what changed since the previous merge and save the diff next to the snapshots
+    diff, removed = refresh_universe()
+    if diff is not None:
+        print("Removed " + ", ".join(f"{count} {name}" for name, count in removed.items()))
+        diff.to_csv(os.path.join(SNAPSHOT_DIR, 'latest_diff.csv'), index=False)
+
+        # Re-seed the daily history of the still listed symbols whose bars were dropped, so the cost of
+        # the refresh follows the churn instead of the size of the universe
+        listed = list(diff.loc[stale_bars(diff) & (diff['Change'] != 'removed'), 'Symbol'])
+        if listed:
+            start = dt.date.today() - dt.timedelta(days=365 * BACKFILL_YEARS)
+            ib = IBPool('127.0.0.1', 7497, client_ids=CLIENT_IDS)
+            try:
+                ib.connect()
+                ib.errorEvent += lambda reqId, errorCode, errorString, contract: None
+                stored = backfill(ib, listed, start)
+                known = [bars for bars in stored.values() if bars is not None]
+                print(f"Backfilled {sum(known):,} bars for {len(known)} added, re-identified or split symbols")
+            finally:
+                ib.disconnect()
@@ -6,6 +6,12 @@ import matplotlib.pyplot as plt # provides functions to create various plots: li
 import statsmodels.api as sm # statsmodels is a Python library designed for statistical modeling, estimation, and hypothesis testing.
 # It provides tools for conducting statistical analyses, including regression models, time-series analysis, and more.
 from ib_insync import *  # For TWS API (data fetching)
+import os  # For locating the shared scanner modules
+import sys  # For adding the shared scanner modules to the import path
+# The shared contract store lives with the scanners in Scanners/uptrend
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'Scanners', 'uptrend'))
+from contract_cache import qualify_contracts  # For cached contract qualification
+from bar_arrays import bars_to_array  # For converting bars without util.df
 
 # CONNECT TO IB *******************************************************************************************************************************
 
@@ -22,6 +28,8 @@ ib.connect('127.0.0.1', 7497, clientId=1)  # Adjust port/clientId
 # variable = class with parameters
 gld_contract = Stock('GLD', 'SMART', 'USD')
 gdx_contract = Stock('GDX', 'SMART', 'USD')
+# Qualify both contracts through the shared contract store (no TWS round trip once cached)
+gld_contract, gdx_contract = qualify_contracts(ib, [gld_contract, gdx_contract])
 # ib object was created earlier in line 11, "reqHistoricalData" is like a function call
 # bars_gld stores a list of BarData objects from ib.reqHistoricalData, which fetches 10 years of daily 
 # adjusted closing prices for GLD during regular trading hours.
@@ -31,12 +39,12 @@ bars_gdx = ib.reqHistoricalData(gdx_contract, endDateTime='', durationStr='3 Y',
 # CONVERT DATA ***********************************************************************************************************************************
 
 # Convert to DataFrames
-# Converts GLD/GDX historical data (from TWS API) to a Pandas DataFrame using ib_insync's utility function. Prepares GLD/GDX data for analysis.
-df_gld = util.df(bars_gld)
-df_gdx = util.df(bars_gdx)
-# Selects 'date' and 'close' columns from GLD/GDX DataFrame, renames 'close' to 'Adj Close_GLD' for consistency with strategy.
-df_gld = df_gld[['date', 'close']].rename(columns={'close': 'Adj Close_GLD'})
-df_gdx = df_gdx[['date', 'close']].rename(columns={'close': 'Adj Close_GDX'})
+# Converts GLD/GDX historical data (from TWS API) straight into NumPy arrays of bars, without building a full DataFrame first.
+gld = bars_to_array(bars_gld)
+gdx = bars_to_array(bars_gdx)
+# Keeps only the 'date' and 'close' columns, named 'Adj Close_GLD' / 'Adj Close_GDX' for consistency with strategy.
+df_gld = pd.DataFrame({'date': gld['date'], 'Adj Close_GLD': gld['close']})
+df_gdx = pd.DataFrame({'date': gdx['date'], 'Adj Close_GDX': gdx['close']})
 # Merges GLD and GDX DataFrames on 'date' column, keeping only matching dates (inner join)
 # GLD/GDX prices into a single DataFrame for pairs analysis.
 df = pd.merge(df_gld, df_gdx, on='date', how='inner')
@@ -6,6 +6,12 @@ import matplotlib.pyplot as plt # provides functions to create various plots: li
 import statsmodels.api as sm # statsmodels is a Python library designed for statistical modeling, estimation, and hypothesis testing.
 # It provides tools for conducting statistical analyses, including regression models, time-series analysis, and more.
 from ib_insync import *  # For TWS API (data fetching)
+import os  # For locating the shared scanner modules
+import sys  # For adding the shared scanner modules to the import path
+# The shared contract store lives with the scanners in Scanners/uptrend
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'Scanners', 'uptrend'))
+from contract_cache import qualify_contracts  # For cached contract qualification
+from bar_arrays import bars_to_array  # For converting bars without util.df
 
 # CONNECT TO IB *******************************************************************************************************************************
 
@@ -21,15 +27,17 @@ ib.connect('127.0.0.1', 7497, clientId=1)  # Adjust port/clientId
 # Fetch historical data (daily bars, 3 years)
 gld_contract = Stock('GLD', 'SMART', 'USD')
 gdx_contract = Stock('GDX', 'SMART', 'USD')
+# Qualify both contracts through the shared contract store (no TWS round trip once cached)
+gld_contract, gdx_contract = qualify_contracts(ib, [gld_contract, gdx_contract])
 bars_gld = ib.reqHistoricalData(gld_contract, endDateTime='', durationStr='3 Y', barSizeSetting='1 day', whatToShow='ADJUSTED_LAST', useRTH=True)
 bars_gdx = ib.reqHistoricalData(gdx_contract, endDateTime='', durationStr='3 Y', barSizeSetting='1 day', whatToShow='ADJUSTED_LAST', useRTH=True)
 
 # Convert to DataFrames
-df_gld = util.df(bars_gld)
-df_gdx = util.df(bars_gdx)
-print(f"GLD rows: {len(df_gld)}, GDX rows: {len(df_gdx)}")  # Debug
-df_gld = df_gld[['date', 'close']].rename(columns={'close': 'Adj Close_GLD'})
-df_gdx = df_gdx[['date', 'close']].rename(columns={'close': 'Adj Close_GDX'})
+gld = bars_to_array(bars_gld)
+gdx = bars_to_array(bars_gdx)
+print(f"GLD rows: {len(gld)}, GDX rows: {len(gdx)}")  # Debug
+df_gld = pd.DataFrame({'date': gld['date'], 'Adj Close_GLD': gld['close']})
+df_gdx = pd.DataFrame({'date': gdx['date'], 'Adj Close_GDX': gdx['close']})
 df = pd.merge(df_gld, df_gdx, on='date', how='inner')
 df.set_index('date', inplace=True)
 df.sort_index(inplace=True)
@@ -3,17 +3,25 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import statsmodels.api as sm
 from ib_insync import *
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'Scanners', 'uptrend'))
+from contract_cache import qualify_contracts
+from bar_arrays import bars_to_array
 
 ib = IB()
 ib.connect('127.0.0.1', 7497, clientId=1)
 
 gld_contract = Stock('GLD', 'SMART', 'USD')
 gdx_contract = Stock('GDX', 'SMART', 'USD')
+gld_contract, gdx_contract = qualify_contracts(ib, [gld_contract, gdx_contract])
 bars_gld = ib.reqHistoricalData(gld_contract, endDateTime='', durationStr='30 D', barSizeSetting='5 mins', whatToShow='ADJUSTED_LAST', useRTH=True)
 bars_gdx = ib.reqHistoricalData(gdx_contract, endDateTime='', durationStr='30 D', barSizeSetting='5 mins', whatToShow='ADJUSTED_LAST', useRTH=True)
 
-df_gld = util.df(bars_gld)[['date', 'close']].rename(columns={'close': 'Adj Close_GLD'})
-df_gdx = util.df(bars_gdx)[['date', 'close']].rename(columns={'close': 'Adj Close_GDX'})
+gld = bars_to_array(bars_gld)
+gdx = bars_to_array(bars_gdx)
+df_gld = pd.DataFrame({'date': gld['date'], 'Adj Close_GLD': gld['close']})
+df_gdx = pd.DataFrame({'date': gdx['date'], 'Adj Close_GDX': gdx['close']})
 df = pd.merge(df_gld, df_gdx, on='date', how='inner')
 df.set_index('date', inplace=True)
 df.sort_index(inplace=True)
@@ -9,6 +9,13 @@ from ib_insync import *
 import time
 # Import os to create directories for saving logs
 import os
+# Import sys to make the shared contract store in Scanners/uptrend importable
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'Scanners', 'uptrend'))
+# Import the shared contract store so qualification skips TWS once the contracts are cached
+from contract_cache import qualify_contracts
+# Import the bar conversion that skips building a DataFrame of the whole day for one bar
+from bar_arrays import bars_to_array
 
 # CONNECT TO INTERACTIVE BROKERS ********************************************************************************************************************
 # Initialize Interactive Brokers client instance for paper trading
@@ -21,9 +28,8 @@ ib.connect('127.0.0.1', 7497, clientId=1)
 gld_contract = Stock('GLD', 'SMART', 'USD')
 # Define GDX stock contract (VanEck Gold Miners ETF, traded in USD on SMART exchange)
 gdx_contract = Stock('GDX', 'SMART', 'USD')
-# Qualify contracts with IB to ensure valid definitions
-ib.qualifyContracts(gld_contract)
-ib.qualifyContracts(gdx_contract)
+# Qualify contracts with IB to ensure valid definitions (answered from the shared contract store when cached)
+gld_contract, gdx_contract = qualify_contracts(ib, [gld_contract, gdx_contract])
 
 # Set initial parameters (modifiable for optimization)
 # Hedge ratio from backtest (0.48), can be updated with real-time regression if desired
@@ -58,9 +64,11 @@ while True:
         bars_gld = ib.reqHistoricalData(gld_contract, endDateTime='', durationStr='1 D', barSizeSetting='1 min', whatToShow='ADJUSTED_LAST', useRTH=True)
         bars_gdx = ib.reqHistoricalData(gdx_contract, endDateTime='', durationStr='1 D', barSizeSetting='1 min', whatToShow='ADJUSTED_LAST', useRTH=True)
 
-        # Convert to DataFrame, keeping only latest bar
-        df_gld = util.df(bars_gld).tail(1)[['date', 'close']].rename(columns={'close': 'Adj Close_GLD'})
-        df_gdx = util.df(bars_gdx).tail(1)[['date', 'close']].rename(columns={'close': 'Adj Close_GDX'})
+        # Convert only the latest bar (not the whole day of 1-minute bars) to a one-row DataFrame
+        gld = bars_to_array(bars_gld[-1:])
+        gdx = bars_to_array(bars_gdx[-1:])
+        df_gld = pd.DataFrame({'date': gld['date'], 'Adj Close_GLD': gld['close']})
+        df_gdx = pd.DataFrame({'date': gdx['date'], 'Adj Close_GDX': gdx['close']})
         # Merge latest data
         latest_data = pd.merge(df_gld, df_gdx, on='date', how='inner')
         # Append to historical data
@@ -3,22 +3,25 @@ import os
 import glob
 
 # Debug: List files in the directory that contain "stocks"
-directory = r"C:\Users\jorge_388iox0\OneDrive\OneDrive\Trading\QuantitativeTrading\all_stocks"
+directory = os.path.dirname(os.path.abspath(__file__))
 files = glob.glob(os.path.join(directory, "*stocks*"))
 print("Files found in directory:", files)
 
-# Define file paths (update these based on the print output above)
-file_paths = [
-    r"C:\Users\jorge_388iox0\OneDrive\OneDrive\Trading\QuantitativeTrading\all_stocks\nasdaq-stocks-stocks.csv",
-    r"C:\Users\jorge_388iox0\OneDrive\OneDrive\Trading\QuantitativeTrading\all_stocks\nyse-stocks-stocks.csv",
-    r"C:\Users\jorge_388iox0\OneDrive\OneDrive\Trading\QuantitativeTrading\all_stocks\otc-stocks-stocks.csv"
-]
+# Define file paths with the listing exchange each file covers, as IB names it
+# (IB lists OTC Markets stocks under the PINK exchange)
+file_paths = {
+    os.path.join(directory, "nasdaq-stocks-stocks.csv"): "NASDAQ",
+    os.path.join(directory, "nyse-stocks-stocks.csv"): "NYSE",
+    os.path.join(directory, "otc-stocks-stocks.csv"): "PINK",
+}
 
 # Read and merge CSV files, assuming they have a 'Symbol' column
 dfs = []
-for file in file_paths:
+for file, exchange in file_paths.items():
     if os.path.exists(file):
         df = pd.read_csv(file)
+        # Remember which list the symbol came from
+        df['Exchange'] = exchange
         dfs.append(df)
         print(f"Loaded {file} with {len(df)} rows")
     else:
@@ -31,9 +34,45 @@ if dfs:
     merged_df = merged_df.drop_duplicates(subset=['Symbol'], keep='first')
 
     # Save merged list to a new CSV file
-    output_path = r"C:\Users\jorge_388iox0\OneDrive\OneDrive\Trading\QuantitativeTrading\all_stocks\merged_stocks.csv"
+    output_path = os.path.join(directory, "merged_stocks.csv")
     merged_df.to_csv(output_path, index=False)
 
     print(f"Merged stock list saved to {output_path} with {len(merged_df)} unique symbols")
+
+    # Typed columnar copy for the scanners: numbers stay floats, repeated strings are stored once as
+    # categories, and the file is uncompressed so it can be memory-mapped instead of parsed
+    universe_df = merged_df.reset_index(drop=True)
+    for column in ('Market Cap', 'Stock Price', 'Revenue'):
+        universe_df[column] = pd.to_numeric(universe_df[column], errors='coerce')
+    for column in ('Company Name', '% Change', 'Exchange'):
+        universe_df[column] = universe_df[column].astype('category')
+    universe_path = os.path.join(directory, "merged_stocks.feather")
+    universe_df.to_feather(universe_path, compression='uncompressed')
+
+    print(f"Universe file saved to {universe_path}")
+
+    # Dated snapshot of the universe (one per day, a rerun replaces it), so the scanners' caches can
+    # be invalidated for just the symbols that changed since the last merge (see universe_refresh.py)
+    snapshot_dir = os.path.join(directory, "snapshots")
+    os.makedirs(snapshot_dir, exist_ok=True)
+    snapshot_path = os.path.join(snapshot_dir, f"merged_stocks_{pd.Timestamp.today():%Y-%m-%d}.feather")
+    universe_df.to_feather(snapshot_path)
+
+    print(f"Universe snapshot saved to {snapshot_path}")
+
+    # Routing table for building IB contracts: IB writes share classes and units with a space
+    # instead of a dot (BRK.A -> 'BRK A'), and every symbol is routed SMART with its listing
+    # exchange as the primary exchange
+    routing_df = pd.DataFrame({
+        'Symbol': merged_df['Symbol'],
+        'IB Symbol': merged_df['Symbol'].astype(str).str.replace('.', ' ', regex=False),
+        'Exchange': merged_df['Exchange'],
+        'Sec Type': 'STK',
+        'Currency': 'USD',
+    })
+    routing_path = os.path.join(directory, "routing.csv")
+    routing_df.to_csv(routing_path, index=False)
+
+    print(f"Routing table saved to {routing_path}")
 else:
-    print("No files were loaded. Check the file paths.")
\ No newline at end of file
+    print("No files were loaded. Check the file paths.")
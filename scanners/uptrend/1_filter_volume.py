@@ -1,11 +1,24 @@
 # LIBRARIES ***************************************************************************************
 from ib_insync import *  # For connecting to Interactive Brokers TWS API
 import pandas as pd  # For handling the stock list and data manipulation
-import time  # For adding delays to respect IB API rate limits
-from tqdm import tqdm  # For progress bar tracking
+import os  # For locating the shared scanner modules
+import sys  # For adding the shared scanner modules to the import path
+
+# The shared scanner modules live in Scanners/uptrend (the same folder on Windows, a different one on
+# case-sensitive filesystems), so make sure they can be imported either way
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Scanners', 'uptrend'))
+from fetch_engine import fetch_histories, is_retryable  # For concurrent, pacing-aware bar downloads
+from bar_cache import BarCache  # For reusing bars downloaded on earlier runs
+from routing import make_routed_contract  # For exchange-aware contracts from the routing table
+from stage_table import read_stock_table, write_stage_table, filter_stored, bar_range  # For typed stage tables
+from prescreen import apply_prescreen, DEFAULT_PRESCREEN  # For the local fundamental pre-screen
+from market_scanner import scan_candidates, prefilter_universe  # For the server-side shortlist
+from checkpoint import ScanCheckpoint  # For resuming an interrupted scan
+from telemetry import Telemetry  # For run timings, request counters and IB error codes
+from universe import Universe, universe_path  # For the Feather universe and its symbol index
 
 # FUNCTION TO FILTER STOCKS BY AVERAGE VOLUME ******************************************************
-def filter_by_avg_volume(csv_file, min_avg_volume=2000000, days=20):
+def filter_by_avg_volume(csv_file, min_avg_volume=2000000, days=20, market_scanner=False, resume=False, prescreen=None):
     # docstring, explaining the function
     """
     Filter stocks from a CSV file based on average daily volume over a specified period.
@@ -13,86 +26,110 @@ def filter_by_avg_volume(csv_file, min_avg_volume=2000000, days=20):
         csv_file (str): Path to the CSV file with stock symbols
         min_avg_volume (int): Minimum average daily volume (default: 2M shares)
         days (int): Number of days to calculate average volume (default: 20)
+        market_scanner (bool): Only check the symbols IB's market scanners return for the volume
+            threshold instead of the whole stock list. A lossy fast path: the scanners rank by today's
+            volume and move with at most 50 rows per price band, so liquid stocks having a quiet
+            session can be missed (default: False)
+        resume (bool): Skip the symbols an interrupted run already checked today with the same
+            settings (default: False)
+        prescreen (list): (column, operator, value) predicates on the stock list columns, applied
+            before anything is requested from IB (default: none, see prescreen.DEFAULT_PRESCREEN)
     Returns:
         pd.DataFrame: Filtered DataFrame with stocks meeting the volume criterion
     """
-    # Read the CSV file containing stock symbols and store in a DataFrame
-    df = pd.read_csv(csv_file)
+    # Read the stock list (the original CSV or the table written by the previous stage)
+    df = read_stock_table(csv_file)
+    
+    # Drop stocks failing the local pre-screen before anything is sent to IB
+    if prescreen:
+        df = apply_prescreen(df, prescreen)
+    
+    # Filter on metrics stored by an earlier run today instead of asking IB again
+    stored = filter_stored(df, ['avg_volume'], lambda t: t['avg_volume'] >= min_avg_volume)
+    if stored is not None:
+        print("Using stored average volumes from today's stage table")
+        return stored
     
     # Initialize IB connection
     ib = IB()
+    # Timings, request counters and IB error codes, exported at the end of the run
+    telemetry = Telemetry('filter_by_avg_volume')
     try:
         # Connect to TWS or IB Gateway (update host/port/clientId as needed)
-        ib.connect('127.0.0.1', 7497, clientId=1)
+        with telemetry.phase('connect'):
+            ib.connect('127.0.0.1', 7497, clientId=1)
         
         # Suppress IB API error messages for invalid contracts
         ib.errorEvent += lambda reqId, errorCode, errorString, contract: None
         
-        # Initialize list for filtered stocks
-        filtered_stocks = []
+        # Count IB error codes and bytes received for the telemetry
+        telemetry.attach(ib)
+        
+        # Let IB's scanners shortlist liquid US stocks so only those need historical bars
+        if market_scanner:
+            with telemetry.phase('market_scanner'):
+                candidates = scan_candidates(ib, min_avg_volume=min_avg_volume)
+            df = prefilter_universe(df, candidates)
+            print(f"Market scanners shortlisted {len(df)} of {len(candidates)} candidates from the stock list")
         
-        # Get total symbols for progress tracking
-        total_symbols = len(df)
+        # Index the (shortlisted) stock list once instead of scanning it for every passing symbol
+        stocks = Universe(df)
         
-        # Loop through each stock symbol in the DataFrame with progress bar
-        for symbol in tqdm(df['Symbol'], total=total_symbols, desc="Scanning stocks"):
+        # Every checked symbol is written to the checkpoint right away, so a crash or a dropped
+        # connection only loses the symbols that were still in flight
+        checkpoint = ScanCheckpoint('filter_by_avg_volume', resume=resume, params={
+            'csv_file': csv_file, 'min_avg_volume': min_avg_volume, 'days': days, 'market_scanner': market_scanner})
+        if len(checkpoint):
+            print(f"Resuming: {len(checkpoint)} symbols already checked today")
+        
+        # Check one symbol's downloaded bars as soon as the fetch engine has them
+        def check_symbol(result):
+            symbol = result.symbol
             try:
-                # Create a Stock contract for the symbol (NYSE, USD, common stock)
-                contract = Stock(symbol, 'NYSE', 'USD', primaryExchange='NYSE')
+                # Skip symbols whose contract was invalid or returned no data
+                if result.error:
+                    print(f"✗ {symbol}: {result.error}")
+                    # Dropped connections and other exceptions are retried on the next run
+                    if not is_retryable(result):
+                        checkpoint.record(symbol, {'passed': False, 'error': result.error})
+                    return
+                
+                # DataFrame of the bars (built by the fetch engine from bar_arrays, in util.df format)
+                hist_data = result.hist_data
                 
-                # Qualify the contract to resolve ambiguities
-                qualified_contracts = ib.qualifyContracts(contract)
+                # Calculate average volume over the period
+                with telemetry.timed('evaluate', symbol):
+                    avg_volume = hist_data['volume'].mean()
+                
+                # Check if average volume exceeds the threshold
+                passed = bool(avg_volume >= min_avg_volume)
+                if passed:
+                    print(f"✓ {symbol}: Avg vol {avg_volume:,.0f} (passed)")
+                checkpoint.record(symbol, {'passed': passed, 'avg_volume': float(avg_volume), **bar_range(hist_data)})
                 
-                # Check if a valid contract was found
-                if qualified_contracts:
-                    contract = qualified_contracts[0]  # Use the first valid contract
-                    
-                    # Request historical data (20 days, daily bars, regular trading hours)
-                    bars = ib.reqHistoricalData(
-                        contract,
-                        endDateTime='',
-                        durationStr=f'{days} D',
-                        barSizeSetting='1 day',
-                        whatToShow='TRADES',    # 'TRADES' — Trade data (price/volume of trades, most common for stocks)
-                                                # 'MIDPOINT' — Midpoint between bid and ask
-                                                # 'BID' — Bid prices only
-                                                # 'ASK' — Ask prices only
-                                                # 'BID_ASK' — Both bid and ask prices
-                                                # 'HISTORICAL_VOLATILITY' — Historical volatility
-                                                # 'OPTION_IMPLIED_VOLATILITY' — Option implied volatility
-                                                # 'YIELD_BID', 'YIELD_ASK', 'YIELD_BID_ASK', 'YIELD_LAST' — For bonds
-                        useRTH=True, # regular trading hours
-                        formatDate=1,       # Controls the date format in the returned data (1 = 
-                                            # human-readable, 2 = UNIX timestamp).
-                        keepUpToDate=False  # If True, keeps streaming new data as it comes in; if False, 
-                                            # just gets a snapshot.
-                    )
-                    
-                    # Check if data was returned
-                    if bars:
-                        # a helper function from the ib_insync library that converts this list of bar objects 
-                        # into a pandas DataFrame.
-                        hist_data = util.df(bars)
-                        
-                        # Calculate average volume over the period
-                        avg_volume = hist_data['volume'].mean()
-                        
-                        # Check if average volume exceeds the threshold
-                        if avg_volume >= min_avg_volume:
-                            # Add symbol to filtered list (preserve other columns if they exist)
-                            stock_data = df[df['Symbol'] == symbol].to_dict('records')[0]
-                            filtered_stocks.append(stock_data)
-                            print(f"✓ {symbol}: Avg vol {avg_volume:,.0f} (passed)")
-                    else:
-                        print(f"✗ {symbol}: No data returned")
-                else:
-                    print(f"✗ {symbol}: Invalid contract")
-                    
             except Exception as e:
                 print(f"✗ {symbol}: Error - {str(e)[:50]}...")
-            
-            # Reduced delay for speed (0.2s = ~5 req/s, safe under limits)
-            time.sleep(0.2)
+        
+        # Download bars for the symbols not checked yet, keeping many requests in flight
+        # (replaces the serial qualify -> request -> sleep loop)
+        try:
+            fetch_histories(ib, checkpoint.pending(df['Symbol']), days, make_contract=make_routed_contract,
+                            cache=BarCache(), on_result=check_symbol, telemetry=telemetry,
+                            desc="Scanning stocks")
+        finally:
+            checkpoint.close()
+        
+        # Initialize list for filtered stocks
+        filtered_stocks = []
+        
+        # Collect the passing symbols from this run and the resumed one, in stock list order
+        for symbol in df['Symbol']:
+            result = checkpoint.results.get(symbol)
+            if result and result['passed']:
+                # Add symbol to filtered list (preserve other columns if they exist)
+                stock_data = stocks.row(symbol)
+                stock_data.update({name: value for name, value in result.items() if name != 'passed'})
+                filtered_stocks.append(stock_data)
         
         # Convert filtered stocks to DataFrame
         filtered_df = pd.DataFrame(filtered_stocks)
@@ -104,16 +141,19 @@ def filter_by_avg_volume(csv_file, min_avg_volume=2000000, days=20):
         return pd.DataFrame()
     
     finally:
-        # Disconnect from IB to clean up
+        # Save the run's telemetry, then disconnect from IB to clean up
+        telemetry.detach(ib)
+        telemetry.write()
         ib.disconnect()
 
 # MAIN SCRIPT ************************************************************************************
 if __name__ == "__main__":
-    # Path to the input CSV file (fixed extension)
-    csv_file = r'C:\Users\jorge_388iox0\OneDrive\OneDrive\Trading\QuantitativeTrading\all_stocks\merged_stocks.csv'  # Update with your actual path
+    # Stock list written by all_stocks/merge.py (merged_stocks.feather, or the CSV if there is no Feather file)
+    csv_file = universe_path()
     
-    # Filter stocks by average volume (> 2M over 20 days)
-    filtered_stocks = filter_by_avg_volume(csv_file, min_avg_volume=2000000, days=20)
+    # Filter stocks by average volume (> 2M over 20 days), after dropping small and penny stocks locally
+    filtered_stocks = filter_by_avg_volume(csv_file, min_avg_volume=2000000, days=20, resume=True,
+                                           prescreen=DEFAULT_PRESCREEN)
     
     # Check if the filtered DataFrame is not empty
     if not filtered_stocks.empty:
@@ -128,5 +168,8 @@ if __name__ == "__main__":
         
         # Confirm the file was saved
         print("Saved to 'nyse_high_volume_stocks.csv'")
+        
+        # Save the average volumes and bar range with the stocks as a typed table for the next stage
+        write_stage_table(filtered_stocks, 'nyse_high_volume_stocks.parquet')
     else:
         print("No stocks met the average volume criterion or an error occurred.")
\ No newline at end of file